@@ -0,0 +1,142 @@
+"""Convert a synthetic library with a job server and several worker processes on localhost.
+
+One worker is stopped while it converts a video, so its job is given back to
+the server and converted by another worker. The exit code is 1 if a video was
+not converted or a process did not exit.
+
+Usage::
+
+    python benchmarks/bench_distributed.py [--files 12] [--workers 3] [--duration 10]
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fixtures import make_library  # noqa: E402
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CLI = ['-c', 'import sys; from convert_mp4.cli import main; sys.exit(main(sys.argv[1:]))']
+
+
+class Process:
+
+    def __init__(self, args: list[str], env: dict, on_event=None) -> None:
+        """Run convert-mp4 in a subprocess and collect the JSON-line events that it writes."""
+        super(Process, self).__init__()
+        self.events = []
+        self.on_event = on_event or (lambda process, event: None)
+        self.process = subprocess.Popen([sys.executable, *CLI, *args], env=env, text=True,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self) -> None:
+        for line in self.process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self.events.append(event)
+            self.on_event(self, event)
+
+    def wait_for(self, name: str, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            for event in self.events:
+                if event['event'] == name:
+                    return event
+            if time.monotonic() > deadline or (self.process.poll() is not None and not self.reader.is_alive()):
+                return {}
+            time.sleep(0.05)
+
+    def count(self, name: str) -> int:
+        return sum(1 for event in self.events if event['event'] == name)
+
+    def stop(self) -> None:
+        if self.process.poll() is None:
+            self.process.terminate()
+
+    def join(self, timeout: float):
+        try:
+            code = self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            code = None
+        self.reader.join(5)
+        return code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=12, help='number of videos in the library')
+    parser.add_argument('--workers', type=int, default=3, help='number of worker processes')
+    parser.add_argument('--duration', type=float, default=10, help='duration of each video [seconds]')
+    parser.add_argument('--timeout', type=float, default=600, help='the maximum time to wait [seconds]')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='convert-mp4-bench-')
+    try:
+        library_dir = os.path.join(directory, 'library')
+        library = make_library(library_dir, args.files, duration=args.duration)
+        config = os.path.join(directory, 'config.json')
+        with open(config, 'w') as fp:
+            json.dump({
+                'server_token': secrets.token_hex(16),
+                'lease_ttl': 5,
+                'heartbeat_interval': 0.5,
+                'server_poll': 0.5,
+                'cost_calibrate': False,
+                'duplicates': 'convert',  # the library contains copies, convert them all
+            }, fp)
+        env = dict(os.environ, PYTHONPATH=ROOT, CONVERT_MP4_CACHE_DIR=os.path.join(directory, 'cache'))
+
+        t0 = time.perf_counter()
+        server = Process([config, '--batch', library_dir, '--serve', '0'], env)
+        port = server.wait_for('serve', 60).get('port')
+        if port is None:
+            server.stop()
+            server.join(10)
+            sys.exit('the job server did not start')
+
+        def stop_first(process: Process, event: dict) -> None:
+            if event['event'] == 'convert':
+                process.stop()
+
+        url = f'http://127.0.0.1:{port}'
+        workers = [Process(['worker', url, config, '--jobs', '1', '--name', f'worker-{i}'], env,
+                           on_event=stop_first if i == 0 else None)
+                   for i in range(args.workers)]
+
+        server_code = server.join(args.timeout)
+        elapsed = time.perf_counter() - t0
+        worker_codes = [worker.join(30) for worker in workers]
+
+        finish = server.wait_for('finish', 0)
+        done = finish.get('done', 0) + finish.get('skipped', 0)
+        print(f'videos:    {len(library)}')
+        print(f'converted: {done} ({finish.get("failed", 0)} failed) in {elapsed:.2f} s, '
+              f'{60 * done / elapsed:.1f} videos/min')
+        print(f'requeued:  {server.count("requeue")}')
+        for i, (worker, code) in enumerate(zip(workers, worker_codes)):
+            print(f'worker-{i}:  {worker.count("done")} done, {worker.count("aborted")} given back, exit code {code}')
+        print(f'server exit code {server_code}')
+
+        ok = server_code == 0 and None not in worker_codes and done == len(library) and \
+            (args.workers < 2 or server.count('requeue') > 0)
+        print('OK' if ok else 'FAILED')
+        return 0 if ok else 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Compare the cold-scan time per file of the legacy two-ffprobe approach
+with the single-pass probe.
+
+Usage::
+
+    python benchmarks/bench_probe.py [--files 20] [--duration 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from convert_mp4.probe import ffprobe  # noqa: E402
+from convert_mp4.probe import subtitle_streams  # noqa: E402
+
+from fixtures import make_movie  # noqa: E402
+
+
+def legacy_probe(path: str) -> tuple:
+    out = subprocess.check_output([
+        'ffprobe', '-v', 'error', '-select_streams', 's',
+        '-show_entries', 'stream=index:stream=codec_name:stream_tags=language',
+        '-of', 'csv=p=0', path
+    ])
+    metadata = json.loads(subprocess.check_output([
+        'ffprobe', '-v', 'error', '-of', 'json',
+        '-show_entries', 'stream:format', path
+    ]))
+    return out, metadata
+
+
+def single_probe(path: str) -> tuple:
+    metadata = ffprobe(path)
+    return subtitle_streams(metadata), metadata
+
+
+def bench(function, paths: list[str]) -> float:
+    t0 = time.perf_counter()
+    for path in paths:
+        function(path)
+    return (time.perf_counter() - t0) / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=20, help='number of files to probe')
+    parser.add_argument('--duration', type=float, default=5, help='duration of each file [seconds]')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='convert-mp4-bench-')
+    try:
+        make_movie(os.path.join(directory, 'movie.mkv'), duration=args.duration)
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(directory, f'movie{i}.mkv')
+            shutil.copyfile(os.path.join(directory, 'movie.mkv'), path)
+            paths.append(path)
+
+        before = bench(legacy_probe, paths)
+        after = bench(single_probe, paths)
+        print(f'files:  {len(paths)}')
+        print(f'before: {before * 1e3:.1f} ms/file (2 x ffprobe)')
+        print(f'after:  {after * 1e3:.1f} ms/file (1 x ffprobe)')
+        print(f'speed-up: {before / after:.2f}x')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
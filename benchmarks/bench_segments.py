@@ -0,0 +1,72 @@
+"""Compare a single-pass HEVC to H.264 transcode with a segment-parallel transcode.
+
+The segmented output must match the single-pass output in duration and
+stream layout, otherwise the exit code is 1.
+
+Usage::
+
+    python benchmarks/bench_segments.py [--duration 60] [--segments 4]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from convert_mp4.conversion import Conversion  # noqa: E402
+from convert_mp4.movie import Movie  # noqa: E402
+from convert_mp4.probe import ffprobe  # noqa: E402
+
+from fixtures import make_movie  # noqa: E402
+
+
+def layout(path: str) -> tuple:
+    metadata = ffprobe(path)
+    streams = tuple((s['codec_type'], s['codec_name']) for s in metadata['streams'])
+    return float(metadata['format']['duration']), streams
+
+
+def convert(path: str, config: dict) -> float:
+    conversion = Conversion(Movie(path), config=config)
+    t0 = time.perf_counter()
+    status = conversion.run(error=print)
+    elapsed = time.perf_counter() - t0
+    if status != 'done':
+        sys.exit(f'{path}: conversion {status}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=60, help='duration of the video [seconds]')
+    parser.add_argument('--segments', type=int, default=4, help='number of segments')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='convert-mp4-bench-')
+    try:
+        single = os.path.join(directory, 'single.mkv')
+        segmented = os.path.join(directory, 'segmented.mkv')
+        make_movie(single, duration=args.duration, video='hevc', subtitle='none', size='640x360')
+        shutil.copyfile(single, segmented)
+
+        t_single = convert(single, {})
+        t_segmented = convert(segmented, {'segments': args.segments, 'segment_min_duration': 0})
+
+        d_single, s_single = layout(os.path.join(directory, 'single.mp4'))
+        d_segmented, s_segmented = layout(os.path.join(directory, 'segmented.mp4'))
+        print(f'single pass: {t_single:.2f} s, duration {d_single:.3f} s, streams {s_single}')
+        print(f'segmented:   {t_segmented:.2f} s, duration {d_segmented:.3f} s, streams {s_segmented}')
+        print(f'speed-up: {t_single / t_segmented:.2f}x')
+
+        ok = s_single == s_segmented and abs(d_single - d_segmented) <= 0.1
+        print('outputs match' if ok else 'outputs DO NOT match')
+        return 0 if ok else 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
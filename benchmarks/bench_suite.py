@@ -0,0 +1,228 @@
+"""Benchmark scanning, probing, subtitle loading and converting a synthetic library.
+
+The results are written to a JSON file that can be compared with a previous run.
+
+Usage::
+
+    python benchmarks/bench_suite.py [--files 24] [--duration 10] [--output results.json] [--compare previous.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from convert_mp4 import EXTENSIONS  # noqa: E402
+from convert_mp4 import ffmpeg_version  # noqa: E402
+from convert_mp4 import subtitles  # noqa: E402
+from convert_mp4.cache import ProbeCache  # noqa: E402
+from convert_mp4.conversion import Conversion  # noqa: E402
+from convert_mp4.movie import Movie  # noqa: E402
+from convert_mp4.scanner import Scanner  # noqa: E402
+from convert_mp4.scanner import extensions_regex  # noqa: E402
+from convert_mp4.sidecars import SidecarIndex  # noqa: E402
+
+from fixtures import make_library  # noqa: E402
+from fixtures import make_movie  # noqa: E402
+
+
+def timed(function, *args, **kwargs) -> float:
+    t0 = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def summary(name: str, seconds: list[float]) -> dict:
+    return {
+        f'{name}.mean_ms': 1e3 * statistics.mean(seconds),
+        f'{name}.median_ms': 1e3 * statistics.median(seconds),
+        f'{name}.max_ms': 1e3 * max(seconds),
+    }
+
+
+def bench_scan_gui(root: str, count: int) -> dict:
+    """VideoConverter.scan + ProbePool (requires Qt, runs offscreen)."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from msl.qt import application
+        from convert_mp4.gui import VideoConverter
+    except ImportError:
+        return {}
+
+    app = application()
+    main = VideoConverter({'probe_cache': False})
+    t0 = time.perf_counter()
+    main.scan([root])
+    deadline = t0 + 600
+
+    def probed():
+        return sum(1 for row in main.model.rows if row.movie is not None or row.error)
+
+    while probed() < count and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - t0
+    rows = probed()
+    main.close()
+    return {
+        'scan_gui.files': rows,
+        'scan_gui.seconds': elapsed,
+        'scan_gui.files_per_second': rows / elapsed,
+    }
+
+
+def bench_scan(root: str, cache: ProbeCache, name: str) -> dict:
+    """The Qt-free scan that the batch CLI uses."""
+    def load(path):
+        movie = Movie(path, cache=cache, sidecars=sidecars)
+        movie.attach_sidecars()
+        return movie
+
+    t0 = time.perf_counter()
+    sidecars = SidecarIndex()
+    paths = list(Scanner(extensions_regex(EXTENSIONS), sidecars=sidecars).scan([root]))
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        movies = list(executor.map(load, paths))
+    elapsed = time.perf_counter() - t0
+    return {
+        f'{name}.files': len(movies),
+        f'{name}.seconds': elapsed,
+        f'{name}.files_per_second': len(movies) / elapsed,
+    }
+
+
+def bench_movie(library: list[dict], cache: ProbeCache) -> dict:
+    sidecars = SidecarIndex()
+    cold = [timed(Movie, item['path'], sidecars=sidecars) for item in library]
+    for item in library:
+        Movie(item['path'], cache=cache, sidecars=sidecars)
+    warm = [timed(Movie, item['path'], cache=cache, sidecars=sidecars) for item in library]
+    return {**summary('movie_cold', cold), **summary('movie_warm', warm)}
+
+
+def bench_subtitles(library: list[dict]) -> dict:
+    results = {}
+    sidecars = SidecarIndex()
+    for kind in ('embedded', 'sidecar'):
+        cold, warm = [], []
+        for item in library:
+            if item['subtitle'] != kind:
+                continue
+            movie = Movie(item['path'], sidecars=sidecars)
+            movie.attach_sidecars()
+            info = next(iter(movie.subtitles.values()))
+            subtitles.cache = subtitles.LRUCache()
+            cold.append(timed(movie.load_subtitle, info))
+            warm.append(timed(movie.load_subtitle, info))
+        if cold:
+            results.update(summary(f'load_subtitle_{kind}_cold', cold))
+            results.update(summary(f'load_subtitle_{kind}_cached', warm))
+    return results
+
+
+def bench_convert(directory: str, duration: float) -> dict:
+    """End-to-end conversion of a remux (copy) and a transcode (HEVC to H.264)."""
+    results = {}
+    for name, video in (('convert_copy', 'h264'), ('convert_transcode', 'hevc')):
+        path = make_movie(os.path.join(directory, f'{name}.mkv'), duration=duration,
+                          video=video, audio='aac', subtitle='none', size='1280x720')
+        conversion = Conversion(Movie(path))
+        if os.path.isfile(conversion.outfile):
+            os.remove(conversion.outfile)
+        last = []
+        elapsed = timed(conversion.run, stats=last.append)
+        frames = duration * 25
+        results[f'{name}.kind'] = conversion.kind()
+        results[f'{name}.seconds'] = elapsed
+        results[f'{name}.fps'] = frames / elapsed
+        results[f'{name}.speed'] = duration / elapsed
+        if last:
+            results[f'{name}.ffmpeg_fps'] = last[-1].fps
+    return results
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f'{"metric":45s} {"previous":>12s} {"current":>12s} {"ratio":>8s}')
+    for key, value in current['results'].items():
+        old = previous['results'].get(key)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+            continue
+        ratio = value / old if old else float('nan')
+        print(f'{key:45s} {old:12.3f} {value:12.3f} {ratio:8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=24, help='number of videos in the library')
+    parser.add_argument('--duration', type=float, default=10, help='duration of each video [seconds]')
+    parser.add_argument('--output', default='bench_results.json', help='the JSON file to write the results to')
+    parser.add_argument('--compare', help='a JSON file from a previous run to compare with')
+    parser.add_argument('--keep', help='create (or reuse) the library in this folder instead of a temporary folder')
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix='convert-mp4-bench-')
+    # the journal, fingerprint index and cost model of the GUI must not use the real cache folder
+    os.environ['CONVERT_MP4_CACHE_DIR'] = os.path.join(directory, 'cache')
+    try:
+        library_dir = os.path.join(directory, 'library')
+        manifest = os.path.join(directory, 'library.json')
+        if args.keep and os.path.isfile(manifest):
+            with open(manifest) as fp:
+                library = json.load(fp)
+        else:
+            library = make_library(library_dir, args.files, duration=args.duration)
+            with open(manifest, 'w') as fp:
+                json.dump(library, fp)
+
+        cache = ProbeCache(os.path.join(directory, 'probe.sqlite3'))
+        cache.invalidate()
+
+        results = {}
+        results.update(bench_scan_gui(library_dir, len(library)))
+        results.update(bench_scan(library_dir, None, 'scan_cold'))
+        bench_scan(library_dir, cache, 'scan_warm')  # populate the cache
+        results.update(bench_scan(library_dir, cache, 'scan_warm'))
+        results.update(bench_movie(library, cache))
+        results.update(bench_subtitles(library))
+        convert_dir = os.path.join(directory, 'convert')
+        os.makedirs(convert_dir, exist_ok=True)
+        results.update(bench_convert(convert_dir, args.duration))
+        cache.close()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'ffmpeg': ffmpeg_version(),
+                'files': len(library),
+                'duration': args.duration,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+        for key, value in results.items():
+            print(f'{key:45s} {value:.3f}' if isinstance(value, float) else f'{key:45s} {value}')
+        print(f'results written to {args.output}')
+
+        if args.compare:
+            with open(args.compare) as fp:
+                compare(json.load(fp), report)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
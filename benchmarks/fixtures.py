@@ -0,0 +1,85 @@
+"""Generate synthetic video libraries with the ffmpeg testsrc and sine sources."""
+import itertools
+import os
+import shutil
+import subprocess
+
+VIDEO_CODECS = {'h264': 'libx264', 'hevc': 'libx265'}
+AUDIO_CODECS = {'aac': 'aac', 'mp3': 'libmp3lame'}
+SUBTITLES = ('embedded', 'sidecar', 'none')
+
+SRT = """1
+00:00:00,000 --> 00:00:01,000
+Hello
+
+2
+00:00:01,000 --> 00:00:02,000
+World
+"""
+
+
+def write_srt(path: str) -> str:
+    with open(path, 'w') as fp:
+        fp.write(SRT)
+    return path
+
+
+def make_movie(path: str,
+               duration: float = 5,
+               video: str = 'h264',
+               audio: str = 'aac',
+               subtitle: str = 'embedded',
+               size: str = '320x240',
+               rate: int = 25) -> str:
+    """Create a Matroska file from lavfi sources.
+
+    The `subtitle` is either embedded (an English SRT stream), a sidecar
+    file (same name as the video, with a .srt extension) or none.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-y',
+           '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size={size}:rate={rate}',
+           '-f', 'lavfi', '-i', f'sine=duration={duration}']
+    srt = os.path.splitext(path)[0] + '.srt'
+    if subtitle in ('embedded', 'sidecar'):
+        write_srt(srt)
+    if subtitle == 'embedded':
+        cmd.extend(['-i', srt, '-map', '0', '-map', '1', '-map', '2',
+                    '-c:s', 'srt', '-metadata:s:s:0', 'language=eng'])
+    cmd.extend(['-c:v', VIDEO_CODECS[video], '-preset', 'ultrafast', '-g', str(2 * rate)])
+    if video == 'hevc':
+        cmd.extend(['-x265-params', 'log-level=error'])
+    cmd.extend(['-c:a', AUDIO_CODECS[audio], path])
+    subprocess.run(cmd, check=True)
+    if subtitle == 'embedded':
+        os.remove(srt)
+    return path
+
+
+def variants() -> list[dict]:
+    """Returns every combination of video codec, audio codec and subtitle."""
+    return [dict(video=v, audio=a, subtitle=s)
+            for v, a, s in itertools.product(VIDEO_CODECS, AUDIO_CODECS, SUBTITLES)]
+
+
+def make_library(directory: str, count: int, duration: float = 5) -> list[dict]:
+    """Create a library of `count` videos that cycles through all :func:`variants`.
+
+    One file is encoded per variant, the others are copies (so that creating
+    a large library is fast). Returns the path and the variant of each video.
+    """
+    os.makedirs(directory, exist_ok=True)
+    originals = {}
+    library = []
+    for i, variant in zip(range(count), itertools.cycle(variants())):
+        key = tuple(variant.values())
+        folder = os.path.join(directory, f'Show {i // 10:03d}')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'Episode {i:05d} {"-".join(key)}.mkv')
+        if key not in originals:
+            originals[key] = make_movie(path, duration=duration, **variant)
+        else:
+            shutil.copyfile(originals[key], path)
+            if variant['subtitle'] == 'sidecar':
+                write_srt(os.path.splitext(path)[0] + '.srt')
+        library.append(dict(path=path, **variant))
+    return library
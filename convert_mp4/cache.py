@@ -0,0 +1,106 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+def cache_dir() -> str:
+    """Return the per-user cache directory for convert-mp4.
+
+    The ``CONVERT_MP4_CACHE_DIR`` environment variable overrides it.
+    """
+    path = os.environ.get('CONVERT_MP4_CACHE_DIR')
+    if not path:
+        if sys.platform == 'win32':
+            root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        elif sys.platform == 'darwin':
+            root = os.path.expanduser('~/Library/Caches')
+        else:
+            root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        path = os.path.join(root, 'convert-mp4')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ProbeCache:
+
+    def __init__(self, path: str = None, max_entries: int = 50000) -> None:
+        """An on-disk cache of ffprobe results.
+
+        Entries are keyed by the path of the video file and are only valid
+        while the size and the modification time of the file are unchanged.
+        When there are more than `max_entries` rows, the least-recently
+        used rows are evicted.
+        """
+        super(ProbeCache, self).__init__()
+        if path is None:
+            path = os.path.join(cache_dir(), 'probe.sqlite3')
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS probe ('
+                'path TEXT PRIMARY KEY, '
+                'size INTEGER NOT NULL, '
+                'mtime INTEGER NOT NULL, '
+                'metadata TEXT NOT NULL, '
+                'subtitles TEXT NOT NULL, '
+                'accessed REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS probe_accessed ON probe (accessed)'
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM probe').fetchone()[0]
+
+    def get(self, path: str, stat: os.stat_result):
+        """Returns the cached (metadata, subtitle streams) or :data:`None`."""
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT size, mtime, metadata, subtitles FROM probe WHERE path=?', (path,)
+            ).fetchone()
+            if row is None:
+                return
+            size, mtime, metadata, subtitles = row
+            if size != stat.st_size or mtime != stat.st_mtime_ns:
+                self.connection.execute('DELETE FROM probe WHERE path=?', (path,))
+                return
+            self.connection.execute(
+                'UPDATE probe SET accessed=? WHERE path=?', (time.time(), path)
+            )
+        return json.loads(metadata), json.loads(subtitles)
+
+    def put(self, path: str, stat: os.stat_result, metadata: dict, subtitles: list) -> None:
+        """Insert (or replace) the probe results for a video file."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, json.dumps(metadata),
+                 json.dumps(subtitles), time.time())
+            )
+            excess = self.connection.execute(
+                'SELECT COUNT(*) FROM probe'
+            ).fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    'DELETE FROM probe WHERE path IN '
+                    '(SELECT path FROM probe ORDER BY accessed LIMIT ?)', (excess,)
+                )
+
+    def invalidate(self, path: str = None) -> None:
+        """Remove a cached entry, or all entries if `path` is not specified."""
+        with self.lock, self.connection:
+            if path is None:
+                self.connection.execute('DELETE FROM probe')
+            else:
+                self.connection.execute('DELETE FROM probe WHERE path=?', (path,))
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
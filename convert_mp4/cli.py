@@ -0,0 +1,861 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Iterable
+from typing import TextIO
+
+from . import EXTENSIONS
+from . import PROBE_CACHE_SIZE
+from . import __version__
+from . import ffmpeg_version
+
+
+def load_config(path: str = None) -> dict:
+    if not path:
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+class JsonLines:
+
+    def __init__(self, stream: TextIO = None) -> None:
+        """Write events to a stream as JSON lines (thread safe)."""
+        super(JsonLines, self).__init__()
+        self.stream = sys.stdout if stream is None else stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event: str, **kwargs) -> None:
+        line = json.dumps({'event': event, **kwargs})
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class Session:
+
+    def __init__(self,
+                 config: dict,
+                 jobs: int = None,
+                 subs: str = 'auto',
+                 burn: bool = None,
+                 emit: JsonLines = None) -> None:
+        """The state that the :func:`batch`, :func:`watch` and :func:`worker` modes share.
+
+        Call :meth:`open` before probing or converting videos and :meth:`close`
+        at the end. If `jobs` is specified, it caps the number of concurrent
+        conversions of each kind, otherwise the limits are from the
+        configuration. See :func:`batch` for `subs` and `burn`.
+        """
+        from .scheduler import DeviceLimiter
+        from .scheduler import concurrency
+        from .sidecars import SidecarIndex
+
+        super(Session, self).__init__()
+        self.config = config
+        self.subs = subs
+        self.burn = config.get('burn_subtitles', False) if burn is None else burn
+        self.emit = JsonLines() if emit is None else emit
+        self.limits = concurrency(config)
+        if jobs:
+            self.limits = {kind: min(value, jobs) for kind, value in self.limits.items()}
+        self.devices = DeviceLimiter(config.get('device_concurrency', 0))
+        self.sidecars = SidecarIndex()
+        self.event_stop = threading.Event()
+        self.version = None
+        self.cache = None
+        self.telemetry = None
+        self.journal = None
+        self.index = None
+        self.costs = None
+
+    def open(self, journal: bool = True, learn: bool = True) -> bool:
+        """Check that ffmpeg is available and open the caches.
+
+        Returns whether ffmpeg is available, an ``error`` event is emitted if
+        it is not. See :meth:`open_caches` for `journal` and `learn`.
+        """
+        try:
+            self.version = ffmpeg_version()
+        except RuntimeError as e:
+            self.emit('error', message=str(e))
+            return False
+        if self.version is None:
+            self.emit('error', message='ffmpeg not found')
+            return False
+        self.open_caches(journal=journal, learn=learn)
+        return True
+
+    def open_caches(self, journal: bool = True, learn: bool = True) -> None:
+        """Open the caches (the GUI checks for ffmpeg itself).
+
+        The journal is only opened if `journal` is true, and the cost model
+        and the telemetry files only if `learn` is true (a worker leaves them
+        to the job server).
+        """
+        from .cache import ProbeCache
+        from .costs import CostModel
+        from .fingerprint import FingerprintIndex
+        from .journal import Journal
+        from .telemetry import Telemetry
+
+        config = self.config
+        if config.get('probe_cache', True):
+            self.cache = ProbeCache(max_entries=config.get('probe_cache_size', PROBE_CACHE_SIZE))
+        if learn:
+            self.telemetry = Telemetry(config.get('telemetry_log'), config.get('metrics_textfile'))
+            self.costs = CostModel()
+        else:
+            self.telemetry = Telemetry()
+        if journal and config.get('journal', True):
+            self.journal = Journal()
+        if config.get('fingerprint_index', True):
+            self.index = FingerprintIndex()
+
+    def probe(self,
+              path: str,
+              subtitle: dict = None,
+              error: Callable[[str], None] = None,
+              ready: Callable = None):
+        """Probe a video, returns the :class:`~convert_mp4.movie.Movie` or :data:`None` if it cannot be probed.
+
+        The `subtitle` is the one that was selected (e.g., in the journal or
+        by the job server), otherwise an English subtitle is chosen if `subs`
+        is ``'auto'``, once the subtitle files of the movie have been attached.
+        Then `ready` is called with the movie, by the calling thread unless a
+        :class:`~convert_mp4.scanner.Scanner` is still indexing the folder of
+        the movie (see :meth:`~convert_mp4.movie.Movie.attach_sidecars`).
+        The `error` callback receives why the video cannot be probed, an
+        ``error`` event is emitted by default.
+        """
+        from .movie import Movie
+        from .probe import probe_error
+
+        t0 = time.perf_counter()
+        try:
+            movie = Movie(path, cache=self.cache, sidecars=self.sidecars,
+                          timeout=self.config.get('probe_timeout', 60))
+        except Exception as e:
+            message = probe_error(e)
+            self.telemetry.record('probe', path=path, status='failed', wall=time.perf_counter() - t0,
+                                  cached=False, error=message)
+            if error is None:
+                self.emit('error', path=path, message=f'cannot probe: {message}')
+            else:
+                error(f'cannot probe: {message}')
+            return None
+        self.telemetry.record('probe', path=path, status='done', wall=movie.probe_time, cached=movie.probe_cached)
+        if self.index is not None:
+            try:
+                self.index.fingerprint(path)  # read while probing, so conversion() only looks it up
+            except OSError:
+                pass
+
+        def attached(m) -> None:
+            if subtitle is not None:
+                m.subtitle = subtitle
+            elif self.subs == 'auto':
+                auto = m.auto_subtitle()
+                if auto:
+                    m.subtitle = dict(auto, burn=self.burn)
+            if ready is not None:
+                ready(m)
+
+        movie.attach_sidecars(attached)
+        return movie
+
+    def probe_pool(self, load: Callable, callback: Callable):
+        """Returns a :class:`~convert_mp4.probe.ProbePool` that is limited by ``probe_concurrency`` and ``probe_queue_size``."""
+        from .probe import ProbePool
+
+        return ProbePool(load, callback,
+                         per_device=self.config.get('probe_concurrency', 2),
+                         max_queued=self.config.get('probe_queue_size', 256))
+
+    def conversion(self, movie, calibrate: bool = True, **kwargs):
+        """Returns the :class:`~convert_mp4.conversion.Conversion` of a movie, with its predicted time.
+
+        If `calibrate` is true, a sample of the video may be encoded first
+        (see ``cost_calibrate``). The movie is fingerprinted (if there is an
+        index) by the calling thread, unless :meth:`probe` already did. The
+        keyword arguments are passed to the
+        :class:`~convert_mp4.conversion.Conversion`.
+        """
+        from .conversion import Conversion
+
+        conversion = Conversion(movie, self.event_stop, self.config,
+                                journal=self.journal, index=self.index, **kwargs)
+        conversion.content_key()
+        if self.costs is not None:
+            plan = conversion.plan()
+            if calibrate and self.config.get('cost_calibrate', True):
+                self.costs.calibrate_once(plan, seconds=self.config.get('cost_sample_seconds', 5))
+            conversion.predicted = self.costs.predict(plan)
+        return conversion
+
+    def convert(self, conversion, stats: Callable = None, **kwargs) -> str:
+        """Run a conversion and emit its ``convert`` (with the keyword arguments), ``error`` and status events.
+
+        The `stats` callback receives the :class:`~convert_mp4.progress.Progress`.
+        Returns the status of the conversion.
+        """
+        path = conversion.movie.path
+
+        def error(message: str) -> None:
+            self.emit('error', path=path, message=message)
+
+        self.emit('convert', path=path, output=conversion.outfile, kind=conversion.kind(), **kwargs)
+        status = conversion.run(error=error, stats=stats)
+        self.learn(conversion)
+        self.emit(status, path=path, output=conversion.outfile, metrics=conversion.metrics)
+        return status
+
+    def learn(self, conversion) -> None:
+        """Record the metrics of a conversion that finished (here or on a worker)."""
+        if not conversion.metrics:
+            return
+        if self.costs is not None:
+            self.costs.learn(conversion)
+        self.telemetry.record('conversion', **conversion.metrics)
+
+    def close(self, aborted: Iterable = ()) -> None:
+        """Close the caches.
+
+        The `aborted` conversions that had not started are marked as aborted
+        in the journal.
+        """
+        from .journal import QUEUED
+
+        if self.journal is not None:
+            for conversion in aborted:
+                job = self.journal.get(conversion.movie.path)
+                if job and job['state'] == QUEUED:
+                    self.journal.update(conversion.movie.path, 'aborted')
+            self.journal.close()
+        if self.costs is not None:
+            self.costs.close()
+        if self.index is not None:
+            self.index.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+
+def batch(paths: list[str],
+          config: dict,
+          jobs: int = None,
+          subs: str = 'auto',
+          burn: bool = None,
+          dry_run: bool = False,
+          resume: bool = False,
+          serve: int = None,
+          emit: JsonLines = None) -> int:
+    """Convert all videos in `paths` without a GUI.
+
+    If `burn` is true, the subtitles are burned into the video, otherwise
+    text-based subtitles are muxed as a separate stream (if :data:`None`, the
+    ``burn_subtitles`` value in the configuration is used). If `dry_run` is
+    true, only the plan for each video is written. If `resume` is true, the
+    conversions in the journal that did not finish (e.g., the computer
+    crashed) are converted again, with the subtitle that was selected.
+
+    If `serve` is a port, the videos are not converted by this process, the
+    queue is served to the workers (see :func:`worker`) on that port instead.
+
+    If `jobs` is specified, it caps the number of concurrent conversions of
+    each kind, otherwise the limits are from the configuration.
+
+    Returns the exit code (0 if no conversion failed).
+    """
+    from .conversion import Conversion
+    from .costs import TABLE
+    from .costs import finish_times
+    from .costs import get_order
+    from .costs import priority
+    from .distributed import JobServer
+    from .journal import QUEUED
+    from .journal import RUNNING
+    from .progress import Progress
+    from .scanner import Scanner
+    from .scanner import extensions_regex
+    from .scheduler import Scheduler
+    from .telemetry import report
+
+    session = Session(config, jobs=jobs, subs=subs, burn=burn, emit=emit)
+    emit = session.emit
+    if not session.open():
+        return 1
+    journal = session.journal
+
+    restoring = {}  # path -> the job in the journal
+    if resume and journal is not None:
+        restoring = {job['path']: job for job in journal.unfinished() if os.path.isfile(job['path'])}
+        paths = list(paths) + list(restoring)
+
+    scanner = Scanner(extensions_regex(config.get('extensions', EXTENSIONS)),
+                      sidecars=session.sidecars,
+                      max_depth=config.get('scan_max_depth'),
+                      exclude=config.get('scan_exclude', []),
+                      workers=config.get('scan_workers', 8))
+    limits = session.limits
+    order = get_order(config)
+    deadline = 3600. * config.get('deadline', 24)
+    emit('start', concurrency=limits, ffmpeg=session.version)
+
+    # a Movie once its subtitles are attached, None if a video cannot be
+    # probed, and ('found', the number of videos) once the search finished
+    probed = queue.Queue()
+
+    def probe(path: str):
+        job = restoring.get(path)
+        return session.probe(path, subtitle=None if job is None else job['subtitle'], ready=probed.put)
+
+    def on_probed(path: str, movie, error: str) -> None:
+        if movie is None:
+            probed.put(None)
+
+    def search() -> None:
+        # the videos are probed as they are found
+        found = 0
+        try:
+            for path in scanner.scan(paths):
+                if not probes.submit(path):
+                    break
+                found += 1
+        finally:
+            probed.put(('found', found))
+
+    def convert(conversion: Conversion) -> str:
+        path = conversion.movie.path
+
+        def stats(info: Progress) -> None:
+            emit('progress', path=path, **info.to_dict())
+
+        subtitle = conversion.movie.subtitle
+        return session.convert(conversion, stats, subtitle=subtitle.get('path') or subtitle.get('index'))
+
+    def on_job(event: str, job, **kwargs) -> None:
+        # a conversion that runs on a worker
+        conversion = job.conversion
+        path = conversion.movie.path
+        if event == 'lease':
+            if journal is not None:
+                journal.update(path, RUNNING)
+            emit('convert', path=path, output=conversion.outfile, kind=conversion.kind(),
+                 worker=job.worker, attempt=job.attempts)
+        elif event == 'progress':
+            emit('progress', path=path, worker=job.worker, **kwargs['progress'])
+        elif event == 'requeue':
+            if journal is not None:
+                journal.update(path, QUEUED, kwargs['reason'])
+            emit('requeue', path=path, worker=job.worker, reason=kwargs['reason'])
+        elif event == 'finish':
+            status = kwargs['status']
+            if journal is not None:
+                journal.update(path, status, conversion.message)
+            session.learn(conversion)
+            emit(status, path=path, output=conversion.outfile, metrics=conversion.metrics,
+                 worker=job.worker, message=conversion.message)
+
+    def submit(conversion: Conversion) -> None:
+        if journal is not None:
+            journal.queue(conversion.movie.path, conversion.outfile, conversion.movie.subtitle)
+        key = priority(order, conversion.predicted, conversion.movie.path, deadline)
+        if server is None:
+            futures.append(scheduler.submit(conversion.kind(), convert, conversion, priority=key,
+                                            devices=conversion.devices_used(),
+                                            exclusive=conversion.exclusive_key()))
+        else:
+            futures.append(server.submit(conversion, priority=key))
+
+    server = None
+    if serve is not None and not dry_run:
+        try:
+            server = JobServer(serve, on_job,
+                               metrics=session.telemetry.prometheus,
+                               lease_ttl=config.get('lease_ttl', 30),
+                               max_attempts=config.get('lease_attempts', 3),
+                               token=config.get('server_token'),
+                               host=config.get('server_host', '127.0.0.1'))
+        except (OSError, ValueError) as e:
+            emit('error', message=f'cannot serve on port {serve}, {e}')
+            session.close()
+            return 1
+        emit('serve', port=server.port)
+    linger = 2 * config.get('server_poll', 2)  # so that the workers are told to stop
+
+    scheduler = Scheduler(limits, session.devices)
+    statuses = []
+    futures = []
+    conversions = []
+    probes = session.probe_pool(probe, on_probed)
+    searching = threading.Thread(target=search, daemon=True)
+    try:
+        searching.start()
+        found, received = None, 0
+        while found is None or received < found:
+            movie = probed.get()
+            if isinstance(movie, tuple):
+                found = movie[1]
+                emit('found', files=found)
+                continue
+            received += 1
+            if movie is None:
+                statuses.append('failed')
+                continue
+            conversion = session.conversion(movie, calibrate=not dry_run)
+            plan = conversion.plan()
+            emit('plan', path=movie.path, command=conversion.command(), estimate=conversion.predicted,
+                 streams=[str(p) for p in [plan.video] + plan.audio if p])
+            conversions.append(conversion)
+            if order == TABLE and not dry_run:  # otherwise, wait until all conversions are known
+                submit(conversion)
+        probes.close()
+        if order != TABLE and not dry_run:
+            for conversion in conversions:
+                submit(conversion)
+        if server is not None:
+            server.seal()
+        ordered = sorted(conversions, key=lambda c: priority(order, c.predicted, c.movie.path, deadline))
+        finish = finish_times([(c.movie.path, c.kind(), c.predicted, False) for c in ordered], limits)
+        emit('queue', order=order, eta=max(finish.values(), default=0.),
+             jobs=[{'path': c.movie.path, 'predicted': c.predicted, 'eta': finish[c.movie.path]} for c in ordered])
+        statuses.extend(future.result() for future in futures)
+    except KeyboardInterrupt:
+        session.event_stop.set()
+        scanner.cancel()
+        probes.close()
+        for conversion in conversions:
+            conversion.cancel()
+        scheduler.shutdown(cancel_futures=True)
+        if server is not None:
+            server.shutdown_jobs()
+            server.close(linger)
+        session.close(aborted=conversions)
+        emit('aborted')
+        return 130
+    scheduler.shutdown()
+    if server is not None:
+        server.close(linger)
+
+    summary = session.telemetry.summary()
+    session.close()
+    emit('summary', **summary)
+    if not dry_run:
+        print(report(summary), file=sys.stderr)
+
+    counts = {s: statuses.count(s) for s in ('done', 'skipped', 'failed', 'aborted')}
+    emit('finish', **counts)
+    return 1 if counts['failed'] else 0
+
+
+def watch(root: str,
+          config: dict,
+          jobs: int = None,
+          subs: str = 'auto',
+          burn: bool = None,
+          emit: JsonLines = None) -> int:
+    """Convert the videos that are added to a folder (and sub-folders) until interrupted.
+
+    A video is converted once it has not been written to for ``watch_settle``
+    seconds, the videos that are in the folder when watching starts are also
+    converted (unless they have been already). The status of the conversions
+    is served as JSON on localhost at ``http://127.0.0.1:<watch_port>/status``
+    and the telemetry at ``/metrics``. See :func:`batch` for the other arguments.
+
+    Returns the exit code.
+    """
+    import signal
+    from .conversion import Conversion
+    from .conversion import output_paths
+    from .costs import finish_times
+    from .costs import get_order
+    from .costs import priority
+    from .planner import get_outputs
+    from .progress import Progress
+    from .scanner import extensions_regex
+    from .scheduler import Scheduler
+    from .watch import StatusServer
+    from .watch import Watcher
+    from .watch import is_output
+
+    session = Session(config, jobs=jobs, subs=subs, burn=burn, emit=emit)
+    emit = session.emit
+    if not os.path.isdir(root):
+        emit('error', message=f'{root!r} is not a folder')
+        return 1
+    if not session.open():
+        return 1
+    journal = session.journal
+    telemetry = session.telemetry
+    limits = session.limits
+
+    extensions = config.get('extensions', EXTENSIONS)
+    outputs = get_outputs(config)
+    order = get_order(config)
+    deadline = 3600. * config.get('deadline', 24)
+    exclude = list(config.get('scan_exclude', []))
+    for key in ('output_dir', 'scratch_dir'):  # in case they are in the folder that is watched
+        if config.get(key):
+            exclude.append(os.path.abspath(config[key]))
+    watcher = Watcher(root, extensions_regex(extensions),
+                      exclude=exclude,
+                      settle=config.get('watch_settle', 10),
+                      interval=config.get('watch_interval', 30),
+                      polling=config.get('watch_polling', False),
+                      sidecars=session.sidecars)
+
+    event_stop = session.event_stop
+    lock = threading.Lock()
+    states = {}  # path -> the state of a video that is being probed or converted
+    conversions = {}  # path -> Conversion
+    written = set()  # the output files
+    counts = dict.fromkeys(('done', 'skipped', 'failed', 'aborted'), 0)
+    started = time.time()
+
+    def status() -> dict:
+        with lock:
+            current = [{'path': path, **job} for path, job in states.items()]
+            finished = dict(counts)
+        converting = sorted((job for job in current if 'kind' in job), key=lambda job: job['priority'])
+        finish = finish_times([(job['path'], job['kind'],
+                                job['eta'] if job.get('eta', -1) >= 0 else job['predicted'],
+                                job['state'] == 'running') for job in converting], limits)
+        for job in current:
+            if job['path'] in finish:
+                job['finish'] = finish[job['path']]
+        return {
+            'root': watcher.root,
+            'mode': watcher.mode,
+            'ffmpeg': session.version,
+            'started': started,
+            'pending': sorted(watcher.pending),
+            'jobs': current,
+            'eta': max(finish.values(), default=0.),
+            'counts': finished,
+            'summary': telemetry.summary(),
+        }
+
+    def finish(path: str, state: str) -> None:
+        with lock:
+            states.pop(path, None)
+            conversions.pop(path, None)
+            counts[state] += 1
+
+    def probe(path: str):
+        return session.probe(path, ready=probed)
+
+    def on_probed(path: str, movie, error: str) -> None:
+        if movie is None:
+            finish(path, 'failed')
+
+    def probed(movie) -> None:
+        # may be called by a Scanner thread, the conversion is queued by another thread
+        with lock:
+            if not event_stop.is_set():
+                queuing.submit(queue, movie)
+
+    def queue(movie) -> None:
+        path = movie.path
+        conversion = session.conversion(movie)
+        key = priority(order, conversion.predicted, path, deadline)
+        with lock:
+            if event_stop.is_set():
+                return
+            written.update(conversion.outfiles)
+            conversions[path] = conversion
+            states[path] = {'state': 'queued', 'kind': conversion.kind(), 'output': conversion.outfile,
+                            'predicted': conversion.predicted, 'priority': key}
+        if journal is not None:
+            journal.queue(path, conversion.outfile, movie.subtitle)
+        scheduler.submit(conversion.kind(), convert, conversion, priority=key,
+                         devices=conversion.devices_used(), exclusive=conversion.exclusive_key())
+
+    def convert(conversion: Conversion) -> None:
+        path = conversion.movie.path
+
+        def stats(info: Progress) -> None:
+            with lock:
+                states[path].update(state='running', percentage=info.percentage, speed=info.speed, eta=info.eta)
+
+        with lock:
+            states[path]['state'] = 'running'
+        finish(path, session.convert(conversion, stats))
+
+    def ingest(path: str) -> None:
+        with lock:
+            if path in states or path in written:
+                return
+        if all(os.path.isfile(f) for f in output_paths(path, outputs, config.get('output_dir'))) or \
+                is_output(path, extensions, [o.suffix for o in outputs]) or \
+                (journal is not None and journal.is_output(path)):
+            return
+        with lock:
+            states[path] = {'state': 'probing'}
+        probes.submit(path)
+
+    scheduler = Scheduler(limits, session.devices)
+    probes = session.probe_pool(probe, on_probed)
+    queuing = ThreadPoolExecutor(max_workers=1)
+
+    server = None
+    port = config.get('watch_port', 8765)
+    if port is not None:
+        server = StatusServer(port, status, telemetry.prometheus)
+        port = server.port
+
+    previous = signal.signal(signal.SIGTERM, lambda *args: watcher.stop())
+    emit('watch', root=watcher.root, mode=watcher.mode, port=port, concurrency=limits, ffmpeg=session.version)
+    try:
+        watcher.run(ingest)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        with lock:
+            event_stop.set()
+            running = list(conversions.values())
+        for conversion in running:
+            conversion.cancel()
+        probes.close()
+        queuing.shutdown(cancel_futures=True)
+        scheduler.shutdown(cancel_futures=True)
+        if server is not None:
+            server.close()
+        session.close(aborted=running)
+        emit('stopped', **counts)
+    return 0
+
+
+def worker(url: str,
+           config: dict,
+           jobs: int = None,
+           name: str = None,
+           emit: JsonLines = None) -> int:
+    """Convert the videos that a job server queues (see the `serve` argument of :func:`batch`).
+
+    The videos must be at the same path on this computer as on the server
+    (e.g., shared storage). A heartbeat is sent every ``heartbeat_interval``
+    seconds while a video is converted, if the lease is lost (the lease
+    expired or the server aborted the job) the conversion is cancelled.
+    The worker stops once the server has no more jobs, or when interrupted
+    (the conversions that are running are given back to the server).
+    See :func:`batch` for `jobs`.
+
+    Returns the exit code.
+    """
+    import signal
+    import socket
+    from collections import Counter
+    from .conversion import Conversion
+    from .distributed import JobClient
+    from .progress import Progress
+
+    session = Session(config, jobs=jobs, emit=emit)
+    emit = session.emit
+    # the journal, the cost model and the telemetry are kept by the job server
+    if not session.open(journal=False, learn=False):
+        return 1
+
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    limits = session.limits
+    client = JobClient(url, token=config.get('server_token'))
+    lease_ttl = config.get('lease_ttl', 30)
+    interval = config.get('heartbeat_interval', 2)
+    poll = config.get('server_poll', 2)
+
+    event_stop = session.event_stop
+    wake = threading.Event()
+    lock = threading.Lock()
+    running = {}  # job id -> (kind, Conversion or None while probing)
+    threads = []
+    counts = dict.fromkeys(('done', 'skipped', 'failed', 'aborted'), 0)
+
+    def run(job: dict) -> None:
+        path = job['path']
+        done = threading.Event()
+        latest = {}
+
+        def heartbeat() -> None:
+            renewed = time.monotonic()
+            while not done.wait(interval):
+                try:
+                    ok = client.heartbeat(job, latest.get('progress'))
+                except OSError:
+                    ok = None
+                if ok:
+                    renewed = time.monotonic()
+                elif ok is False or time.monotonic() - renewed > lease_ttl:
+                    emit('error', path=path, message='the lease was lost')
+                    with lock:
+                        conversion = running[job['id']][1]
+                        running[job['id']] = (job['kind'], 'lost')
+                    if conversion is not None:
+                        conversion.cancel()
+                    return
+
+        def stats(info: Progress) -> None:
+            latest['progress'] = info.to_dict()
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        status, metrics, message = 'failed', {}, ''
+        reasons = []  # why the video cannot be probed
+        try:
+            movie = session.probe(path, subtitle=job['subtitle'], error=reasons.append)
+            if movie is None:
+                message = reasons[0]
+                emit('error', path=path, message=message)
+                emit(status, path=path, metrics=metrics)
+            else:
+                conversion = session.conversion(movie, devices=session.devices)
+                with lock:
+                    lost = running[job['id']][1] == 'lost'
+                    running[job['id']] = (job['kind'], conversion)
+                if lost:
+                    conversion.cancel()
+                status = session.convert(conversion, stats, job=job['id'])
+                metrics, message = conversion.metrics, conversion.message
+        except Exception as e:  # the job must still be completed, otherwise the lease is renewed forever
+            status, message = 'failed', f'ERROR: {e.__class__.__name__}: {e}'
+            emit('error', path=path, message=message)
+            emit(status, path=path, metrics=metrics)
+        finally:
+            done.set()
+            beat.join()
+            try:
+                client.complete(job, status, metrics, message)
+            except OSError as e:
+                emit('error', path=path, message=f'cannot report to {url}, {e}')
+            with lock:
+                del running[job['id']]
+                counts[status] += 1
+            wake.set()
+
+    def stop(*args) -> None:
+        event_stop.set()
+        wake.set()
+
+    previous = signal.signal(signal.SIGTERM, stop)
+    emit('worker', name=name, server=url, concurrency=limits, ffmpeg=session.version)
+    code = 0
+    unreachable = None  # when the server could not be reached
+    try:
+        while not event_stop.is_set():
+            with lock:
+                busy = Counter(kind for kind, _ in running.values())
+            kinds = [kind for kind, limit in limits.items() if busy[kind] < limit]
+            job = None
+            if kinds:
+                try:
+                    job = client.lease(name, kinds)
+                except PermissionError as e:
+                    emit('error', message=str(e))
+                    code = 1
+                    break
+                except OSError as e:
+                    if unreachable is None:
+                        unreachable = time.monotonic()
+                        emit('error', message=f'cannot reach {url}, {e}')
+                    elif time.monotonic() - unreachable > lease_ttl and not running:
+                        code = 1
+                        break
+                else:
+                    unreachable = None
+                if client.finished:
+                    break
+            if job is not None:
+                with lock:
+                    running[job['id']] = (job['kind'], None)
+                thread = threading.Thread(target=run, args=(job,))
+                threads.append(thread)
+                thread.start()
+                continue
+            wake.wait(poll)
+            wake.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        event_stop.set()
+        with lock:
+            conversions = [c for _, c in running.values() if isinstance(c, Conversion)]
+        for conversion in conversions:  # given back to the server
+            conversion.cancel()
+        for thread in threads:
+            thread.join()
+        session.close()
+        emit('stopped', **counts)
+    return code
+
+
+def worker_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='convert-mp4 worker',
+        description='Convert the videos that a job server (convert-mp4 --batch DIR --serve) queues.'
+    )
+    parser.add_argument('url', help='the URL of the job server, e.g., http://host:8766')
+    parser.add_argument('config', nargs='?', help='path to a JSON configuration file')
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help='the maximum number of conversions of each kind (copy, '
+                             'audio or video transcode) to run at the same time')
+    parser.add_argument('--name', help='the name of the worker (default is the hostname and process ID)')
+    args = parser.parse_args(argv)
+    return worker(args.url, load_config(args.config), jobs=args.jobs, name=args.name)
+
+
+def main(argv: list[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'worker':
+        return worker_main(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        prog='convert-mp4',
+        description='Convert a video to MP4 format and maybe embed English subtitles.'
+    )
+    parser.add_argument('config', nargs='?', help='path to a JSON configuration file')
+    parser.add_argument('--batch', action='append', metavar='DIR',
+                        help='convert the videos in a folder (or a file) without a GUI, '
+                             'progress is written to stdout as JSON lines '
+                             '(may be specified multiple times)')
+    parser.add_argument('--watch', nargs='?', const='', metavar='DIR',
+                        help='keep running and convert the videos that are added to a folder '
+                             '(the root_dir in the configuration if DIR is not specified)')
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help='the maximum number of conversions of each kind (copy, '
+                             'audio or video transcode) to run at the same time')
+    parser.add_argument('--subs', choices=('auto', 'none'), default='auto',
+                        help='whether to choose an English subtitle automatically')
+    parser.add_argument('--burn', action='store_true', default=None,
+                        help='burn the subtitles into the video instead of muxing them as a separate stream')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only write the plan (ffmpeg command and estimated time) of each video')
+    parser.add_argument('--resume', action='store_true',
+                        help='also convert the videos whose conversion did not finish the last time '
+                             '(e.g., the computer crashed), implies --batch')
+    parser.add_argument('--serve', nargs='?', type=int, const=8766, metavar='PORT',
+                        help='serve the queue of --batch to workers (convert-mp4 worker URL) '
+                             'instead of converting the videos (the default port is 8766)')
+    parser.add_argument('--version', action='version', version=__version__)
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.watch is not None:
+        root = args.watch or config.get('root_dir')
+        if not root:
+            parser.error('--watch requires a folder or a root_dir in the configuration')
+        return watch(root, config, jobs=args.jobs, subs=args.subs, burn=args.burn)
+    if args.batch or args.resume:
+        return batch(args.batch or [], config, jobs=args.jobs, subs=args.subs,
+                     burn=args.burn, dry_run=args.dry_run, resume=args.resume, serve=args.serve)
+    if args.serve is not None:
+        parser.error('--serve requires --batch or --resume')
+
+    from .gui import run
+    run(config)
+    return 0
@@ -0,0 +1,649 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import replace
+from typing import Callable
+
+from .fingerprint import CONVERT
+from .fingerprint import FingerprintIndex
+from .fingerprint import REPORT
+from .fingerprint import get_duplicates
+from .journal import Journal
+from .movie import Movie
+from .planner import Output
+from .planner import Plan
+from .planner import get_outputs
+from .probe import device
+from .probe import ffprobe
+from .probe import probe_error
+from .progress import Progress
+from .progress import ProgressParser
+from .progress import Throttle
+from .progress import format_duration
+from .scheduler import DeviceLimiter
+from .scheduler import classify
+
+
+class FFmpeg:
+
+    def __init__(self, cmd: list[str], duration: float, cwd: str = None) -> None:
+        """Run an ffmpeg command that can be stopped from another thread."""
+        super(FFmpeg, self).__init__()
+        self.cmd = cmd[:1] + ['-nostats', '-loglevel', 'error', '-progress', 'pipe:1'] + cmd[1:]
+        self.duration = duration
+        self.cwd = cwd
+        self.process = None
+        self.cpu_time = None  # user + system time of ffmpeg [seconds], if available
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def run(self, callback: Callable[[Progress], None]) -> tuple:
+        """Run ffmpeg and call `callback` with each ``-progress`` block.
+
+        Returns (returncode, error message). The returncode is :data:`None`
+        if ffmpeg was stopped.
+        """
+        with self.lock:
+            if self.stopping.is_set():
+                return None, 'aborted'
+            p = self.process = subprocess.Popen(
+                self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, text=True, cwd=self.cwd)
+
+        errors = deque(maxlen=10)
+        reader = threading.Thread(target=errors.extend, args=(p.stderr,), daemon=True)
+        reader.start()
+
+        parser = ProgressParser(self.duration)
+        for line in p.stdout:
+            info = parser.feed(line)
+            if info is not None and not self.stopping.is_set():
+                callback(info)
+
+        code = self._wait(p)
+        reader.join()
+        if self.stopping.is_set():
+            return None, 'aborted'
+        return code, ''.join(errors).strip()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop ffmpeg without blocking.
+
+        ffmpeg is asked to quit gracefully (by sending ``q``) so that it
+        releases the output file. If it is still running after `timeout`
+        seconds it is terminated, and then killed.
+        """
+        with self.lock:
+            self.stopping.set()
+            p = self.process
+        if p is None or p.poll() is not None:
+            return
+        try:
+            p.stdin.write('q')
+            p.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        threading.Thread(target=self._escalate, args=(p, timeout), daemon=True).start()
+
+    def _wait(self, p: subprocess.Popen) -> int:
+        """Wait for ffmpeg to exit and get its CPU time (if supported by the OS)."""
+        if hasattr(os, 'wait4'):
+            try:
+                _, status, usage = os.wait4(p.pid, 0)
+            except ChildProcessError:  # already reaped, e.g., by stop()
+                pass
+            else:
+                p.returncode = os.waitstatus_to_exitcode(status)
+                self.cpu_time = usage.ru_utime + usage.ru_stime
+        return p.wait()
+
+    @staticmethod
+    def _escalate(p: subprocess.Popen, timeout: float) -> None:
+        try:
+            p.wait(timeout)
+        except subprocess.TimeoutExpired:
+            p.terminate()
+            try:
+                p.wait(timeout)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+def remove(path: str, timeout: float = 10) -> None:
+    """Remove a file, retrying while it is still in use (e.g., on Windows)."""
+    t0 = time.monotonic()
+    while True:
+        try:
+            os.remove(path)
+            return
+        except FileNotFoundError:
+            return
+        except PermissionError:  # file is still in use
+            if time.monotonic() - t0 > timeout:
+                raise
+            time.sleep(0.1)
+
+
+def output_path(path: str, directory: str = None) -> str:
+    """Returns the path of the MP4 file that a video is converted to.
+
+    The file is in the same folder as the video, unless `directory` is specified.
+    """
+    output_extension = '.mp4'
+    root, ext = os.path.splitext(path)
+    if directory:
+        root = os.path.join(directory, os.path.basename(root))
+    if ext == output_extension:
+        return root + '_(copy)' + output_extension
+    return root + output_extension
+
+
+def file_size(path: str) -> int:
+    """Returns the size of a file, 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def output_paths(path: str, outputs: list[Output], directory: str = None) -> list[str]:
+    """Returns the path of the MP4 file of each rendition that a video is converted to."""
+    outfile = output_path(path, directory)
+    return [output.path(outfile) for output in outputs]
+
+
+def partial_path(path: str, directory: str = None) -> str:
+    """Returns the path that ffmpeg writes to, it is moved to `path` once the output is verified.
+
+    The file is next to `path`, unless a scratch `directory` is specified (the
+    name is unique for each `path`).
+    """
+    if not directory:
+        return path + '.part'
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(directory, f'{digest}-{os.path.basename(path)}.part')
+
+
+def place(partial: str, path: str) -> None:
+    """Move a file that ffmpeg wrote to its output `path`, atomically.
+
+    A file on another storage device (e.g., a scratch folder) is copied to
+    a temporary file next to `path` first, which is then renamed.
+    """
+    try:
+        os.replace(partial, path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        temporary = partial_path(path)
+        try:
+            shutil.copyfile(partial, temporary)
+            os.replace(temporary, path)
+        except OSError:
+            remove(temporary)
+            raise
+        remove(partial)
+
+
+def link(source: str, path: str) -> None:
+    """Hard link an output file of a duplicate video to `path`, atomically."""
+    temporary = partial_path(path)
+    remove(temporary)
+    os.link(source, temporary)
+    os.replace(temporary, path)
+
+
+def within(duration: float, expected: float, tolerance: float = 2) -> bool:
+    """Whether a duration differs from the `expected` duration by at most `tolerance` seconds or 1%."""
+    return abs(duration - expected) <= max(tolerance, 0.01 * expected)
+
+
+def verify(path: str, expected: float, tolerance: float = 2, require: tuple = ()) -> tuple[str, dict]:
+    """Probe an output file and check it, see :func:`check_duration`.
+
+    Each codec type in `require` (e.g., ``'video'``) must have a stream.
+    Returns (an empty string if the file is valid, otherwise a description
+    of the problem, the duration and the streams of the file).
+    """
+    try:
+        metadata = ffprobe(path, timeout=60)
+        info = {
+            'duration': float(metadata['format']['duration']),
+            'streams': [f'{s.get("codec_type")}:{s.get("codec_name", "")}' for s in metadata.get('streams', [])],
+        }
+    except Exception as e:
+        return f'cannot verify the output, {probe_error(e)}', {}
+    if not within(info['duration'], expected, tolerance):
+        return (f'the output is {format_duration(info["duration"])} long, '
+                f'expected {format_duration(expected)}'), info
+    for codec_type in require:
+        if not any(s.startswith(f'{codec_type}:') for s in info['streams']):
+            return f'the output does not have a {codec_type} stream', info
+    return '', info
+
+
+def check_duration(path: str, expected: float, tolerance: float = 2) -> str:
+    """Check that the duration of an output file is (close to) the `expected` duration.
+
+    Returns an empty string if it is, otherwise a description of the problem.
+    The difference may be `tolerance` seconds or 1% of the duration.
+    """
+    return verify(path, expected, tolerance)[0]
+
+
+class Conversion:
+
+    def __init__(self,
+                 movie: Movie,
+                 event_stop: threading.Event = None,
+                 config: dict = None,
+                 journal: Journal = None,
+                 devices: DeviceLimiter = None,
+                 index: FingerprintIndex = None) -> None:
+        """Convert a movie to MP4 with ffmpeg (does not depend on Qt).
+
+        ffmpeg writes to a temporary file that is renamed once its duration
+        has been checked, so the output file is either complete or does not
+        exist. The state of the conversion is recorded in the `journal`. If
+        `devices` is specified, the conversion waits until the storage
+        devices that it reads from and writes to are available (see
+        :meth:`devices_used`), otherwise the caller is expected to limit them.
+
+        An output that already exists is only skipped if it is valid, which
+        is checked without probing it if it is unchanged since it was
+        recorded in the fingerprint `index`. A movie with the same content
+        (and the same recipe, see :meth:`recipe`) as a movie that was
+        converted before is a duplicate, see :meth:`deduplicate`.
+
+        The following `config` keys are used:
+
+        * profile: the target-device profile, see :func:`~convert_mp4.planner.get_profile`
+        * threads: the number of threads that ffmpeg may use to encode
+          video (0 lets ffmpeg decide)
+        * segments: if > 1, an HEVC video that is longer than
+          segment_min_duration seconds (and does not have subtitles burned
+          in) is split into this many segments that are encoded in parallel
+        * progress_interval: the minimum number of seconds between progress updates
+        * stop_timeout: the number of seconds to wait for ffmpeg to quit
+          gracefully after a conversion is cancelled before it is terminated
+        * duration_tolerance: the number of seconds (or 1%) that the duration
+          of the output may differ from the movie
+        * outputs: the renditions to write, see :func:`~convert_mp4.planner.get_outputs`
+        * output_dir: the folder to write the outputs to, instead of the folder of the movie
+        * scratch_dir: the folder that ffmpeg writes to, the verified outputs
+          are then moved to the output folder
+        * duplicates: what to do with a duplicate, see :func:`~convert_mp4.fingerprint.get_duplicates`
+        """
+        super(Conversion, self).__init__()
+        config = config or {}
+        self.config = config
+        self.movie = movie
+        self.segments = config.get('segments', 0)
+        self.segment_min_duration = config.get('segment_min_duration', 600)
+        self.progress_interval = config.get('progress_interval', 0.25)
+        self.stop_timeout = config.get('stop_timeout', 5)
+        self.duration_tolerance = config.get('duration_tolerance', 2)
+        self.output_dir = config.get('output_dir')
+        self.scratch_dir = config.get('scratch_dir')
+        self.journal = journal
+        self.devices = devices
+        self.index = index
+        self.duplicates = get_duplicates(config)
+        self.content = None  # (fingerprint, recipe) of the movie, if there is an index
+        self.claimed = False
+        self.duplicate = ''  # the movie that the outputs were linked from
+        self.invalid: set[str] = set()  # the outputs that exist but are not valid
+        self.cancelled = threading.Event()
+        self.job = None  # FFmpeg or SegmentedEncode
+        self.queued = time.monotonic()
+        self.segmented = False
+        self.predicted = None  # how long the conversion is predicted to take, see CostModel
+        self.cpu_time = None
+        self.last = None  # the last Progress from ffmpeg
+        self.message = ''  # why the conversion failed or was skipped
+        self.metrics = {}
+        self.event_stop = threading.Event() if event_stop is None else event_stop
+        self.outputs = get_outputs(config)
+        self.outfiles = output_paths(movie.path, self.outputs, self.output_dir)
+        self.outfile = self.outfiles[0]
+        self.partial = partial_path(self.outfile, self.scratch_dir)
+        self.movie.convert_path = self.outfile
+
+    def plan(self) -> Plan:
+        """Returns the decision for each stream (depends on the selected subtitle)."""
+        return Plan(self.movie, self.config)
+
+    def pending(self) -> list[tuple[Output, str]]:
+        """Returns the outputs whose file does not exist yet (all outputs if none exist) and their file."""
+        pending = [(o, f) for o, f in zip(self.outputs, self.outfiles) if not os.path.isfile(f) or f in self.invalid]
+        return pending or list(zip(self.outputs, self.outfiles))
+
+    def command(self) -> list[str]:
+        """Returns the ffmpeg command (relative to the folder of the movie)."""
+        plan = self.plan()
+        if plan.multiple:
+            return plan.outputs_command([(o, partial_path(f, self.scratch_dir)) for o, f in self.pending()])
+        return plan.command(self.partial)
+
+    def recipe(self) -> str:
+        """Returns a hash of how the movie is converted.
+
+        The hash is of the ffmpeg command without the file names and of the
+        fingerprint of the subtitle file that is used (if any), so movies that
+        use different subtitle files with the same name are not duplicates.
+        Raises :exc:`OSError` if the subtitle file cannot be read.
+        """
+        plan = self.plan()
+        folder = os.path.dirname(self.movie.path)
+        if plan.multiple:
+            cmd = plan.outputs_command([(o, os.path.join(folder, f'{i}.mp4')) for i, o in enumerate(self.outputs)])
+        else:
+            cmd = plan.command(os.path.join(folder, '0.mp4'))
+        basename = os.path.basename(self.movie.path)
+        cmd = [arg.replace(basename, '{input}') for arg in cmd]
+        subtitle = self.movie.subtitle.get('path')
+        if subtitle:
+            cmd.append(self.index.fingerprint(subtitle))
+            sub = os.path.splitext(subtitle)[0] + '.sub'  # the images of a VobSub .idx file
+            if subtitle.lower().endswith('.idx') and os.path.isfile(sub):
+                cmd.append(self.index.fingerprint(sub))
+        return hashlib.sha1(json.dumps(cmd).encode()).hexdigest()
+
+    def content_key(self):
+        """Returns the (fingerprint, recipe) of the movie, :data:`None` if there is no index or it cannot be read."""
+        if self.index is not None and self.content is None:
+            try:
+                self.content = (self.index.fingerprint(self.movie.path), self.recipe())
+            except OSError:
+                pass
+        return self.content
+
+    def exclusive_key(self):
+        """Returns the :meth:`content_key` if only one movie with the same content may be converted at a time.
+
+        Returns :data:`None` if duplicates are converted again.
+        """
+        return None if self.duplicates == CONVERT else self.content_key()
+
+    def required(self) -> tuple:
+        """Returns the codec types that an output must have a stream of."""
+        return ('video',) if self.plan().video is not None else ()
+
+    def check_existing(self, error: Callable[[str], None]) -> None:
+        """Check the outputs that already exist, an output that is not valid (e.g., a leftover) is converted again."""
+        for position, outfile in enumerate(self.outfiles):
+            if not os.path.isfile(outfile):
+                continue
+            record = self.index.get(outfile) if self.index is not None else None
+            if record is not None and within(record['duration'], self.movie.duration, self.duration_tolerance):
+                continue
+            message, info = verify(outfile, self.movie.duration, self.duration_tolerance, self.required())
+            if message:
+                self.invalid.add(outfile)
+                error(f'{os.path.basename(outfile)} exists but is not valid, {message}, converting it again')
+            elif self.index is not None:
+                self.index.record(outfile, info, self.movie.path, rendition=position)
+
+    def deduplicate(self, pending: list[tuple[Output, str]], error: Callable[[str], None]):
+        """Hard link (or report) the outputs of a movie with the same content that was converted before.
+
+        The outputs are only linked if every pending output has a valid
+        duplicate (the video is converted if a link cannot be created, e.g.,
+        the outputs are on another device). A movie with the same content
+        that was being converted has been waited for, see :meth:`run`.
+
+        Returns the status, or :data:`None` if the movie must be converted.
+        """
+        if self.content_key() is None or self.duplicates == CONVERT:
+            return None
+        records = [self.index.find(*self.content, self.outfiles.index(f)) for _, f in pending]
+        if not all(records):
+            return None
+        sources = ', '.join(sorted({record['source'] for record in records}))
+        if self.duplicates == REPORT:
+            error(f'duplicate of {sources}')
+            return 'skipped'
+        try:
+            for record, (_, outfile) in zip(records, pending):
+                if os.path.abspath(record['output']) != os.path.abspath(outfile):
+                    link(record['output'], outfile)
+        except OSError:
+            return None
+        self.record(pending, records)
+        self.duplicate = sources
+        return 'done'
+
+    def record(self, pending: list[tuple[Output, str]], infos: list[dict]) -> None:
+        """Record the outputs that were written in the index."""
+        if self.index is None:
+            return
+        fingerprint, recipe = self.content or ('', '')
+        for (_, outfile), info in zip(pending, infos):
+            self.index.record(outfile, info, self.movie.path, fingerprint, recipe, self.outfiles.index(outfile))
+
+    def devices_used(self) -> tuple[int, ...]:
+        """Returns the storage devices that the movie is read from and the outputs are written to.
+
+        The scratch folder is not included, it is expected to be a local disk.
+        """
+        folder = os.path.dirname(os.path.abspath(self.outfile))
+        while not os.path.isdir(folder) and os.path.dirname(folder) != folder:  # not created yet
+            folder = os.path.dirname(folder)
+        return tuple(sorted({d for d in (device(self.movie.path), device(folder)) if d != -1}))
+
+    def is_segmented(self) -> bool:
+        """Whether the video is encoded in segments that run in parallel."""
+        plan = self.plan()
+        return self.segments > 1 and \
+            len(self.outputs) == 1 and not plan.multiple and \
+            plan.transcodes_video and plan.video.codec == 'hevc' and \
+            not self.movie.subtitle and \
+            self.movie.duration >= self.segment_min_duration
+
+    def kind(self) -> str:
+        """Returns whether the conversion is a ``'copy'``, ``'audio'`` or ``'video'`` job."""
+        return classify(self.command())
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set() or self.event_stop.is_set()
+
+    def cancel(self) -> None:
+        """Cancel the conversion without waiting for ffmpeg to stop.
+
+        May be called from any thread, before or while the conversion runs.
+        The partially-written output file is removed by the thread that
+        called :meth:`run`.
+        """
+        self.cancelled.set()
+        job = self.job
+        if job is not None:
+            job.stop(self.stop_timeout)
+
+    def run(self,
+            progress: Callable[[int], None] = None,
+            error: Callable[[str], None] = None,
+            stats: Callable[[Progress], None] = None) -> str:
+        """Run ffmpeg.
+
+        The `progress` callback receives the percentage complete, the `stats`
+        callback receives the :class:`~convert_mp4.progress.Progress` (fps,
+        speed, ETA, bytes written) and the `error` callback receives a
+        description of why the conversion failed. The `progress` and `stats`
+        callbacks are only called when the value changes, and at most once
+        per progress_interval.
+
+        Returns one of ``'done'``, ``'skipped'``, ``'failed'`` or ``'aborted'``
+        and updates :attr:`metrics`, see :meth:`measure`.
+        """
+        devices = self.devices_used() if self.devices is not None else ()
+        available = self._claim() and self._acquire(devices)
+        started = time.monotonic()
+        if self.journal is not None:
+            self.journal.update(self.movie.path, 'running')
+        try:
+            status = self._run(progress, error, stats) if available else 'aborted'
+        finally:
+            if available and self.devices is not None:
+                self.devices.release(devices)
+            if self.claimed:
+                self.index.release(self.content)
+                self.claimed = False
+        self.measure(status, started)
+        if self.journal is not None:
+            self.journal.update(self.movie.path, status, self.message)
+        return status
+
+    def _claim(self) -> bool:
+        """Wait until no other movie with the same content is converted, returns :data:`False` if cancelled while waiting.
+
+        This is done before the storage devices are used, so waiting does not
+        block the other conversions.
+        """
+        key = self.exclusive_key()
+        if key is None:
+            return True
+        while not self.index.claim(key, timeout=0.5):
+            if self.is_cancelled():
+                return False
+        self.claimed = True
+        return True
+
+    def _acquire(self, devices: tuple[int, ...]) -> bool:
+        """Wait until the storage devices are available, returns :data:`False` if cancelled while waiting."""
+        if self.devices is None:
+            return True
+        while not self.devices.acquire(devices, timeout=0.5):
+            if self.is_cancelled():
+                return False
+        return True
+
+    def measure(self, status: str, started: float) -> dict:
+        """Update the timing and throughput :attr:`metrics` of the conversion.
+
+        The queue wait is the time between creating the :class:`Conversion`
+        and calling :meth:`run`. The fps and speed are from the last
+        ``-progress`` block of ffmpeg and the CPU time is of the ffmpeg
+        process(es), :data:`None` if the OS does not report it.
+        """
+        written = status == 'done' and not self.duplicate  # a linked duplicate was not converted
+        output_bytes = sum(file_size(outfile) for outfile in self.outfiles) if written else 0
+        self.metrics = {
+            'path': self.movie.path,
+            'status': status,
+            'kind': self.kind(),
+            'segmented': self.segmented,
+            'queue_wait': started - self.queued,
+            'wall': time.monotonic() - started,
+            'predicted': self.predicted,
+            'fps': self.last.fps if self.last else 0.,
+            'speed': self.last.speed if self.last else 0.,
+            'cpu_time': self.cpu_time,
+            'input_bytes': int(self.movie.metadata['format'].get('size', 0)),
+            'output_bytes': output_bytes,
+            'media_seconds': self.movie.duration if written else 0.,
+            'duplicate': self.duplicate,
+            'error': self.message,
+        }
+        return self.metrics
+
+    def _run(self, progress, error, stats) -> str:
+        progress = progress or (lambda value: None)
+        stats = stats or (lambda info: None)
+
+        error_callback = error or (lambda message: None)
+
+        def error(message: str) -> None:
+            self.message = message
+            error_callback(message)
+
+        if self.is_cancelled():
+            return 'aborted'
+
+        self.check_existing(error_callback)
+        if all(os.path.isfile(outfile) and outfile not in self.invalid for outfile in self.outfiles):
+            progress(0)
+            error('already exists')
+            return 'skipped'
+
+        pending = self.pending()
+        if self.index is not None:
+            status = self.deduplicate(pending, error)
+            if status is not None:
+                progress(100 if status == 'done' else 0)
+                return status
+        partials = [partial_path(outfile, self.scratch_dir) for _, outfile in pending]
+        throttle_percentage = Throttle(self.progress_interval)
+        throttle_stats = Throttle(self.progress_interval)
+
+        def report(info: Progress) -> None:
+            if len(self.outputs) > 1:
+                info = replace(info, outputs=tuple((o.name, file_size(p)) for (o, _), p in zip(pending, partials)))
+            self.last = info
+            if throttle_percentage.ready(info.percentage, force=info.done):
+                progress(info.percentage)
+            if throttle_stats.ready(info, force=info.done):
+                stats(info)
+
+        try:
+            for folder in {os.path.dirname(p) for p in partials + [f for _, f in pending]}:
+                os.makedirs(folder, exist_ok=True)
+        except OSError as e:
+            error(f'ERROR: cannot create {e.filename}, {e.strerror}')
+            return 'failed'
+        for partial in partials:  # from a previous run that did not finish
+            remove(partial)
+        self.segmented = self.is_segmented()
+        if self.segmented:
+            from .segments import SegmentedEncode
+            self.job = SegmentedEncode(self.plan(), self.partial, self.segments)
+        else:
+            self.job = FFmpeg(self.command(), self.movie.duration, cwd=os.path.dirname(self.movie.path))
+        if self.is_cancelled():
+            self.job.stop(self.stop_timeout)
+
+        code, message = self.job.run(report)
+        self.cpu_time = self.job.cpu_time
+        self.job = None
+
+        if code is None:
+            for partial in partials:
+                remove(partial)
+            return 'aborted'
+
+        if code == 0:
+            infos = []
+            for (output, _), partial in zip(pending, partials):
+                message, info = verify(partial, self.movie.duration, self.duration_tolerance)
+                if message and len(self.outputs) > 1:
+                    message = f'{output.name or "default"} output, {message}'
+                if message:
+                    break
+                infos.append(info)
+            else:
+                for (_, outfile), partial in zip(pending, partials):
+                    try:
+                        place(partial, outfile)
+                    except OSError as e:
+                        message = f'cannot move the output to {outfile}, {e.strerror or e}'
+                        break
+                else:
+                    self.record(pending, infos)
+        else:
+            message = message or f'ffmpeg exited with code {code}'
+
+        if message:
+            progress(0)
+            error(f'ERROR: {message}')
+            for partial in partials:
+                remove(partial)
+            return 'failed'
+
+        if throttle_percentage.ready(100, force=True):
+            progress(100)
+        return 'done'
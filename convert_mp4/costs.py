@@ -0,0 +1,224 @@
+import heapq
+import os
+import sqlite3
+import statistics
+import subprocess
+import threading
+import time
+
+from .cache import cache_dir
+from .planner import Plan
+from .planner import RATES
+from .planner import VIDEO_ENCODER
+from .planner import frame_rate
+
+TABLE = 'table'
+SHORTEST = 'shortest'
+DEADLINE = 'deadline'
+ORDERS = (TABLE, SHORTEST, DEADLINE)
+
+
+def get_order(config: dict) -> str:
+    """Returns the order that conversions are queued in from the configuration.
+
+    ``'table'`` (the order of the table or that the videos were found in),
+    ``'shortest'`` (the shortest predicted conversion first) or ``'deadline'``
+    (the conversion with the least slack until its deadline first, see
+    :func:`priority`).
+    """
+    order = config.get('order', TABLE)
+    if order not in ORDERS:
+        raise ValueError(f'Invalid order {order!r}, must be one of {ORDERS}')
+    return order
+
+
+def priority(order: str, predicted: float, path: str, deadline: float = 86400) -> float:
+    """Returns the sort key of a conversion, the lowest key is converted first.
+
+    The deadline of a video is `deadline` seconds after it was modified (e.g.,
+    copied to the folder), so the key is the latest time that the conversion
+    can start and still finish by the deadline.
+    """
+    if order == SHORTEST:
+        return predicted
+    if order == DEADLINE:
+        try:
+            arrived = os.path.getmtime(path)
+        except OSError:
+            arrived = time.time()
+        return arrived + deadline - predicted
+    return 0.
+
+
+def finish_times(jobs: list[tuple], limits: dict[str, int]) -> dict:
+    """Predict when each conversion finishes [seconds from now].
+
+    Each job is (key, kind, seconds remaining, running), the running jobs
+    occupy a slot of their kind and the jobs that are queued start, in the
+    order of `jobs`, when a slot of their kind becomes available.
+    """
+    slots = {kind: [] for kind in limits}
+    finished = {}
+    for key, kind, remaining, running in jobs:
+        if running:
+            slots[kind].append(remaining)
+            finished[key] = remaining
+    for kind, times in slots.items():
+        times.extend([0.] * max(0, limits[kind] - len(times)))
+        heapq.heapify(times)
+    for key, kind, remaining, running in jobs:
+        if not running:
+            start = heapq.heappop(slots[kind])
+            finished[key] = start + remaining
+            heapq.heappush(slots[kind], finished[key])
+    return finished
+
+
+class CostModel:
+
+    def __init__(self, path: str = None, window: int = 20) -> None:
+        """Predict how long a conversion takes from the throughput of previous conversions.
+
+        The throughput of each kind of work (see :meth:`Plan.work
+        <convert_mp4.planner.Plan.work>`) is the median of the last `window`
+        samples, from conversions that finished and from sample encodes (see
+        :meth:`calibrate`). The encode throughput is per codec of the video
+        that is decoded. The default throughput is used for a kind of work
+        that has no samples.
+        """
+        super(CostModel, self).__init__()
+        if path is None:
+            path = os.path.join(cache_dir(), 'costs.sqlite3')
+        self.path = path
+        self.window = window
+        self.lock = threading.Lock()
+        self.calibrating = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS samples ('
+                'kind TEXT NOT NULL, '
+                'codec TEXT NOT NULL, '
+                'rate REAL NOT NULL, '
+                'source TEXT NOT NULL, '
+                'timestamp REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS samples_kind ON samples (kind, codec, timestamp)'
+            )
+            # only keep the samples that are used
+            self.connection.execute(
+                'DELETE FROM samples WHERE timestamp < ('
+                'SELECT s.timestamp FROM samples s WHERE s.kind=samples.kind AND s.codec=samples.codec '
+                'ORDER BY s.timestamp DESC LIMIT 1 OFFSET ?)',
+                (window - 1,)
+            )
+
+    def add(self, kind: str, rate: float, codec: str = '', source: str = 'history') -> None:
+        """Add a throughput sample of a kind of work."""
+        if rate <= 0:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO samples VALUES (?, ?, ?, ?, ?)', (kind, codec, rate, source, time.time())
+            )
+
+    def samples(self, kind: str, codec: str = '') -> list[float]:
+        """Returns the most recent throughput samples of a kind of work."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT rate FROM samples WHERE kind=? AND codec=? ORDER BY timestamp DESC LIMIT ?',
+                (kind, codec, self.window)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def rate(self, kind: str, codec: str = '') -> float:
+        """Returns the throughput of a kind of work."""
+        samples = self.samples(kind, codec)
+        return statistics.median(samples) if samples else RATES[kind]
+
+    def rates(self, plan: Plan) -> dict[str, float]:
+        """Returns the throughput of each kind of work of a plan."""
+        codec = plan.video.codec if plan.video else ''
+        return {
+            'copy': self.rate('copy'),
+            'encode': self.rate('encode', codec),
+            'audio': self.rate('audio'),
+        }
+
+    def predict(self, plan: Plan) -> float:
+        """Returns how long the conversion of a plan is predicted to take [seconds]."""
+        return plan.estimate(self.rates(plan))
+
+    def record(self, plan: Plan, wall: float) -> None:
+        """Learn from a conversion that finished in `wall` seconds.
+
+        The time of the work of the other kinds (as predicted) is subtracted
+        to get the throughput of the most expensive kind of work.
+        """
+        if wall <= 0:
+            return
+        work = plan.work()
+        rates = self.rates(plan)
+        if work['encode']:
+            kind, codec = 'encode', plan.video.codec
+        elif work['audio']:
+            kind, codec = 'audio', ''
+        elif work['copy']:
+            kind, codec = 'copy', ''
+        else:
+            return
+        others = sum(amount / rates[k] for k, amount in work.items() if k != kind and amount)
+        self.add(kind, work[kind] / max(wall - others, 0.1 * wall), codec=codec)
+
+    def learn(self, conversion) -> None:
+        """Learn from a :class:`~convert_mp4.conversion.Conversion` that has finished.
+
+        Only conversions that are done and were not encoded in segments are used.
+        """
+        metrics = conversion.metrics
+        if metrics.get('status') == 'done' and not metrics.get('segmented'):
+            self.record(conversion.plan(), metrics['wall'])
+
+    def calibrate(self, plan: Plan, seconds: float = 5, timeout: float = 300) -> float:
+        """Encode a sample of the video of a plan to measure the encode throughput of its codec.
+
+        A `seconds` long sample from the middle of the video is encoded
+        (the output is discarded). Returns the throughput [pixels/second],
+        or :data:`None` if the video is not transcoded or ffmpeg failed.
+        """
+        movie = plan.movie
+        if plan.video is None or not plan.work()['encode']:
+            return
+        seconds = min(seconds, movie.duration)
+        start = max(0., movie.duration / 2. - seconds / 2.)
+        cmd = ['ffmpeg', '-nostats', '-loglevel', 'error',
+               '-ss', f'{start:.3f}', '-t', f'{seconds:.3f}', '-i', movie.path,
+               '-map', f'0:v:{plan.video.index}', '-c:v', VIDEO_ENCODER]
+        if plan.threads:
+            cmd.extend(['-threads', str(plan.threads)])
+        cmd.extend(['-vf', 'format=yuv420p', '-f', 'null', '-'])
+        t0 = time.perf_counter()
+        try:
+            subprocess.run(cmd, capture_output=True, check=True, timeout=timeout)
+        except (OSError, subprocess.SubprocessError):
+            return
+        wall = time.perf_counter() - t0
+        rate = seconds * movie.width * movie.height * (frame_rate(plan.video.stream) or 25.) / wall
+        self.add('encode', rate, codec=plan.video.codec, source='sample')
+        return rate
+
+    def calibrate_once(self, plan: Plan, seconds: float = 5) -> None:
+        """Calibrate the encode throughput of the codec of a plan, if there are no samples for it yet.
+
+        Only one sample is encoded at a time (may be called from any thread).
+        """
+        if plan.video is None or not plan.work()['encode']:
+            return
+        with self.calibrating:
+            if not self.samples('encode', plan.video.codec):
+                self.calibrate(plan, seconds=seconds)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
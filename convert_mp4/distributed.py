@@ -0,0 +1,392 @@
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass
+from dataclasses import field
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Callable
+
+QUEUED = 'queued'
+LEASED = 'leased'
+
+
+def is_loopback(host: str) -> bool:
+    """Whether `host` is an address (or the name) of the local computer only."""
+    if host.lower() == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+@dataclass
+class Job:
+    """A :class:`~convert_mp4.conversion.Conversion` that is queued on a :class:`JobServer`."""
+    id: str
+    conversion: object
+    priority: float = 0.
+    future: Future = field(default_factory=Future)
+    state: str = QUEUED
+    worker: str = ''  # the name of the worker that has (or last had) the lease
+    lease: str = ''
+    expires: float = 0.  # time.monotonic() when the lease expires
+    attempts: int = 0
+    progress: dict = field(default_factory=dict)
+
+    @property
+    def path(self) -> str:
+        return self.conversion.movie.path
+
+    @property
+    def kind(self) -> str:
+        return self.conversion.kind()
+
+    def payload(self) -> dict:
+        """Returns what a worker needs to run the conversion."""
+        return {
+            'id': self.id,
+            'lease': self.lease,
+            'path': self.path,
+            'subtitle': self.conversion.movie.subtitle or {},
+            'kind': self.kind,
+            'output': self.conversion.outfile,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'path': self.path,
+            'kind': self.kind,
+            'state': self.state,
+            'worker': self.worker,
+            'attempts': self.attempts,
+            'predicted': self.conversion.predicted,
+            'progress': self.progress,
+        }
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/status'):
+            self.reply(200, self.server.status())
+        elif path == '/metrics' and self.server.metrics is not None:
+            body = self.server.metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.server.authorized(self.headers.get('Authorization', '')):
+            self.reply(401, {'error': 'unauthorized'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            path = self.path.rstrip('/')
+            if path == '/lease':
+                job = self.server.lease(body['worker'], body['kinds'])
+                if job is not None:
+                    self.reply(200, job.payload())
+                elif self.server.finished():
+                    self.reply(410, {})
+                else:
+                    self.reply(204)
+            elif path == '/heartbeat':
+                ok = self.server.heartbeat(body['id'], body['lease'], body.get('progress'))
+                self.reply(200 if ok else 409, {})
+            elif path == '/complete':
+                ok = self.server.complete(body['id'], body['lease'], body['status'],
+                                          body.get('metrics') or {}, body.get('message', ''))
+                self.reply(200 if ok else 409, {})
+            else:
+                self.send_error(404)
+        except (KeyError, TypeError, ValueError) as e:
+            self.reply(400, {'error': str(e)})
+
+    def reply(self, code: int, obj: dict = None) -> None:
+        body = b'' if obj is None else json.dumps(obj).encode()
+        self.send_response(code)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JobServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int,
+                 on_event: Callable[..., None] = None,
+                 metrics: Callable[[], str] = None,
+                 lease_ttl: float = 30,
+                 max_attempts: int = 3,
+                 token: str = None,
+                 host: str = '127.0.0.1') -> None:
+        """Serve a queue of conversions to :class:`JobClient` workers over HTTP, in background threads.
+
+        A worker leases the best queued job of the kinds that it has a free
+        slot for (see :func:`~convert_mp4.scheduler.concurrency`) and sends a
+        heartbeat, with its progress, to renew the lease. A job whose lease
+        is not renewed within `lease_ttl` seconds (e.g., the worker died) or
+        that a worker gave up (``'aborted'``) is queued again, up to
+        `max_attempts` times. If `token` is specified, the workers must send
+        it as a Bearer token. A `token` is required to listen on a `host`
+        other than the local computer, otherwise :exc:`ValueError` is raised.
+
+        ``on_event(event, job, **kwargs)`` is called from a server thread
+        when a worker leases a job (``'lease'``), reports its progress
+        (``'progress'``, ``progress=dict``), when a job is queued again
+        (``'requeue'``, ``reason=str``) and when a job finishes
+        (``'finish'``, ``status=str``).
+        """
+        if not token and not is_loopback(host):
+            raise ValueError(f'A server_token is required to serve the queue on {host!r}')
+        super(JobServer, self).__init__((host, port), JobHandler)
+        self.on_event = on_event or (lambda event, job, **kwargs: None)
+        self.metrics = metrics
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.token = token
+        self.lock = threading.Lock()
+        self.queues: dict[str, list] = {}  # kind -> heap of (priority, count, Job)
+        self.jobs: dict[str, Job] = {}  # id -> the jobs that have not finished
+        self.workers: dict[str, float] = {}  # name -> when it was last heard from
+        self.counts: dict[str, int] = {}  # status -> number of jobs that finished
+        self.counter = itertools.count()
+        self.sealed = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 1}, daemon=True)
+        self.thread.start()
+        self.reaper = threading.Thread(target=self._reap, daemon=True)
+        self.reaper.start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def authorized(self, header: str) -> bool:
+        if not self.token:
+            return True
+        return hmac.compare_digest(header.encode(), f'Bearer {self.token}'.encode())
+
+    def submit(self, conversion, priority: float = 0.) -> Future:
+        """Queue a conversion, the lowest `priority` is leased first.
+
+        Returns a :class:`~concurrent.futures.Future` of the status of the conversion.
+        """
+        job = Job(uuid.uuid4().hex, conversion, priority)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._push(job)
+        return job.future
+
+    def seal(self) -> None:
+        """No more jobs will be submitted, the workers are told to stop once all jobs have finished."""
+        with self.lock:
+            self.sealed = True
+
+    def finished(self) -> bool:
+        with self.lock:
+            return self.sealed and not self.jobs
+
+    def lease(self, worker: str, kinds: list[str]):
+        """Returns the best queued job of one of the `kinds`, or :data:`None` if none are queued."""
+        with self.lock:
+            self.workers[worker] = time.time()
+            best = None
+            for kind in kinds:
+                queue = self.queues.get(kind)
+                while queue and queue[0][2].state != QUEUED:  # finished while queued
+                    heapq.heappop(queue)
+                if queue and (best is None or queue[0][:2] < self.queues[best][0][:2]):
+                    best = kind
+            if best is None:
+                return None
+            _, _, job = heapq.heappop(self.queues[best])
+            job.state = LEASED
+            job.worker = worker
+            job.lease = uuid.uuid4().hex
+            job.expires = time.monotonic() + self.lease_ttl
+            job.attempts += 1
+            job.progress = {}
+        self.on_event('lease', job)
+        return job
+
+    def heartbeat(self, job_id: str, lease: str, progress: dict = None) -> bool:
+        """Renew a lease, returns :data:`False` if the lease was lost (the worker must stop the conversion)."""
+        with self.lock:
+            job = self._leased(job_id, lease)
+            if job is None:
+                return False
+            self.workers[job.worker] = time.time()
+            job.expires = time.monotonic() + self.lease_ttl
+            if progress:
+                job.progress = progress
+        if progress:
+            self.on_event('progress', job, progress=progress)
+        return True
+
+    def complete(self, job_id: str, lease: str, status: str, metrics: dict, message: str = '') -> bool:
+        """A worker finished a job, returns :data:`False` if the lease was lost.
+
+        A job that the worker aborted (e.g., the worker is stopping) is queued again.
+        """
+        with self.lock:
+            job = self._leased(job_id, lease)
+            if job is None:
+                return False
+            self.workers[job.worker] = time.time()
+            requeued = self._requeue(job) if status == 'aborted' else False
+            if requeued is False:
+                self._finish(job, status)
+        if requeued:
+            self.on_event('requeue', job, reason='aborted by the worker')
+        elif requeued is None:
+            self._finished(job, 'failed', metrics, f'aborted by the workers {job.attempts} times')
+        else:
+            self._finished(job, status, metrics, message)
+        return True
+
+    def expire(self) -> None:
+        """Queue the jobs whose lease expired again."""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if job.state == LEASED and job.expires < now:
+                    expired.append((job, self._requeue(job)))
+        for job, requeued in expired:
+            if requeued:
+                self.on_event('requeue', job, reason='the lease expired')
+            else:
+                self._finished(job, 'failed', {}, f'the lease expired {job.attempts} times')
+
+    def shutdown_jobs(self) -> None:
+        """Abort the jobs that have not finished, the workers stop them at their next heartbeat."""
+        with self.lock:
+            self.sealed = True
+            jobs = list(self.jobs.values())
+            for job in jobs:
+                self._finish(job, 'aborted')
+        for job in jobs:
+            self._finished(job, 'aborted', {}, '')
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'queued': sum(1 for job in self.jobs.values() if job.state == QUEUED),
+                'jobs': [job.to_dict() for job in self.jobs.values() if job.state == LEASED],
+                'workers': dict(self.workers),
+                'counts': dict(self.counts),
+                'sealed': self.sealed,
+            }
+
+    def close(self, linger: float = 0) -> None:
+        """Stop serving, after `linger` seconds so that the workers can be told to stop."""
+        if linger > 0:
+            time.sleep(linger)
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+    def _reap(self) -> None:
+        while not self.stopping.wait(1):
+            self.expire()
+
+    def _push(self, job: Job) -> None:
+        heapq.heappush(self.queues.setdefault(job.kind, []), (job.priority, next(self.counter), job))
+
+    def _leased(self, job_id: str, lease: str):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != LEASED or job.lease != lease:
+            return None
+        return job
+
+    def _requeue(self, job: Job):
+        """Returns whether the job was queued again, :data:`None` if it failed too many times."""
+        if job.attempts >= self.max_attempts:
+            self._finish(job, 'failed')
+            return None
+        job.state = QUEUED
+        job.lease = ''
+        self._push(job)
+        return True
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.state = status
+        self.jobs.pop(job.id, None)
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+    def _finished(self, job: Job, status: str, metrics: dict, message: str) -> None:
+        if metrics:
+            job.conversion.metrics = metrics
+        job.conversion.message = message
+        self.on_event('finish', job, status=status)
+        job.future.set_result(status)
+
+
+class JobClient:
+
+    def __init__(self, url: str, token: str = None, timeout: float = 10) -> None:
+        """Lease jobs from a :class:`JobServer` and report their progress.
+
+        Raises :exc:`OSError` if the server cannot be reached.
+        """
+        super(JobClient, self).__init__()
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.finished = False  # whether the server has no more jobs
+
+    def request(self, path: str, body: dict) -> tuple[int, dict]:
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode(),
+                                         headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+                return response.status, json.loads(data) if data else {}
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                raise PermissionError(f'{self.url} requires a valid server_token') from None
+            return e.code, {}
+
+    def lease(self, worker: str, kinds: list[str]):
+        """Returns a job, or :data:`None` if no job is queued (:attr:`finished` is set if there will be none)."""
+        code, job = self.request('/lease', {'worker': worker, 'kinds': kinds})
+        self.finished = code == 410
+        return job if code == 200 else None
+
+    def heartbeat(self, job: dict, progress: dict = None) -> bool:
+        """Renew the lease of a job, returns :data:`False` if the lease was lost."""
+        code, _ = self.request('/heartbeat', {'id': job['id'], 'lease': job['lease'], 'progress': progress})
+        return code == 200
+
+    def complete(self, job: dict, status: str, metrics: dict, message: str = '') -> bool:
+        code, _ = self.request('/complete', {'id': job['id'], 'lease': job['lease'], 'status': status,
+                                             'metrics': metrics, 'message': message})
+        return code == 200
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import cache_dir
+
+LINK = 'link'
+REPORT = 'report'
+CONVERT = 'convert'
+DUPLICATES = (LINK, REPORT, CONVERT)
+
+
+def get_duplicates(config: dict) -> str:
+    """Returns what to do with a video whose content was already converted, from the configuration.
+
+    ``'link'`` (hard link the existing output), ``'report'`` (skip the
+    video) or ``'convert'`` (convert it again).
+    """
+    duplicates = config.get('duplicates', LINK)
+    if duplicates not in DUPLICATES:
+        raise ValueError(f'Invalid duplicates {duplicates!r}, must be one of {DUPLICATES}')
+    return duplicates
+
+
+def fingerprint(path: str, samples: int = 8, chunk_size: int = 65536) -> str:
+    """Returns a fingerprint of the content of a file.
+
+    The fingerprint is the size of the file and a hash of `samples` chunks
+    that are spread evenly across it (the first and last chunk included),
+    so only a small part of a large file is read.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as fp:
+        if size <= samples * chunk_size:
+            digest.update(fp.read())
+        else:
+            for i in range(samples):
+                fp.seek((size - chunk_size) * i // (samples - 1))
+                digest.update(fp.read(chunk_size))
+    return f'{size:x}-{digest.hexdigest()}'
+
+
+class FingerprintIndex:
+
+    def __init__(self, path: str = None) -> None:
+        """An on-disk index of the content of the videos and the outputs they were converted to.
+
+        The fingerprint of a video (see :func:`fingerprint`) is only valid
+        while the size and the modification time of the file are unchanged.
+        An output is recorded with the fingerprint of its video, a hash of how
+        it was converted (the recipe, see :meth:`Conversion.recipe
+        <convert_mp4.conversion.Conversion.recipe>`) and its probed duration
+        and streams, so an output that is unchanged since it was recorded is
+        valid without probing it and a video with the same content and recipe
+        is a duplicate.
+        """
+        super(FingerprintIndex, self).__init__()
+        if path is None:
+            path = os.path.join(cache_dir(), 'fingerprints.sqlite3')
+        self.path = path
+        self.lock = threading.Lock()
+        self.claimed = threading.Condition()
+        self.claims: set[tuple] = set()  # the (fingerprint, recipe) that are being converted
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, '
+                'size INTEGER NOT NULL, '
+                'mtime INTEGER NOT NULL, '
+                'fingerprint TEXT NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS outputs ('
+                'output TEXT PRIMARY KEY, '
+                'size INTEGER NOT NULL, '
+                'mtime INTEGER NOT NULL, '
+                'duration REAL NOT NULL, '
+                'streams TEXT NOT NULL, '
+                'source TEXT NOT NULL, '
+                'fingerprint TEXT NOT NULL, '
+                'recipe TEXT NOT NULL, '
+                'rendition INTEGER NOT NULL, '
+                'updated REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS outputs_content ON outputs (fingerprint, recipe, rendition)'
+            )
+
+    def fingerprint(self, path: str) -> str:
+        """Returns the fingerprint of a file, it is only calculated if the file changed.
+
+        Raises :exc:`OSError` if the file cannot be read.
+        """
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT fingerprint FROM files WHERE path=? AND size=? AND mtime=?',
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        value = fingerprint(path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, value)
+            )
+        return value
+
+    def record(self,
+               output: str,
+               info: dict,
+               source: str,
+               fingerprint: str = '',
+               recipe: str = '',
+               rendition: int = 0) -> None:
+        """Record an output file that is valid, `info` is its duration and streams (see :func:`~convert_mp4.conversion.verify`)."""
+        try:
+            stat = os.stat(output)
+        except OSError:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (output, stat.st_size, stat.st_mtime_ns, info['duration'], json.dumps(info['streams']),
+                 source, fingerprint, recipe, rendition, time.time())
+            )
+
+    def get(self, output: str):
+        """Returns the record of an output file, or :data:`None` if it is not recorded or it changed since."""
+        try:
+            stat = os.stat(output)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT output, duration, streams, source, fingerprint, recipe, rendition FROM outputs '
+                'WHERE output=? AND size=? AND mtime=?',
+                (output, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return None if row is None else self._output(row)
+
+    def find(self, fingerprint: str, recipe: str, rendition: int):
+        """Returns the record of an output of a video with the same content and recipe, or :data:`None`."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT output FROM outputs WHERE fingerprint=? AND recipe=? AND rendition=? ORDER BY updated DESC',
+                (fingerprint, recipe, rendition)
+            ).fetchall()
+        for row in rows:
+            record = self.get(row[0])
+            if record is not None:
+                return record
+        return None
+
+    def claim(self, key: tuple, timeout: float) -> bool:
+        """Claim converting the content `key` (fingerprint, recipe), waits while another conversion has it.
+
+        Returns whether it was claimed within `timeout` seconds.
+        """
+        with self.claimed:
+            if not self.claimed.wait_for(lambda: key not in self.claims, timeout):
+                return False
+            self.claims.add(key)
+            return True
+
+    def release(self, key: tuple) -> None:
+        with self.claimed:
+            self.claims.discard(key)
+            self.claimed.notify_all()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def _output(row: tuple) -> dict:
+        output, duration, streams, source, fingerprint, recipe, rendition = row
+        return {'output': output, 'duration': duration, 'streams': json.loads(streams), 'source': source,
+                'fingerprint': fingerprint, 'recipe': recipe, 'rendition': rendition}
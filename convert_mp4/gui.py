@@ -0,0 +1,561 @@
+import os
+import sys
+import time
+from functools import partial
+
+from msl.qt import Button
+from msl.qt import Qt
+from msl.qt import QtCore
+from msl.qt import QtWidgets
+from msl.qt import application
+from msl.qt import prompt
+from msl.qt.convert import to_qicon
+from msl.qt.utils import drag_drop_paths
+from msl.qt.utils import screen_geometry
+
+from . import EXTENSIONS
+from . import ffmpeg_version
+from .cli import Session
+from .conversion import output_path
+from .costs import DEADLINE
+from .costs import finish_times
+from .costs import get_order
+from .costs import priority
+from .model import BURN
+from .model import MovieTableModel
+from .model import ProgressDelegate
+from .model import STATUS
+from .model import SUBTITLES
+from .model import SubtitleDelegate
+from .model import TITLE
+from .model import TableDelegate
+from .movie import Movie
+from .planner import Plan
+from .probe import probe_error
+from .progress import Progress
+from .progress import format_bytes
+from .progress import format_duration
+from .scanner import Scanner
+from .scanner import extensions_regex
+from .scanner import is_candidate
+from .telemetry import report
+from .workers import CalibrateWorker
+from .workers import ConvertMovieWorker
+from .workers import LoadSubtitleWorker
+from .workers import ProbeSignaler
+from .workers import ScanWorker
+
+
+class VideoConverter(QtWidgets.QMainWindow):
+
+    def __init__(self, config):
+        super(VideoConverter, self).__init__()
+        self.config = config
+        self.session = Session(config)
+        self.session.open_caches()
+        self.convert_pools = {}
+        self.limits = self.session.limits
+        for kind, limit in self.limits.items():
+            self.convert_pools[kind] = QtCore.QThreadPool()
+            self.convert_pools[kind].setMaxThreadCount(limit)
+        self.subtitle_pool = QtCore.QThreadPool()
+        self.calibrate_pool = QtCore.QThreadPool()
+        self.calibrate_pool.setMaxThreadCount(1)
+        self.calibrate_workers: list[CalibrateWorker] = []
+        self.scan_pool = QtCore.QThreadPool()
+        self.scan_workers: list[ScanWorker] = []
+        self.subtitle_workers: list[LoadSubtitleWorker] = []
+        self.convert_workers: dict[str, ConvertMovieWorker] = {}  # path -> worker
+        self.devices = self.session.devices
+        self.extensions = config.get('extensions', EXTENSIONS)
+        self.extensions_regex = extensions_regex(self.extensions)
+
+        self.cache = self.session.cache
+        self.sidecars = self.session.sidecars
+        self.telemetry = self.session.telemetry
+        self.journal = self.session.journal
+        self.index = self.session.index
+        self.restoring: dict[str, dict] = {}  # path -> the job in the journal that did not finish
+        self.costs = self.session.costs
+        self.order = get_order(config)
+        self.deadline = 3600. * config.get('deadline', 24)
+        self.epoch = time.time()
+
+        self.event_stop = self.session.event_stop
+
+        self.probe_signaler = ProbeSignaler()
+        self.probe_signaler.finished.connect(self.on_probed)
+        self.probe_signaler.attached.connect(self.on_attached)
+        self.probe_pool = self.session.probe_pool(self.load_movie, self.probe_signaler.finished.emit)
+
+        # the files that are visible in the table are probed first
+        self.priority_timer = QtCore.QTimer(self)
+        self.priority_timer.setSingleShot(True)
+        self.priority_timer.setInterval(200)
+        self.priority_timer.timeout.connect(self.prioritize_visible)
+
+        # the predicted time until the queued conversions finish
+        self.eta_timer = QtCore.QTimer(self)
+        self.eta_timer.setInterval(1000)
+        self.eta_timer.timeout.connect(self.update_etas)
+
+        self.setAcceptDrops(True)
+
+        open_button = Button(
+            left_click=self.open_folder,
+            icon=QtWidgets.QStyle.StandardPixmap.SP_DialogOpenButton,
+            tooltip='Open all videos in a folder (and sub-folders)'
+        )
+        open_button.add_menu_item(
+            text='Open a video file',
+            triggered=self.open_filename
+        )
+
+        convert_button = Button(
+            left_click=self.convert,
+            icon=icon('convert.png'),
+            tooltip='Start converting'
+        )
+
+        abort_button = Button(
+            left_click=self.abort,
+            icon=icon('abort.png'),
+            tooltip='Abort searching for videos and conversions'
+        )
+
+        self.toolbar = QtWidgets.QToolBar()
+        self.toolbar.addWidget(open_button)
+        self.toolbar.addWidget(convert_button)
+        self.toolbar.addWidget(abort_button)
+        self.addToolBar(self.toolbar)
+
+        # disable being able to right-click on the toolbar and close it
+        self.setContextMenuPolicy(Qt.NoContextMenu)
+
+        self.model = MovieTableModel(self, describe=self.describe_plan,
+                                     burn=config.get('burn_subtitles', False))
+        self.model.choice_changed.connect(self.on_choice_changed)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.horizontalHeader().setSortIndicator(TITLE, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.Fixed)
+        self.table.setItemDelegateForColumn(TITLE, TableDelegate(self))
+        self.table.setItemDelegateForColumn(SUBTITLES, SubtitleDelegate(self))
+        self.table.setItemDelegateForColumn(STATUS, ProgressDelegate(self))
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.DoubleClicked |
+                                   QtWidgets.QAbstractItemView.EditTrigger.SelectedClicked)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.table.customContextMenuRequested.connect(self.on_table_menu)
+        self.table.verticalScrollBar().valueChanged.connect(self.priority_timer.start)
+
+        self.setCentralWidget(self.table)
+        self.statusBar()
+
+    def closeEvent(self, event):
+        if self.convert_workers:
+            if prompt.yes_no('Cancel all conversions in progress?'):
+                self.abort()
+                event.accept()
+            else:
+                event.ignore()
+        else:
+            for worker in self.scan_workers:
+                worker.scanner.cancel()
+            self.probe_pool.close()
+            event.accept()
+
+    def dragEnterEvent(self, event):
+        if is_candidate(drag_drop_paths(event), self.extensions_regex):
+            event.accept()
+        else:
+            event.ignore()
+
+    def dropEvent(self, event):
+        event.accept()
+        self.scan(drag_drop_paths(event))
+
+    def keyReleaseEvent(self, event):
+        super(VideoConverter, self).keyReleaseEvent(event)
+        if event.key() == Qt.Key_Delete:
+            rows = self.selected_rows()
+            if rows and prompt.yes_no('Delete the selected movies?'):
+                for row in rows:
+                    self.cancel(self.model.rows[row].path)
+                self.model.remove_rows(rows)
+
+    def selected_rows(self) -> list[int]:
+        return sorted(index.row() for index in self.table.selectionModel().selectedRows())
+
+    def on_table_menu(self, point: QtCore.QPoint) -> None:
+        paths = []
+        for row in self.selected_rows():
+            path = self.model.rows[row].path
+            if path in self.convert_workers:
+                paths.append(path)
+        if not paths:
+            return
+        menu = QtWidgets.QMenu(self)
+        text = 'Cancel conversion' if len(paths) == 1 else f'Cancel {len(paths)} conversions'
+        action = menu.addAction(text)
+        if menu.exec(self.table.viewport().mapToGlobal(point)) is action:
+            for path in paths:
+                self.cancel(path)
+
+    def scan(self, paths: list[str]) -> None:
+        """Search for videos in a background thread, the videos are loaded as they are found."""
+        scanner = Scanner(self.extensions_regex,
+                          sidecars=self.sidecars,
+                          max_depth=self.config.get('scan_max_depth'),
+                          exclude=self.config.get('scan_exclude', []),
+                          workers=self.config.get('scan_workers', 8))
+        worker = ScanWorker(scanner, paths, self.probe_pool.submit)
+        worker.signaler.found.connect(self.on_found)
+        worker.signaler.finished.connect(partial(self.on_scan_finished, worker))
+        self.scan_workers.append(worker)
+        self.statusBar().showMessage('Searching for videos...')
+        self.scan_pool.start(worker)
+
+    def on_scan_finished(self, worker: ScanWorker, count: int) -> None:
+        self.scan_workers.remove(worker)
+        if not self.scan_workers:
+            self.statusBar().showMessage(f'Found {count} videos', 5000)
+
+    def on_found(self, paths: list[str]) -> None:
+        if self.model.add_paths(paths):
+            self.priority_timer.start()
+
+    def load_movie(self, path: str) -> Movie:
+        """Called by the :class:`~convert_mp4.probe.ProbePool` (not in the GUI thread)."""
+        t0 = time.perf_counter()
+        try:
+            movie = Movie(path, cache=self.cache, sidecars=self.sidecars,
+                          timeout=self.config.get('probe_timeout', 60))
+        except Exception as e:
+            self.telemetry.record('probe', path=path, status='failed', wall=time.perf_counter() - t0,
+                                  cached=False, error=probe_error(e))
+            raise
+        self.telemetry.record('probe', path=path, status='done',
+                              wall=movie.probe_time, cached=movie.probe_cached)
+        movie.attach_sidecars(self.probe_signaler.attached.emit)
+        return movie
+
+    def on_probed(self, path: str, movie: Movie, error: str) -> None:
+        if path not in self.convert_workers:  # a file that is converting is not replaced
+            self.model.set_movie(path, movie, error)
+        if path not in self.restoring:
+            return
+        if movie is None or self.model.row(path) is None:
+            self.restoring.pop(path)
+            self.journal.update(path, 'failed', f'cannot probe: {error}' if error else 'removed')
+        elif movie.sidecars_attached:
+            self.resume(path)
+
+    def on_attached(self, movie: Movie) -> None:
+        """The subtitle files of a movie were attached (after it was probed, if its folder was being searched)."""
+        path = movie.path
+        row = self.model.row(path)
+        if row is None or row.movie is not movie:
+            return
+        self.model.update(path, column=SUBTITLES)
+        if path in self.restoring:
+            self.resume(path)
+
+    def resume(self, path: str) -> None:
+        """Convert a movie that did not finish (see :meth:`restore`) with the subtitle that was selected."""
+        job = self.restoring.pop(path)
+        row = self.model.row(path)
+        movie = row.movie
+        subtitle = job['subtitle']
+        if subtitle:
+            info = {k: v for k, v in subtitle.items() if k != 'burn'}
+            key = next((key for key, value in movie.subtitles.items() if value == info), '')
+            self.model.update(path, column=SUBTITLES, subtitle=key)
+            self.model.update(path, column=BURN, burn=subtitle.get('burn', row.burn))
+        self.start_conversion(row)
+        self.update_etas()
+
+    def restore(self) -> None:
+        """Ask whether to resume the conversions in the journal that did not finish."""
+        if self.journal is None:
+            return
+        jobs = [job for job in self.journal.unfinished() if job['path'] not in self.convert_workers]
+        if not jobs:
+            return
+        n = len(jobs)
+        if prompt.yes_no(f'Resume {n} conversion{"s" if n > 1 else ""} that did not finish?'):
+            for job in jobs:
+                self.restoring[job['path']] = job
+            self.scan([job['path'] for job in jobs])
+        else:
+            for job in jobs:
+                self.journal.update(job['path'], 'aborted')
+
+    def prioritize_visible(self) -> None:
+        first = self.table.rowAt(0)
+        if first < 0:
+            return
+        last = self.table.rowAt(self.table.viewport().height() - 1)
+        if last < 0:
+            last = self.model.rowCount() - 1
+        rows = self.model.rows[first:last + 1]
+        self.probe_pool.prioritize([row.path for row in rows if row.movie is None and not row.error])
+
+    def abort(self):
+        self.event_stop.set()
+        for worker in self.scan_workers:
+            worker.scanner.cancel()
+        for path in self.probe_pool.clear():
+            self.model.set_movie(path, error='aborted')
+        for path in self.restoring:
+            self.journal.update(path, 'aborted')
+        self.restoring.clear()
+        for path in list(self.convert_workers):
+            self.cancel(path)
+
+    def cancel(self, path: str) -> None:
+        """Cancel a queued or running conversion without waiting for ffmpeg to stop."""
+        worker = self.convert_workers.get(path)
+        if worker is None:
+            return
+        if self.convert_pools[worker.kind].tryTake(worker):  # had not started
+            if self.journal is not None:
+                self.journal.update(path, 'aborted')
+            worker.signaler.finished.emit(path, 'aborted')
+        else:
+            worker.conversion.cancel()
+
+    def convert(self):
+        self.event_stop.clear()
+        if not self.convert_workers:
+            self.telemetry.start_batch()
+        for row in self.model.rows:
+            if row.movie is None or row.path in self.convert_workers:  # not probed, or already queued or running
+                continue
+            self.start_conversion(row)
+        self.calibrate()
+        self.update_etas()
+
+    def calibrate(self) -> None:
+        """Encode a sample of a queued video of each codec that the cost model has no samples for.
+
+        The queue is reordered with the new predictions when the samples have been encoded.
+        """
+        if not self.config.get('cost_calibrate', True):
+            return
+        plans = {}
+        for worker in self.convert_workers.values():
+            plan = worker.conversion.plan()
+            if plan.video is not None and plan.work()['encode'] and \
+                    not self.costs.samples('encode', plan.video.codec):
+                plans.setdefault(plan.video.codec, plan)
+        if not plans:
+            return
+        worker = CalibrateWorker(self.costs, list(plans.values()), self.config.get('cost_sample_seconds', 5))
+        worker.signaler.finished.connect(partial(self.on_calibrated, worker))
+        self.calibrate_workers.append(worker)
+        self.calibrate_pool.start(worker)
+
+    def on_calibrated(self, calibrate: CalibrateWorker) -> None:
+        self.calibrate_workers.remove(calibrate)
+        for worker in self.convert_workers.values():
+            self.predict(worker)
+            if self.convert_pools[worker.kind].tryTake(worker):  # had not started, queue it again
+                self.convert_pools[worker.kind].start(worker, self.queue_priority(worker.key))
+        self.update_etas()
+
+    def predict(self, worker: ConvertMovieWorker) -> None:
+        """Predict how long a conversion takes and when it should start."""
+        conversion = worker.conversion
+        conversion.predicted = self.costs.predict(conversion.plan())
+        worker.key = priority(self.order, conversion.predicted, worker.movie.path, self.deadline)
+
+    def queue_priority(self, key: float) -> int:
+        """Convert a sort key to the priority of a QThreadPool (an int, the highest priority starts first)."""
+        if self.order == DEADLINE:
+            key -= self.epoch
+        return -int(max(-2e9, min(key, 2e9)))
+
+    def update_etas(self) -> None:
+        """Show when each queued conversion, and all conversions, are predicted to finish."""
+        if not self.convert_workers:
+            self.eta_timer.stop()
+            return
+        jobs = []
+        for path, worker in self.convert_workers.items():
+            conversion = worker.conversion
+            predicted = conversion.predicted or 0.
+            if conversion.last is None:
+                jobs.append((worker.key, path, worker.kind, predicted, False))
+            else:
+                remaining = conversion.last.eta if conversion.last.eta >= 0 else predicted
+                jobs.append((worker.key, path, worker.kind, remaining, True))
+        jobs.sort(key=lambda job: job[0])
+        finish = finish_times([job[1:] for job in jobs], self.limits)
+        for _, path, _, _, running in jobs:
+            if not running:
+                self.model.update(path, text=f'Queued | ETA {format_duration(finish[path])}')
+        n = len(jobs)
+        self.statusBar().showMessage(
+            f'{n} conversion{"s" if n > 1 else ""} | all done in {format_duration(max(finish.values()))}')
+        if not self.eta_timer.isActive():
+            self.eta_timer.start()
+
+    def start_conversion(self, row) -> None:
+        """Queue the conversion of the movie in a row of the table."""
+        path = row.path
+        self.model.update(path, percentage=0, text='%p%', tooltip='')
+
+        movie = row.movie
+        movie.subtitle = row.subtitle_info()
+
+        worker = ConvertMovieWorker(movie, self.event_stop, self.config,
+                                    journal=self.journal, devices=self.devices, index=self.index)
+        worker.signaler.percentage.connect(partial(self.on_percentage, path))
+        worker.signaler.stats.connect(partial(self.on_stats, path))
+        worker.signaler.error.connect(partial(self.on_error, path))
+        worker.signaler.finished.connect(self.on_convert_finished)
+        if self.journal is not None:
+            self.journal.queue(path, worker.outfile, movie.subtitle)
+        self.predict(worker)
+        self.convert_workers[path] = worker
+        self.convert_pools[worker.kind].start(worker, self.queue_priority(worker.key))
+
+    def on_percentage(self, path: str, value: int) -> None:
+        self.model.update(path, percentage=value)
+
+    def on_error(self, path: str, message: str) -> None:
+        self.model.update(path, text=message)
+
+    def on_convert_finished(self, path: str, status: str) -> None:
+        worker = self.convert_workers.pop(path, None)
+        if status == 'aborted':
+            self.model.update(path, text='Aborted %p%')
+        if worker is not None and worker.conversion.metrics:
+            self.telemetry.record('conversion', **worker.conversion.metrics)
+            self.costs.learn(worker.conversion)
+        if not self.convert_workers:
+            self.eta_timer.stop()
+            self.statusBar().showMessage(report(self.telemetry.summary()))
+
+    def on_stats(self, path: str, info: Progress) -> None:
+        outputs = ' | '.join(f'{name or "default"} {format_bytes(size)}' for name, size in info.outputs)
+        if info.done:
+            text = '%p%'
+        else:
+            text = f'%p% | {info.speed:.2f}x | ETA {format_duration(info.eta)}'
+            if outputs:
+                text += f' | {outputs}'
+        tooltip = (
+            f'{info.fps:.1f} fps, {info.speed:.2f}x, '
+            f'{format_bytes(info.total_size)} written, '
+            f'{format_duration(info.out_time)} of {format_duration(info.duration)}'
+        )
+        for name, size in info.outputs:
+            tooltip += f'\n{name or "default"}: {format_bytes(size)} written'
+        self.model.update(path, text=text, tooltip=tooltip)
+
+    def on_choice_changed(self, path: str) -> None:
+        """The subtitle or the Burn in value of a movie changed."""
+        row = self.model.row(path)
+        if row.movie is None:
+            return
+        if path not in self.convert_workers:
+            row.movie.subtitle = row.subtitle_info()
+            self.model.update(path, tooltip='')  # show the new plan
+        info = row.movie.subtitles.get(row.subtitle)
+        if not info or row.preview:
+            return
+        load_subtitles = LoadSubtitleWorker(row.movie, info)
+        load_subtitles.signaler.finished.connect(partial(self.on_change_tooltip, load_subtitles))
+        self.subtitle_workers.append(load_subtitles)
+        self.subtitle_pool.start(load_subtitles)
+
+    def describe_plan(self, movie: Movie) -> str:
+        """Returns the planned ffmpeg command and its estimated cost."""
+        try:
+            return Plan(movie, self.config).describe(output_path(movie.path, self.config.get('output_dir')))
+        except (KeyError, ValueError) as e:
+            return f'Cannot plan the conversion: {e}'
+
+    def on_change_tooltip(self, worker: LoadSubtitleWorker, path: str, subtitles: list[str]) -> None:
+        self.subtitle_workers.remove(worker)
+        self.telemetry.record('subtitle', path=path, status='done', wall=worker.wall)
+        row = self.model.row(path)
+        if row is not None and row.movie.subtitles.get(row.subtitle) == worker.info:
+            self.model.update(path, column=SUBTITLES, preview=''.join(subtitles).rstrip())
+
+    def open(self, file_or_folder):
+        if file_or_folder:
+            self.scan([file_or_folder])
+
+    def open_folder(self):
+        self.open(prompt.folder(directory=self.config.get('root_dir')))
+
+    def open_filename(self):
+        extensions = ' *.'.join(self.extensions)
+        self.open(prompt.filename(
+            filters=f'Video (*.{extensions})',
+            directory=self.config.get('root_dir')
+        ))
+
+
+def icon(filename):
+    return to_qicon(os.path.join(os.path.dirname(__file__), 'images', filename))
+
+
+def find_ffmpeg():
+    """Returns the ffmpeg version, prompting for the executable if it is not on PATH."""
+    while True:
+        try:
+            version = ffmpeg_version()
+        except RuntimeError as e:
+            prompt.critical(str(e))
+            return
+        if version is not None:
+            return version
+        f = prompt.filename(title='Select the ffmpeg executable',
+                            filters={'ffmpeg': '.exe'})
+        if not f:
+            return
+        os.environ['PATH'] += os.pathsep + os.path.dirname(f)
+
+
+def run(config):
+    version = find_ffmpeg()
+    if version is None:
+        sys.exit('ffmpeg not found')
+
+    # disable Windows hibernation
+    previous_state = 0
+    if sys.platform == 'win32':
+        import ctypes
+        SetThreadExecutionState = ctypes.windll.kernel32.SetThreadExecutionState  # noqa
+        SetThreadExecutionState.argtypes = [ctypes.c_longlong]
+        SetThreadExecutionState.restype = ctypes.c_longlong
+        ES_CONTINUOUS = 0x80000000  # noqa
+        ES_DISPLAY_REQUIRED = 0x00000002  # noqa
+        ES_SYSTEM_REQUIRED = 0x00000001  # noqa
+        previous_state = SetThreadExecutionState(ES_CONTINUOUS | ES_DISPLAY_REQUIRED | ES_SYSTEM_REQUIRED)
+        if previous_state == 0:
+            print('Error calling SetThreadExecutionState')
+
+    app = application()
+    main = VideoConverter(config)
+    main.setWindowTitle(f'MP4 Converter || ffmpeg {version}')
+    main.setWindowIcon(icon('favicon.ico'))
+    rect = screen_geometry(main)
+    main.resize(rect.width()//2, rect.height()//2)
+    main.show()
+    main.restore()
+    try:
+        app.exec()
+    finally:
+        main.session.close()
+        # reset Windows hibernation
+        if previous_state:
+            if SetThreadExecutionState(previous_state) == 0:  # noqa: SetThreadExecutionState exists
+                input('Cannot reset SetThreadExecutionState')
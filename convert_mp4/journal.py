@@ -0,0 +1,94 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import cache_dir
+
+QUEUED = 'queued'
+RUNNING = 'running'
+UNFINISHED = (QUEUED, RUNNING)
+PLACEHOLDERS = ', '.join('?' * len(UNFINISHED))  # of the UNFINISHED states in a query
+
+
+class Journal:
+
+    def __init__(self, path: str = None, keep_days: float = 30) -> None:
+        """A persistent record of the state of each conversion.
+
+        A conversion is ``'queued'`` when it is submitted, ``'running'`` while
+        ffmpeg runs and then ``'done'``, ``'skipped'``, ``'failed'`` or
+        ``'aborted'``. A conversion that is still queued or running when the
+        journal is opened did not finish (e.g., the computer crashed) and can
+        be restored. Finished conversions are removed after `keep_days`.
+        """
+        super(Journal, self).__init__()
+        if path is None:
+            path = os.path.join(cache_dir(), 'journal.sqlite3')
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'path TEXT PRIMARY KEY, '
+                'output TEXT NOT NULL, '
+                'state TEXT NOT NULL, '
+                'subtitle TEXT NOT NULL, '
+                'message TEXT NOT NULL, '
+                'updated REAL NOT NULL)'
+            )
+            self.connection.execute(
+                f'DELETE FROM jobs WHERE state NOT IN ({PLACEHOLDERS}) AND updated < ?',
+                (*UNFINISHED, time.time() - keep_days * 86400)
+            )
+
+    def queue(self, path: str, output: str, subtitle: dict) -> None:
+        """Record that a video is queued to be converted (with the selected subtitle)."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+                (path, output, QUEUED, json.dumps(subtitle or {}), '', time.time())
+            )
+
+    def update(self, path: str, state: str, message: str = '') -> None:
+        """Update the state of a conversion that was queued."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state=?, message=?, updated=? WHERE path=?',
+                (state, message, time.time(), path)
+            )
+
+    def get(self, path: str):
+        """Returns the job of a video, or :data:`None` if it was never queued."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT path, output, state, subtitle, message, updated FROM jobs WHERE path=?', (path,)
+            ).fetchone()
+        return None if row is None else self._job(row)
+
+    def is_output(self, path: str) -> bool:
+        """Whether a file is the output of a conversion in the journal."""
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM jobs WHERE output=?', (path,)).fetchone()
+        return row is not None
+
+    def unfinished(self) -> list[dict]:
+        """Returns the jobs that are queued or running, in the order they were queued."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path, output, state, subtitle, message, updated FROM jobs '
+                f'WHERE state IN ({PLACEHOLDERS}) ORDER BY updated', UNFINISHED
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def _job(row: tuple) -> dict:
+        path, output, state, subtitle, message, updated = row
+        return {'path': path, 'output': output, 'state': state,
+                'subtitle': json.loads(subtitle), 'message': message, 'updated': updated}
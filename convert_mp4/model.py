@@ -0,0 +1,281 @@
+import os
+
+from msl.qt import Qt
+from msl.qt import QtCore
+from msl.qt import QtWidgets
+from msl.qt import Signal
+
+from .movie import Movie
+
+TITLE, SUBTITLES, BURN, STATUS = range(4)
+HEADERS = ('Title', 'Subtitles', 'Burn in', 'Status')
+
+# custom roles
+PERCENTAGE_ROLE = Qt.UserRole
+CHOICES_ROLE = Qt.UserRole + 1
+
+
+class Row:
+
+    __slots__ = ('path', 'title', 'movie', 'error', 'subtitle', 'burn', 'percentage', 'text', 'tooltip', 'preview')
+
+    def __init__(self, path: str, movie: Movie = None, burn: bool = False) -> None:
+        """The state of a movie in the table, `movie` is :data:`None` until the file has been probed."""
+        self.path = path
+        self.title = os.path.basename(path)
+        self.movie = movie
+        self.error = ''  # why the file could not be probed
+        self.subtitle = ''  # a key in movie.subtitles, '' for no subtitle
+        self.burn = burn
+        self.percentage = -1  # -1 means the conversion has not started
+        self.text = '%p%'  # the text of the progress bar, %p is replaced by the percentage
+        self.tooltip = ''  # of the Status column, the plan is shown if empty
+        self.preview = ''  # the first few cues of the selected subtitle
+
+    def subtitle_info(self) -> dict:
+        """Returns the selected subtitle (and whether to burn it in)."""
+        info = self.movie.subtitles.get(self.subtitle) if self.movie else None
+        if not info:
+            return {}
+        return dict(info, burn=self.burn)
+
+
+def is_checked(value) -> bool:
+    """Whether a Qt.CheckStateRole value (an enum or an int, depending on the Qt binding) is checked."""
+    return Qt.CheckState(value) == Qt.Checked
+
+
+class MovieTableModel(QtCore.QAbstractTableModel):
+
+    choice_changed = Signal(str)  # path, the subtitle or burn in changed
+
+    def __init__(self, parent=None, describe=None, burn: bool = False) -> None:
+        """The movies in the table, one :class:`Row` per movie.
+
+        A row is found by the path of the movie in constant time. The
+        `describe` callable returns the tooltip of the Status column of
+        a movie that has not been converted (it is only called when the
+        tooltip is shown) and `burn` is the default value of the Burn in
+        column.
+        """
+        super(MovieTableModel, self).__init__(parent)
+        self.rows: list[Row] = []
+        self.positions: dict[str, int] = {}  # path -> row number
+        self.describe = describe or (lambda movie: '')
+        self.burn = burn
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+
+    def rowCount(self, parent=QtCore.QModelIndex()):  # noqa: QModelIndex() default
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):  # noqa: QModelIndex() default
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation != Qt.Horizontal:
+            return None
+        if role == Qt.DisplayRole:
+            return HEADERS[section]
+        if role == Qt.ToolTipRole and section == BURN:
+            return ('Burn the subtitles into the video (requires the video to be transcoded), '
+                    'otherwise text-based subtitles are muxed as a separate stream')
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == TITLE:  # read only, see TableDelegate
+            flags |= Qt.ItemIsEditable
+        elif index.column() == SUBTITLES and self.rows[index.row()].movie is not None:
+            flags |= Qt.ItemIsEditable
+        elif index.column() == BURN:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = index.column()
+        if column == TITLE:
+            if role in (Qt.DisplayRole, Qt.EditRole):
+                return row.title
+        elif column == SUBTITLES:
+            if role in (Qt.DisplayRole, Qt.EditRole):
+                return row.subtitle
+            if role == Qt.ToolTipRole:
+                return row.preview or None
+            if role == CHOICES_ROLE:
+                return [''] + list(row.movie.subtitles if row.movie else ())
+        elif column == BURN:
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if row.burn else Qt.Unchecked
+        elif column == STATUS:
+            if role == Qt.DisplayRole:
+                if row.error:
+                    return f'Cannot probe: {row.error}'
+                if row.movie is None:
+                    return 'Probing...'
+                return '' if row.percentage < 0 else row.text.replace('%p', str(row.percentage))
+            if role == PERCENTAGE_ROLE:
+                return row.percentage
+            if role == Qt.ToolTipRole:
+                if row.movie is None:
+                    return row.error or 'Waiting for ffprobe'
+                return row.tooltip or self.describe(row.movie)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        row = self.rows[index.row()]
+        if index.column() == SUBTITLES and role == Qt.EditRole:
+            if value == row.subtitle:
+                return False
+            row.subtitle = value
+            row.preview = ''
+        elif index.column() == BURN and role == Qt.CheckStateRole:
+            row.burn = is_checked(value)
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        self.choice_changed.emit(row.path)
+        return True
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        keys = {
+            TITLE: lambda r: r.title,
+            SUBTITLES: lambda r: r.subtitle,
+            BURN: lambda r: r.burn,
+            STATUS: lambda r: r.percentage,
+        }
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        paths = [self.rows[index.row()].path for index in persistent]
+        self.rows.sort(key=keys[column], reverse=order == Qt.DescendingOrder)
+        self._reindex()
+        self.changePersistentIndexList(
+            persistent, [self.index(self.positions[p], i.column()) for p, i in zip(paths, persistent)])
+        self.layoutChanged.emit()
+
+    def _reindex(self) -> None:
+        self.positions = {row.path: i for i, row in enumerate(self.rows)}
+
+    def add_paths(self, paths: list[str]) -> list[str]:
+        """Append the files that are not in the table yet in a single insert, returns their paths."""
+        new = []
+        for path in paths:
+            if path not in self.positions:
+                self.positions[path] = -1  # also skips duplicates in `paths`
+                new.append(path)
+        if new:
+            first = len(self.rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(new) - 1)
+            for path in new:
+                self.positions[path] = len(self.rows)
+                self.rows.append(Row(path, burn=self.burn))
+            self.endInsertRows()
+            if self.sort_column >= 0:
+                self.sort(self.sort_column, self.sort_order)
+        return new
+
+    def set_movie(self, path: str, movie: Movie = None, error: str = '') -> None:
+        """Set the result of probing a file, the `error` message if it could not be probed."""
+        position = self.positions.get(path)
+        if position is None:
+            return
+        row = self.rows[position]
+        row.movie = movie
+        row.error = error
+        row.subtitle = row.preview = row.tooltip = ''
+        row.percentage = -1
+        self.dataChanged.emit(self.index(position, 0), self.index(position, len(HEADERS) - 1))
+
+    def remove_rows(self, positions: list[int]) -> None:
+        """Remove the rows at the specified positions."""
+        for position in sorted(set(positions), reverse=True):
+            self.beginRemoveRows(QtCore.QModelIndex(), position, position)
+            del self.rows[position]
+            self.endRemoveRows()
+        self._reindex()
+
+    def find(self, path: str):
+        """Returns the row number of a movie, or -1 if it is not in the table."""
+        return self.positions.get(path, -1)
+
+    def row(self, path: str):
+        """Returns the :class:`Row` of a movie, or :data:`None` if it is not in the table."""
+        position = self.positions.get(path)
+        return None if position is None else self.rows[position]
+
+    def update(self, path: str, column: int = STATUS, **attributes) -> None:
+        """Update the attributes of the :class:`Row` of a movie and repaint a cell."""
+        position = self.positions.get(path)
+        if position is None:
+            return
+        row = self.rows[position]
+        for name, value in attributes.items():
+            setattr(row, name, value)
+        index = self.index(position, column)
+        self.dataChanged.emit(index, index)
+
+
+class TableDelegate(QtWidgets.QItemDelegate):
+
+    def __init__(self, parent):
+        """Allows for the title to be selectable while also in read-only mode."""
+        super(TableDelegate, self).__init__(parent=parent)
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QLineEdit(parent=parent)
+        editor.setFrame(False)
+        editor.setReadOnly(True)
+        return editor
+
+
+class SubtitleDelegate(QtWidgets.QStyledItemDelegate):
+
+    def __init__(self, parent):
+        """A combobox to select a subtitle, only created while a cell is edited."""
+        super(SubtitleDelegate, self).__init__(parent=parent)
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QComboBox(parent=parent)
+        editor.addItems(index.data(CHOICES_ROLE))
+        editor.activated.connect(lambda *args: self.commit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
+
+    def commit(self, editor: QtWidgets.QComboBox) -> None:
+        self.commitData.emit(editor)
+        self.closeEditor.emit(editor)
+
+
+class ProgressDelegate(QtWidgets.QStyledItemDelegate):
+
+    def __init__(self, parent):
+        """Paints a progress bar (no widget is created for each row)."""
+        super(ProgressDelegate, self).__init__(parent=parent)
+
+    def paint(self, painter, option, index):
+        percentage = index.data(PERCENTAGE_ROLE)
+        if percentage is None or percentage < 0:
+            super(ProgressDelegate, self).paint(painter, option, index)
+            return
+        bar = QtWidgets.QStyleOptionProgressBar()
+        bar.rect = option.rect
+        bar.state = option.state
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = percentage
+        bar.text = index.data(Qt.DisplayRole)
+        bar.textVisible = True
+        bar.textAlignment = Qt.AlignCenter
+        style = option.widget.style() if option.widget else QtWidgets.QApplication.style()
+        style.drawControl(QtWidgets.QStyle.ControlElement.CE_ProgressBar, bar, painter)
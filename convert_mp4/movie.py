@@ -1,27 +1,41 @@
-import json
 import os
 import re
-import subprocess
-import tempfile
+import time
+from typing import Callable
 
-from msl.io import search
+from .probe import ffprobe
+from .probe import subtitle_streams
+from .sidecars import SidecarIndex
+from .subtitles import PREVIEW_CUES
+from .subtitles import preview
 
 
 class Movie:
 
     english_regex = re.compile(r'eng', flags=re.IGNORECASE)
 
-    def __init__(self, path):
+    def __init__(self, path, cache=None, sidecars=None, timeout=None):
         super(Movie, self).__init__()
         self.path = path
         self.directory, self.title = os.path.split(path)
         self.subtitle = {}
+        self.sidecars = SidecarIndex() if sidecars is None else sidecars
+
+        t0 = time.perf_counter()
+        stat = os.stat(path)
+        cached = None if cache is None else cache.get(path, stat)
+        self.probe_cached = cached is not None
+        if cached is None:
+            self.metadata = ffprobe(path, timeout=timeout)
+            streams = subtitle_streams(self.metadata)
+            if cache is not None:
+                cache.put(path, stat, self.metadata, streams)
+        else:
+            self.metadata, streams = cached
+        self.probe_time = time.perf_counter() - t0
 
-        self.subtitles = self.get_subtitles()
-
-        cmd = ['ffprobe', '-v', 'error', '-of', 'json',
-               '-show_entries', 'stream:format', self.path]
-        self.metadata = json.loads(subprocess.check_output(cmd))
+        self.subtitles = self.get_subtitles(streams)  # the sidecar files are added by attach_sidecars
+        self.sidecars_attached = False
 
         self.duration = float(self.metadata['format']['duration'])
 
@@ -40,76 +54,52 @@ class Movie:
     def __repr__(self):
         return f'Movie<{self.title}>'
 
-    def get_subtitles(self) -> dict:
-        subtitles_cmd = [
-            'ffprobe', '-v', 'error', '-select_streams', 's',
-            '-show_entries', 'stream=index:stream=codec_name:stream_tags=language',
-            '-of', 'csv=p=0', self.path
-        ]
-        out = subprocess.check_output(subtitles_cmd)
-
+    def get_subtitles(self, streams: list[list[str]]) -> dict:
         subs = {}
-        for index, line in enumerate(out.decode().splitlines()):
-            split = line.split(',')
-            codec, lang = '', ''
-            if len(split) == 3:
-                _, codec, lang = split
-            elif len(split) == 2:
-                _, codec = split
-
+        for index, (codec, lang) in enumerate(streams):
             if self.english_regex.search(lang):
                 subs[f'English[{index}]'] = {'index': index, 'codec': codec, 'path': None}
-
-        name, _ = os.path.splitext(self.title)
-        for srt in search(self.directory, pattern=r'\.(srt|idx|ass)$', levels=None):
-            if name not in srt:
-                continue
-            title = os.path.basename(srt)
-            srt_name, _ = os.path.splitext(title)
-            if srt_name == name or self.english_regex.search(title):
-                subs[title] = {'index': None, 'codec': None, 'path': srt}
-
         return dict(sorted(subs.items()))
 
-    def load_subtitle(self, info: dict) -> list[str]:
-        """Load subtitles from an external file or an internal stream."""
-        if info['path']:  # external file
-            ext = os.path.splitext(info['path'])[1].lower()
-            if ext == '.srt':
-                with open(info['path'], encoding='utf-8', errors='replace') as f:
-                    return f.readlines()
-            elif ext == '.ass':
-                # convert to srt format
-                name, _ = os.path.splitext(os.path.basename(info['path']))
-                outfile = os.path.join(tempfile.gettempdir(), f'{name}.srt')
-                subprocess.run(['ffmpeg', '-i', info['path'], '-c:s', 'srt', outfile], stderr=subprocess.PIPE)
-                with open(outfile, encoding='utf-8', errors='replace') as f:
-                    lines = f.readlines()
-                os.remove(outfile)
-                return lines
-            elif ext == '.idx':
-                return ['Picture-based IDX/SUB']
-            else:
-                raise ValueError(f'Unhandled subtitle extension {ext}')
-
-        # internal stream
-        if info['codec'] == 'subrip':
-            ext = 'srt'
-        elif info['codec'] == 'ass':
-            ext = 'ass'
-        else:
-            raise ValueError(f'Unhandled subtitle codec {info["codec"]}')
-
-        outfile = os.path.join(tempfile.gettempdir(), f'{self.title}.{ext}')
-        cmd = ['ffmpeg', '-i', self.path, '-c', 'copy',
-               '-map', f'0:s:{info["index"]}', outfile]
-
-        if os.path.exists(outfile):
-            os.remove(outfile)
-
-        subprocess.run(cmd, stderr=subprocess.PIPE)
-        with open(outfile, encoding='utf-8') as fp:
-            lines = fp.readlines()
-        os.remove(outfile)
-
-        return lines
+    def attach_sidecars(self, callback: Callable[['Movie'], None] = None) -> None:
+        """Add the subtitle files in the folder of the movie (or in sub-folders) to the subtitles.
+
+        Then `callback` is called with the movie. If a :class:`~convert_mp4.scanner.Scanner`
+        is still indexing the folder, this returns immediately and the files
+        are added later (see :meth:`SidecarIndex.when_indexed <convert_mp4.sidecars.SidecarIndex.when_indexed>`).
+        """
+        def attach():
+            subs = dict(self.subtitles)
+            name, _ = os.path.splitext(self.title)
+            for srt in self.sidecars.find(self.directory, name):
+                title = os.path.basename(srt)
+                srt_name, _ = os.path.splitext(title)
+                if srt_name == name or self.english_regex.search(title):
+                    subs[title] = {'index': None, 'codec': None, 'path': srt}
+            self.subtitles = dict(sorted(subs.items()))
+            self.sidecars_attached = True
+            if callback is not None:
+                callback(self)
+
+        self.sidecars.when_indexed(self.directory, attach)
+
+    def auto_subtitle(self) -> dict:
+        """Choose a subtitle without asking.
+
+        Prefers a sidecar file with the same name as the movie, then an
+        internal text-based English stream, then any other English subtitle.
+        """
+        name, _ = os.path.splitext(self.title)
+        for title, info in self.subtitles.items():
+            if info['path'] and os.path.splitext(title)[0] == name:
+                return info
+        for info in self.subtitles.values():
+            if info['codec'] in ('subrip', 'ass'):
+                return info
+        for info in self.subtitles.values():
+            return info
+        return {}
+
+    def load_subtitle(self, info: dict, cues: int = PREVIEW_CUES) -> list[str]:
+        """Load the first `cues` subtitles from an external file or an internal stream."""
+        return preview(self.path, info, limit=cues)
@@ -0,0 +1,453 @@
+import os
+from dataclasses import dataclass
+
+from .movie import Movie
+from .progress import format_duration
+from .subtitles import is_text
+
+COPY = 'copy'
+TAG = 'tag'
+TRANSCODE = 'transcode'
+
+# The action for each codec (codecs that are not listed are copied).
+# An action of 'tag:<fourcc>' copies the stream and sets its codec tag.
+PROFILES = {
+    'h264': {  # plays (almost) everywhere
+        'video': {'hevc': TRANSCODE},
+        'audio': {'mp3': TRANSCODE},
+    },
+    'hevc': {  # HEVC passthrough, the hvc1 tag is required by Apple devices
+        'video': {'hevc': 'tag:hvc1'},
+        'audio': {'mp3': TRANSCODE},
+    },
+}
+
+DEFAULT_PROFILE = 'h264'
+
+VIDEO_ENCODER = 'libx264'
+AUDIO_ENCODER = 'aac'
+
+# rough throughput, used to estimate the cost of a plan
+COPY_BYTES_PER_SECOND = 150e6
+ENCODE_PIXELS_PER_SECOND = 50e6  # libx264, ~1080p at 24 fps
+AUDIO_SPEED = 300.  # relative to real time
+
+# the default throughput of each kind of work, see Plan.work
+RATES = {
+    'copy': COPY_BYTES_PER_SECOND,
+    'encode': ENCODE_PIXELS_PER_SECOND,
+    'audio': AUDIO_SPEED,
+}
+
+
+def get_profile(config: dict) -> dict:
+    """Returns the target-device profile from the configuration.
+
+    The ``profile`` value is either the name of a profile in :data:`PROFILES`
+    or a mapping with the same structure.
+    """
+    profile = config.get('profile', DEFAULT_PROFILE)
+    if isinstance(profile, dict):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f'Invalid profile {profile!r}, must be one of {tuple(PROFILES)}') from None
+
+
+@dataclass
+class Output:
+    """A rendition of a movie, see :func:`get_outputs`."""
+    name: str = ''
+    height: int = 0  # scale the video to this height (0 keeps the height of the video)
+    crf: float = None  # the constant rate factor of the video encoder
+    bitrate: str = ''  # the video bitrate, e.g., '3M'
+    burn: bool = None  # whether to burn in the subtitle, None follows the selected subtitle
+    suffix: str = None  # appended to the name of the output file, default is '_<name>'
+
+    def __post_init__(self):
+        if self.suffix is None:
+            self.suffix = f'_{self.name}' if self.name else ''
+
+    def __str__(self):
+        options = [f'{self.height}p' if self.height else 'source size']
+        if self.crf is not None:
+            options.append(f'crf {self.crf:g}')
+        if self.bitrate:
+            options.append(f'{self.bitrate}b/s')
+        if self.burn is not None:
+            options.append('burn in' if self.burn else 'no burn in')
+        return f'output {self.name or "default"} ({", ".join(options)})'
+
+    @property
+    def forces_transcode(self) -> bool:
+        return bool(self.height or self.crf is not None or self.bitrate)
+
+    def path(self, outfile: str) -> str:
+        """Returns the path of the output file of this rendition, from the (default) `outfile`."""
+        root, ext = os.path.splitext(outfile)
+        return root + self.suffix + ext
+
+
+def get_outputs(config: dict) -> list[Output]:
+    """Returns the renditions that each movie is converted to.
+
+    The ``outputs`` value is a list of mappings with the fields of
+    :class:`Output`. By default, there is one output with the size of the
+    video. All outputs are written by a single ffmpeg process, so the video
+    is decoded once.
+    """
+    outputs = []
+    for item in config.get('outputs') or [{}]:
+        try:
+            outputs.append(Output(**item))
+        except TypeError:
+            raise ValueError(f'Invalid output {item!r}, the keys may be name, height, '
+                             f'crf, bitrate, burn and suffix') from None
+    suffixes = [output.suffix for output in outputs]
+    if len(set(suffixes)) != len(suffixes):
+        raise ValueError(f'The outputs must have different names (or suffixes), got {suffixes}')
+    return outputs
+
+
+def frame_rate(stream: dict) -> float:
+    num, _, den = stream.get('avg_frame_rate', '0/0').partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.
+
+
+@dataclass
+class StreamPlan:
+    kind: str  # video or audio
+    index: int  # the index of the stream of this kind in the input, i.e., 0:<v|a>:<index>
+    codec: str
+    action: str  # copy, tag or transcode
+    tag: str = ''
+    stream: dict = None  # from ffprobe
+
+    def __str__(self):
+        text = f'{self.kind} 0:{self.kind[0]}:{self.index} {self.codec} -> {self.action}'
+        if self.action == TAG:
+            text += f' {self.tag}'
+        elif self.action == TRANSCODE:
+            text += f' {VIDEO_ENCODER if self.kind == "video" else AUDIO_ENCODER}'
+        return text
+
+
+class Plan:
+
+    def __init__(self, movie: Movie, config: dict = None) -> None:
+        """Decide whether to copy, tag or transcode each stream of a movie.
+
+        The decision for each stream depends on the target-device profile.
+        If a subtitle is burned in, the video is always transcoded, otherwise
+        a text-based subtitle is muxed as a mov_text stream.
+        """
+        super(Plan, self).__init__()
+        config = config or {}
+        self.movie = movie
+        self.profile = get_profile(config)
+        self.threads = config.get('threads', 0)
+        self.outputs = get_outputs(config)
+        self.video = None
+        self.audio: list[StreamPlan] = []
+
+        counts = {'video': 0, 'audio': 0}
+        for stream in movie.metadata['streams']:
+            kind = stream.get('codec_type')
+            if kind not in counts:
+                continue
+            index = counts[kind]
+            counts[kind] += 1
+            if kind == 'video' and (self.video is not None or
+                                    stream.get('disposition', {}).get('attached_pic')):
+                continue  # only the first video stream, not cover art
+
+            codec = stream.get('codec_name', '')
+            action = self.profile.get(kind, {}).get(codec, COPY)
+            tag = ''
+            if action.startswith('tag:'):
+                action, tag = TAG, action[4:]
+            if kind == 'video' and self.burn_in:
+                action = TRANSCODE
+            plan = StreamPlan(kind, index, codec, action, tag=tag, stream=stream)
+            if kind == 'video':
+                self.video = plan
+            else:
+                self.audio.append(plan)
+
+    @property
+    def burn_in(self) -> bool:
+        """Whether a subtitle is burned into the video.
+
+        A text-based subtitle is muxed as a mov_text stream, unless ``burn``
+        is true in :attr:`Movie.subtitle <convert_mp4.movie.Movie.subtitle>`.
+        A picture-based subtitle is always burned in.
+        """
+        subtitle = self.movie.subtitle
+        if not subtitle:
+            return False
+        return subtitle.get('burn', False) or not is_text(subtitle)
+
+    @property
+    def mux_subtitle(self) -> bool:
+        """Whether a subtitle is muxed as a (soft) mov_text stream."""
+        return bool(self.movie.subtitle) and not self.burn_in
+
+    @property
+    def transcodes_video(self) -> bool:
+        return self.video is not None and self.video.action == TRANSCODE
+
+    @property
+    def multiple(self) -> bool:
+        """Whether the outputs differ from a single output with the size of the video."""
+        return self.outputs != [Output()]
+
+    def burns(self, output: Output) -> bool:
+        """Whether the subtitle is burned into an output."""
+        if not self.movie.subtitle or self.video is None:
+            return False
+        return self.burn_in if output.burn is None else output.burn
+
+    def muxes(self, output: Output) -> bool:
+        """Whether the subtitle is muxed into an output as a mov_text stream."""
+        return bool(self.movie.subtitle) and is_text(self.movie.subtitle) and not self.burns(output)
+
+    def transcodes(self, output: Output) -> bool:
+        """Whether the video of an output is transcoded."""
+        if self.video is None:
+            return False
+        if output.forces_transcode or self.burns(output):
+            return True
+        return self.profile.get('video', {}).get(self.video.codec, COPY) == TRANSCODE
+
+    def video_filters(self) -> list[str]:
+        """Returns the filters, other than burning in subtitles, for the video."""
+        if self.transcodes_video and self.video.stream.get('pix_fmt') != 'yuv420p':
+            return ['format=yuv420p']
+        return []
+
+    def video_codec_options(self) -> list[str]:
+        if self.video is None:
+            return []
+        if self.video.action == TRANSCODE:
+            cmd = ['-c:v', VIDEO_ENCODER]
+            if self.threads:
+                cmd.extend(['-threads', str(self.threads)])
+            return cmd
+        cmd = ['-c:v', 'copy']
+        if self.video.action == TAG:
+            cmd.extend(['-tag:v', self.video.tag])
+        return cmd
+
+    def audio_options(self, input_index: int = 0) -> list[str]:
+        """Returns the -map and codec options for all audio streams."""
+        cmd = []
+        for plan in self.audio:
+            cmd.extend(['-map', f'{input_index}:a:{plan.index}'])
+        for i, plan in enumerate(self.audio):
+            cmd.extend([f'-c:a:{i}', AUDIO_ENCODER if plan.action == TRANSCODE else 'copy'])
+        return cmd
+
+    def sidecar(self) -> str:
+        """Returns the path of the sidecar subtitle file, relative to the folder of the movie."""
+        return self.movie.subtitle['path'][len(os.path.dirname(self.movie.path))+1:]
+
+    def relative(self, path: str) -> str:
+        """Returns the filename of `path` if it is in the folder of the movie (ffmpeg runs there), otherwise the absolute path."""
+        if os.path.dirname(os.path.abspath(path)) == os.path.dirname(os.path.abspath(self.movie.path)):
+            return os.path.basename(path)
+        return os.path.abspath(path)
+
+    def command(self, outfile: str) -> list[str]:
+        """Returns the ffmpeg command (relative to the folder of the movie)."""
+        basename = os.path.basename(self.movie.path)
+        cmd = ['ffmpeg', '-i', basename]
+
+        video_map = None if self.video is None else f'0:v:{self.video.index}'
+        video_filters = self.video_filters()
+        subtitle = self.movie.subtitle
+        subtitle_map = None
+        if self.mux_subtitle:
+            if subtitle['index'] is not None:
+                subtitle_map = f'0:s:{subtitle["index"]}'
+            else:
+                cmd.extend(['-i', self.sidecar()])
+                subtitle_map = '1:s:0'
+        elif self.burn_in and self.video is not None:
+            index = subtitle['index']
+            if index is not None and not is_text(subtitle):  # picture based, e.g., PGS
+                graph = f'[{video_map}][0:s:{index}]overlay'
+                if video_filters:
+                    graph += ',' + ','.join(video_filters)
+                    video_filters = []
+                cmd.extend(['-filter_complex', graph + '[v]'])
+                video_map = '[v]'
+            elif index is not None:
+                subs = f'{basename!r}:stream_index={index}'
+                video_filters.append(f'subtitles={subs}')
+            else:
+                subs = self.sidecar()
+                if subs.endswith('.srt') or subs.endswith('.ass'):
+                    subs = subs.replace('[', '\\[').replace(']', '\\]')
+                    video_filters.append(f'subtitles={subs}')
+                else:  # .idx
+                    width, height = self.movie.width, self.movie.height
+                    graph = f'[1:s]crop={width}:{height}[s1];[{video_map}][s1]overlay'
+                    if video_filters:
+                        graph += ',' + ','.join(video_filters)
+                        video_filters = []
+                    cmd.extend(['-canvas_size', f'{width}x{height}', '-i', subs,
+                                '-filter_complex', graph + '[v]'])
+                    video_map = '[v]'
+
+        if video_map is not None:
+            cmd.extend(['-map', video_map])
+        cmd.extend(self.video_codec_options())
+        if video_filters:
+            cmd.extend(['-vf', ', '.join(video_filters)])
+        cmd.extend(self.audio_options())
+        if subtitle_map is not None:
+            cmd.extend(['-map', subtitle_map, '-c:s', 'mov_text', '-metadata:s:s:0', 'language=eng'])
+        cmd.extend(['-f', 'mp4', self.relative(outfile)])
+        return cmd
+
+    def burn_graph(self, source: str, label: str) -> tuple[list[str], str]:
+        """Returns the input options and the filtergraph that burns the subtitle into the video `source`.
+
+        The video with the subtitle burned in is labelled `label`.
+        """
+        subtitle = self.movie.subtitle
+        index = subtitle['index']
+        if index is not None and not is_text(subtitle):  # picture based, e.g., PGS
+            return [], f'[{source}][0:s:{index}]overlay[{label}]'
+        if index is not None:
+            return [], f'[{source}]subtitles={os.path.basename(self.movie.path)!r}:stream_index={index}[{label}]'
+        subs = self.sidecar()
+        if subs.endswith('.srt') or subs.endswith('.ass'):
+            subs = subs.replace('[', '\\[').replace(']', '\\]')
+            return [], f'[{source}]subtitles={subs}[{label}]'
+        width, height = self.movie.width, self.movie.height  # .idx
+        return (['-canvas_size', f'{width}x{height}', '-i', subs],
+                f'[1:s]crop={width}:{height}[s1];[{source}][s1]overlay[{label}]')
+
+    def outputs_command(self, outputs: list[tuple[Output, str]]) -> list[str]:
+        """Returns the ffmpeg command that writes all `outputs`, each is an :class:`Output` and a filename.
+
+        The video is decoded once and split into a filter branch for each
+        output that is transcoded. The subtitle is burned in once, before
+        the branches of the outputs that burn it in are split.
+        """
+        cmd = ['ffmpeg', '-i', os.path.basename(self.movie.path)]
+        transcoded = [i for i, (output, _) in enumerate(outputs) if self.transcodes(output)]
+        burned = [i for i in transcoded if self.burns(outputs[i][0])]
+        clean = [i for i in transcoded if i not in burned]
+
+        graph = []
+        inputs = []
+        if transcoded:
+            source = f'0:v:{self.video.index}'
+            heads = {'clean': source, 'burned': source}
+            if clean and burned:
+                graph.append(f'[{source}]split=2[vc][vb]')
+                heads = {'clean': 'vc', 'burned': 'vb'}
+            if burned:
+                inputs, chain = self.burn_graph(heads['burned'], 'vs')
+                graph.append(chain)
+                heads['burned'] = 'vs'
+            for group, indices in (('clean', clean), ('burned', burned)):
+                if len(indices) == 1:
+                    labels = {indices[0]: heads[group]}
+                else:
+                    labels = {i: f's{i}' for i in indices}
+                    if indices:
+                        graph.append(f'[{heads[group]}]split={len(indices)}' + ''.join(f'[s{i}]' for i in indices))
+                for i, label in labels.items():
+                    filters = []
+                    if outputs[i][0].height:
+                        filters.append(f'scale=-2:{outputs[i][0].height}')
+                    if self.video.stream.get('pix_fmt') != 'yuv420p':
+                        filters.append('format=yuv420p')
+                    graph.append(f'[{label}]{",".join(filters) or "null"}[v{i}]')
+
+        subtitle = self.movie.subtitle
+        if any(self.muxes(output) for output, _ in outputs) and subtitle['index'] is None:
+            inputs = ['-i', self.sidecar()]
+        cmd.extend(inputs)
+        if graph:
+            cmd.extend(['-filter_complex', ';'.join(graph)])
+
+        for i, (output, outfile) in enumerate(outputs):
+            if i in transcoded:
+                cmd.extend(['-map', f'[v{i}]', '-c:v', VIDEO_ENCODER])
+                if output.crf is not None:
+                    cmd.extend(['-crf', f'{output.crf:g}'])
+                if output.bitrate:
+                    cmd.extend(['-b:v', output.bitrate])
+                if self.threads:
+                    cmd.extend(['-threads', str(self.threads)])
+            elif self.video is not None:
+                cmd.extend(['-map', f'0:v:{self.video.index}', '-c:v', 'copy'])
+                if self.video.tag:
+                    cmd.extend(['-tag:v', self.video.tag])
+            cmd.extend(self.audio_options())
+            if self.muxes(output):
+                source = f'0:s:{subtitle["index"]}' if subtitle['index'] is not None else '1:s:0'
+                cmd.extend(['-map', source, '-c:s', 'mov_text', '-metadata:s:s:0', 'language=eng'])
+            cmd.extend(['-f', 'mp4', self.relative(outfile)])
+        return cmd
+
+    def work(self) -> dict[str, float]:
+        """Returns the amount of work of each kind, see :data:`RATES`.
+
+        The bytes that are read (and copied), the pixels of the video that are
+        encoded (of each output that is transcoded) and the seconds of audio
+        that are encoded.
+        """
+        work = {'copy': float(self.movie.metadata['format'].get('size', 0)), 'encode': 0., 'audio': 0.}
+        if self.video is not None:
+            fps = frame_rate(self.video.stream) or 25.
+            pixels = self.movie.duration * self.movie.width * self.movie.height * fps
+            if self.multiple:
+                for output in self.outputs:
+                    if not self.transcodes(output):
+                        continue
+                    if output.height and self.movie.height > 0:
+                        work['encode'] += pixels * (output.height / self.movie.height) ** 2
+                    else:
+                        work['encode'] += pixels
+            elif self.transcodes_video:
+                work['encode'] = pixels
+        for plan in self.audio:
+            if plan.action == TRANSCODE:
+                work['audio'] += self.movie.duration
+        return work
+
+    def estimate(self, rates: dict[str, float] = None) -> float:
+        """Returns a rough estimate of how long the conversion takes [seconds].
+
+        The `rates` override the default throughput of each kind of work,
+        see :data:`RATES` and :class:`~convert_mp4.costs.CostModel`.
+        """
+        rates = {**RATES, **(rates or {})}
+        return sum(amount / rates[kind] for kind, amount in self.work().items() if amount)
+
+    def describe(self, outfile: str) -> str:
+        """Returns a description of the decision for each stream, the cost and the ffmpeg command."""
+        lines = [str(plan) for plan in ([self.video] if self.video else []) + self.audio]
+        subtitle = self.movie.subtitle
+        if subtitle:
+            source = os.path.basename(subtitle['path']) if subtitle['path'] else f'0:s:{subtitle["index"]}'
+            lines.append(f'subtitle {source} -> {"burn in" if self.burn_in else "mux mov_text"}')
+        if self.multiple:
+            for output in self.outputs:
+                action = TRANSCODE if self.transcodes(output) else COPY
+                lines.append(f'{output} -> {action} video, {os.path.basename(output.path(outfile))}')
+            command = self.outputs_command([(output, output.path(outfile)) for output in self.outputs])
+        else:
+            command = self.command(outfile)
+        lines.append(f'estimated time: {format_duration(self.estimate())}')
+        lines.append(' '.join(command))
+        return '\n'.join(lines)
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import json
+import os
+import subprocess
+import threading
+from typing import Any
+from typing import Callable
+
+HIGH = 0
+NORMAL = 1
+
+
+def ffprobe(path: str, timeout: float = None) -> dict:
+    """Run ffprobe once and return the streams, format and tags of a file.
+
+    Raises :exc:`subprocess.TimeoutExpired` if ffprobe does not finish
+    within `timeout` seconds (it is killed) and
+    :exc:`subprocess.CalledProcessError` if it fails.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-of', 'json',
+           '-show_format', '-show_streams', path]
+    return json.loads(subprocess.check_output(cmd, stderr=subprocess.PIPE, timeout=timeout))
+
+
+def subtitle_streams(metadata: dict) -> list[list[str]]:
+    """Returns the [codec, language] of each internal subtitle stream.
+
+    The position of an item in the returned list is the subtitle-stream
+    index that ffmpeg expects, e.g., ``-map 0:s:<index>``.
+    """
+    streams = []
+    for stream in metadata['streams']:
+        if stream.get('codec_type') == 'subtitle':
+            tags = stream.get('tags', {})
+            streams.append([stream.get('codec_name', ''), tags.get('language', '')])
+    return streams
+
+
+def probe_error(error: Exception) -> str:
+    """Returns a short description of why a file could not be probed."""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return f'ffprobe timed out after {error.timeout:g} s'
+    if isinstance(error, subprocess.CalledProcessError):
+        lines = (error.stderr or b'').decode(errors='replace').strip().splitlines()
+        return lines[-1] if lines else f'ffprobe exited with code {error.returncode}'
+    if isinstance(error, KeyError):
+        return f'ffprobe did not report {error}'
+    return str(error) or type(error).__name__
+
+
+def device(path: str) -> int:
+    """Returns the ID of the storage device that a file is on (-1 if unknown)."""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return -1
+
+
+class ProbePool:
+
+    def __init__(self,
+                 load: Callable[[str], Any],
+                 callback: Callable[[str, Any, str], None],
+                 per_device: int = 2,
+                 max_queued: int = 256) -> None:
+        """Probe files with a limited number of threads for each storage device.
+
+        Each file is passed to `load` (e.g., to create a :class:`~convert_mp4.movie.Movie`)
+        and then `callback` receives (path, result, error message) from the
+        thread that loaded it. The result is :data:`None` if `load` raised an
+        exception. At most `per_device` files are loaded at the same time
+        from the same device (so that a spinning disk does not thrash) and
+        :meth:`submit` blocks while `max_queued` files are waiting.
+        """
+        super(ProbePool, self).__init__()
+        self.load = load
+        self.callback = callback
+        self.per_device = per_device
+        self.slots = threading.Semaphore(max_queued)
+        self.condition = threading.Condition()
+        self.queues: dict[int, list] = {}  # device -> heap of [priority, order, path]
+        self.entries: dict[str, list] = {}  # path -> its (valid) heap entry
+        self.order = itertools.count()
+        self.closed = False
+
+    def submit(self, path: str, priority: int = NORMAL) -> bool:
+        """Queue a file to be probed, blocks while the queue is full.
+
+        Returns whether the file was queued (:data:`False` if the pool was closed).
+        """
+        while not self.slots.acquire(timeout=0.1):
+            if self.closed:
+                return False
+        dev = device(path)
+        with self.condition:
+            entry = self.entries.get(path)
+            if self.closed or entry is not None:  # the file is already queued
+                self.slots.release()
+                if entry is not None and priority < entry[0]:
+                    self._push(path, priority, entry[3])
+                return not self.closed
+            self._push(path, priority, dev)
+        return True
+
+    def prioritize(self, paths: list[str]) -> None:
+        """Probe these files (e.g., the ones that are visible) before the others that are queued."""
+        with self.condition:
+            for path in paths:
+                entry = self.entries.get(path)
+                if entry is not None and entry[0] > HIGH:
+                    self._push(path, HIGH, entry[3])
+
+    def clear(self) -> list[str]:
+        """Remove the files that are queued (not the ones being probed), returns their paths."""
+        with self.condition:
+            paths = list(self.entries)
+            self.entries.clear()
+            for heap in self.queues.values():
+                heap.clear()
+        for _ in paths:
+            self.slots.release()
+        return paths
+
+    def close(self) -> None:
+        """Clear the queue and stop the threads once they finish probing."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.clear()
+
+    def _push(self, path: str, priority: int, dev: int) -> None:
+        # a previous entry of the path stays in the heap, but is skipped by _pop
+        entry = [priority, next(self.order), path, dev]
+        self.entries[path] = entry
+        if dev not in self.queues:
+            self.queues[dev] = []
+            for _ in range(self.per_device):
+                threading.Thread(target=self._work, args=(dev,), daemon=True).start()
+        heapq.heappush(self.queues[dev], entry)
+        self.condition.notify_all()
+
+    def _pop(self, dev: int):
+        heap = self.queues[dev]
+        while heap:
+            entry = heapq.heappop(heap)
+            if self.entries.get(entry[2]) is entry:
+                del self.entries[entry[2]]
+                return entry[2]
+
+    def _work(self, dev: int) -> None:
+        while True:
+            with self.condition:
+                path = self._pop(dev)
+                while path is None:
+                    if self.closed:
+                        return
+                    self.condition.wait()
+                    path = self._pop(dev)
+            self.slots.release()
+            try:
+                result, error = self.load(path), ''
+            except Exception as e:
+                result, error = None, probe_error(e)
+            self.callback(path, result, error)
@@ -0,0 +1,108 @@
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import replace
+
+
+@dataclass
+class Progress:
+    """The statistics that ffmpeg reports with ``-progress``."""
+
+    duration: float  # the duration of the input [seconds]
+    out_time: float = 0.0  # the time that has been written to the output [seconds]
+    fps: float = 0.0
+    speed: float = 0.0  # relative to real time
+    total_size: int = 0  # the number of bytes written
+    done: bool = False
+    outputs: tuple = ()  # (name, bytes written) of each output, if there are multiple outputs
+
+    @property
+    def percentage(self) -> int:
+        if self.done:
+            return 100
+        if self.duration <= 0:
+            return 0
+        return max(0, min(99, int(100. * self.out_time / self.duration)))
+
+    @property
+    def eta(self) -> float:
+        """The estimated time remaining [seconds], or -1 if unknown."""
+        if self.done:
+            return 0.0
+        if self.speed <= 0:
+            return -1.0
+        return max(0.0, self.duration - self.out_time) / self.speed
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d.update(percentage=self.percentage, eta=self.eta)
+        return d
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as H:MM:SS (or ? if negative, i.e., unknown)."""
+    if seconds < 0:
+        return '?'
+    m, s = divmod(int(round(seconds)), 60)
+    h, m = divmod(m, 60)
+    return f'{h}:{m:02d}:{s:02d}'
+
+
+def format_bytes(n: float) -> str:
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(n) < 1000:
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1000
+    return f'{n:.1f} TB'
+
+
+def _number(value: str, typ=float):
+    try:
+        return typ(value.rstrip('x'))
+    except ValueError:  # N/A
+        return typ(0)
+
+
+class ProgressParser:
+
+    def __init__(self, duration: float) -> None:
+        """Parse the key=value lines from ``ffmpeg -progress pipe:1``."""
+        super(ProgressParser, self).__init__()
+        self.current = Progress(duration=duration)
+
+    def feed(self, line: str):
+        """Parse a line, returns a :class:`Progress` snapshot at the end of each block, otherwise :data:`None`."""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        if key == 'out_time_us':
+            self.current.out_time = max(0, _number(value, int)) / 1e6
+        elif key == 'fps':
+            self.current.fps = _number(value)
+        elif key == 'speed':
+            self.current.speed = _number(value)
+        elif key == 'total_size':
+            self.current.total_size = _number(value, int)
+        elif key == 'progress':
+            self.current.done = value == 'end'
+            return replace(self.current)
+
+
+class Throttle:
+
+    def __init__(self, interval: float = 0.25) -> None:
+        """Only let a value through if it changed and `interval` seconds have elapsed."""
+        super(Throttle, self).__init__()
+        self.interval = interval
+        self.last_time = -float('inf')
+        self.last_value = None
+
+    def ready(self, value, force: bool = False) -> bool:
+        if value == self.last_value:
+            return False
+        now = time.monotonic()
+        if not force and now - self.last_time < self.interval:
+            return False
+        self.last_time = now
+        self.last_value = value
+        return True
@@ -0,0 +1,171 @@
+import fnmatch
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from typing import Iterator
+
+from .sidecars import SidecarIndex
+from .sidecars import sidecar_regex
+
+
+def find_videos(paths: Iterable[str], extensions_regex: re.Pattern) -> Iterator[str]:
+    """Yield the video files in `paths` (folders are searched recursively)."""
+    for path in paths:
+        if os.path.isfile(path):
+            if extensions_regex.search(path):
+                yield path
+            continue
+        for root, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if extensions_regex.search(filename):
+                    yield os.path.join(root, filename)
+
+
+def extensions_regex(extensions: Iterable[str]) -> re.Pattern:
+    """Returns the regex that matches filenames with the given `extensions`."""
+    return re.compile(r'\.({})$'.format('|'.join(extensions)), flags=re.IGNORECASE)
+
+
+def is_candidate(paths: Iterable[str], extensions_regex: re.Pattern) -> bool:
+    """Whether any of `paths` is a folder or a video file, without searching the folders."""
+    return any(extensions_regex.search(path) or os.path.isdir(path) for path in paths)
+
+
+class _Folder:
+
+    __slots__ = ('path', 'depth', 'parent', 'remaining', 'videos', 'sidecars')
+
+    def __init__(self, path: str, depth: int, parent) -> None:
+        self.path = path
+        self.depth = depth
+        self.parent = parent
+        self.remaining = 1  # itself + the sub-folders that have not been scanned
+        self.videos: list[str] = []
+        self.sidecars: list[str] = []
+
+
+class Scanner:
+
+    def __init__(self,
+                 extensions_regex: re.Pattern,
+                 sidecars: SidecarIndex = None,
+                 max_depth: int = None,
+                 exclude: Iterable[str] = (),
+                 workers: int = 8) -> None:
+        """Search folders for videos with :func:`os.scandir`, sub-folders are scanned in parallel.
+
+        The videos in a folder are yielded as soon as the folder has been
+        scanned, before its sub-folders. The `sidecars` of a folder are indexed
+        once the folder and all of its sub-folders have been scanned (so that
+        a movie can find them without walking the folder again, see
+        :meth:`SidecarIndex.when_indexed <convert_mp4.sidecars.SidecarIndex.when_indexed>`).
+        A folder that is deeper than `max_depth` below a root folder is not
+        scanned (:data:`None` for no limit) and a file or folder that matches
+        any of the `exclude` globs (either its name or its path) is skipped.
+        """
+        super(Scanner, self).__init__()
+        self.extensions_regex = extensions_regex
+        self.sidecars = sidecars
+        self.max_depth = max_depth
+        self.exclude = list(exclude)
+        self.workers = workers
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Stop scanning (may be called from any thread)."""
+        self.cancelled.set()
+
+    def is_excluded(self, name: str, path: str) -> bool:
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern)
+                   for pattern in self.exclude)
+
+    def scan(self, paths: Iterable[str]) -> Iterator[str]:
+        """Yield the video files in `paths`, as they are found.
+
+        A file in `paths` is yielded if it has a video extension and
+        folders are searched recursively. A scan that was cancelled (see
+        :meth:`cancel`) may be started again.
+        """
+        self.cancelled.clear()
+        found = queue.Queue()
+        lock = threading.Lock()
+        roots = []
+        for path in paths:
+            if os.path.isdir(path):
+                roots.append(os.path.abspath(path))
+            elif self.extensions_regex.search(path):
+                yield path
+        if not roots:
+            return
+
+        remaining = [len(roots)]
+
+        def done(folder: _Folder) -> None:
+            # called when a folder and all of its sub-folders have been scanned
+            while folder is not None:
+                with lock:
+                    folder.remaining -= 1
+                    if folder.remaining > 0:
+                        return
+                if self.sidecars is not None and not self.cancelled.is_set():
+                    self.sidecars.add(folder.path, folder.sidecars)
+                if folder.parent is None:
+                    with lock:
+                        remaining[0] -= 1
+                        if remaining[0] == 0:
+                            found.put(None)
+                folder = folder.parent
+
+        def visit(folder: _Folder) -> None:
+            children = []
+            if not self.cancelled.is_set():
+                try:
+                    with os.scandir(folder.path) as it:
+                        for entry in it:
+                            if self.is_excluded(entry.name, entry.path):
+                                continue
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if self.max_depth is None or folder.depth < self.max_depth:
+                                        children.append(_Folder(entry.path, folder.depth + 1, folder))
+                                elif self.extensions_regex.search(entry.name):
+                                    folder.videos.append(entry.path)
+                                elif sidecar_regex.search(entry.name):
+                                    folder.sidecars.append(entry.path)
+                            except OSError:
+                                continue
+                except OSError:
+                    pass
+            if folder.videos:
+                found.put(sorted(folder.videos))
+            with lock:
+                folder.remaining += len(children)
+            for child in children:
+                executor.submit(visit, child)
+            done(folder)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        videos = []
+        try:
+            for root in roots:
+                if self.sidecars is not None:
+                    self.sidecars.begin(root)
+                executor.submit(visit, _Folder(root, 0, None))
+            while not self.cancelled.is_set():
+                try:
+                    videos = found.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if videos is None:
+                    break
+                yield from videos
+        finally:
+            if videos is not None:  # cancelled, or the caller stopped iterating
+                self.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self.sidecars is not None:
+                for root in roots:
+                    self.sidecars.end(root)
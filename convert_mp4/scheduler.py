@@ -0,0 +1,197 @@
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+COPY = 'copy'
+AUDIO = 'audio'
+VIDEO = 'video'
+KINDS = (COPY, AUDIO, VIDEO)
+
+
+def classify(cmd: list[str]) -> str:
+    """Classify an ffmpeg command by the resources that it requires.
+
+    Returns ``'video'`` if the video is transcoded (CPU bound), ``'audio'`` if
+    only the audio is transcoded, otherwise ``'copy'`` (a remux, I/O bound).
+    """
+    if '-vf' in cmd or '-filter_complex' in cmd:
+        return VIDEO
+
+    transcode = set()
+    for option, value in zip(cmd[:-1], cmd[1:]):
+        if value == 'copy':
+            continue
+        if option in ('-vcodec', '-c:v') or option.startswith('-c:v:'):
+            transcode.add(VIDEO)
+        elif option in ('-acodec', '-c:a') or option.startswith('-c:a:'):
+            transcode.add(AUDIO)
+
+    if VIDEO in transcode:
+        return VIDEO
+    if AUDIO in transcode:
+        return AUDIO
+    return COPY
+
+
+def concurrency(config: dict) -> dict[str, int]:
+    """Returns the maximum number of concurrent conversions of each kind.
+
+    The number of concurrent video transcodes defaults to the number of
+    CPU cores divided by the ``threads`` that each ffmpeg process may use
+    (or 1 if ``threads`` is not specified). The defaults may be overridden
+    by the ``concurrency`` mapping in the configuration.
+    """
+    threads = config.get('threads', 0)
+    cpus = os.cpu_count() or 1
+    limits = {
+        COPY: 4,
+        AUDIO: 2,
+        VIDEO: max(1, cpus // threads) if threads else 1,
+    }
+    for kind, value in config.get('concurrency', {}).items():
+        if kind not in limits:
+            raise ValueError(f'Invalid concurrency kind {kind!r}, must be one of {KINDS}')
+        limits[kind] = max(1, int(value))
+    return limits
+
+
+class DeviceLimiter:
+
+    def __init__(self, per_device: int = 0) -> None:
+        """Limit the number of conversions that use each storage device at the same time.
+
+        A device is identified by ``st_dev`` (see :func:`~convert_mp4.probe.device`),
+        so that parallel conversions do not saturate one disk. There is no
+        limit if `per_device` is 0.
+        """
+        super(DeviceLimiter, self).__init__()
+        self.per_device = per_device
+        self.busy: dict[int, int] = {}  # device -> number of conversions
+        self.condition = threading.Condition()
+
+    def available(self, devices: tuple[int, ...]) -> bool:
+        with self.condition:
+            return self.per_device <= 0 or all(self.busy.get(d, 0) < self.per_device for d in devices)
+
+    def acquire(self, devices: tuple[int, ...], timeout: float = 0) -> bool:
+        """Use the devices, waiting up to `timeout` seconds for them to be available.
+
+        Returns whether the devices were acquired.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.available(devices), timeout):
+                return False
+            for d in devices:
+                self.busy[d] = self.busy.get(d, 0) + 1
+            return True
+
+    def release(self, devices: tuple[int, ...]) -> None:
+        with self.condition:
+            for d in devices:
+                self.busy[d] -= 1
+            self.condition.notify_all()
+
+
+class Scheduler:
+
+    def __init__(self, limits: dict[str, int], devices: DeviceLimiter = None) -> None:
+        """Run jobs concurrently, with a separate limit for each kind of job.
+
+        A cheap remux therefore never waits behind a long video transcode.
+        The jobs of a kind that are waiting run in the order of their priority,
+        a job whose storage devices are all in use (see `devices`), or whose
+        exclusive key is used by a job that is running, is skipped until it
+        is available.
+        """
+        super(Scheduler, self).__init__()
+        self.limits = limits
+        self.devices = devices or DeviceLimiter()
+        self.executors = {
+            kind: ThreadPoolExecutor(max_workers=limits[kind], thread_name_prefix=f'convert-{kind}')
+            for kind in KINDS
+        }
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.queues = {kind: [] for kind in KINDS}  # heap of (priority, count, future, fn, args, kwargs, devices, exclusive)
+        self.running = dict.fromkeys(KINDS, 0)
+        self.exclusive = set()  # the exclusive keys of the jobs that are running
+        self.counter = itertools.count()
+        self.closed = False
+
+    def submit(self,
+               kind: str,
+               fn: Callable,
+               *args,
+               priority: float = 0,
+               devices: tuple[int, ...] = (),
+               exclusive=None,
+               **kwargs) -> Future:
+        """Run ``fn(*args, **kwargs)``, the waiting job with the lowest `priority` runs first.
+
+        Jobs with the same priority run in the order that they were submitted.
+        The job uses the storage `devices` while it runs. Jobs with the same
+        `exclusive` key (e.g., the content of a movie) do not run at the same
+        time, a job waits for it without using a thread.
+        """
+        future = Future()
+        with self.lock:
+            heapq.heappush(self.queues[kind],
+                           (priority, next(self.counter), future, fn, args, kwargs, devices, exclusive))
+            self._dispatch()
+        return future
+
+    def _dispatch(self) -> None:
+        # start the best waiting jobs that a thread and their devices are available for (the lock is held)
+        if self.closed:
+            return
+        for kind in KINDS:
+            queue = self.queues[kind]
+            skipped = []
+            while queue and self.running[kind] < self.limits[kind]:
+                item = heapq.heappop(queue)
+                if item[2].cancelled():
+                    continue
+                if (item[7] is not None and item[7] in self.exclusive) or not self.devices.acquire(item[6]):
+                    skipped.append(item)
+                    continue
+                if item[7] is not None:
+                    self.exclusive.add(item[7])
+                self.running[kind] += 1
+                self.executors[kind].submit(self._run, kind, item)
+            for item in skipped:
+                heapq.heappush(queue, item)
+
+    def _run(self, kind: str, item: tuple) -> None:
+        _, _, future, fn, args, kwargs, devices, exclusive = item
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self.lock:
+                self.running[kind] -= 1
+                self.exclusive.discard(exclusive)
+                self.devices.release(devices)
+                self._dispatch()
+                self.idle.notify_all()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        with self.lock:
+            if cancel_futures:
+                for queue in self.queues.values():
+                    for item in queue:
+                        item[2].cancel()
+                    queue.clear()
+            if wait:
+                self.idle.wait_for(lambda: not any(self.queues.values()) and not any(self.running.values()))
+            self.closed = True
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
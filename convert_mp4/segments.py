@@ -0,0 +1,232 @@
+import bisect
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .conversion import FFmpeg
+from .planner import Plan
+from .progress import Progress
+
+
+def keyframes(path: str) -> list[float]:
+    """Returns the timestamps of the keyframes of the first video stream.
+
+    Only the packet headers are read, the video is not decoded. Raises
+    :exc:`OSError` or :exc:`subprocess.CalledProcessError` if ffprobe fails.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+    out = subprocess.check_output(cmd, text=True)
+    times = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' in flags and pts not in ('', 'N/A'):
+            times.append(float(pts))
+    return sorted(times)
+
+
+def split_points(keys: list[float], duration: float, n: int, min_length: float = 1.) -> list[float]:
+    """Choose the keyframes that split a video into (at most) `n` segments of similar length.
+
+    Returns the start time of each segment. The `keys` must be relative to
+    the start time of the video, the first segment always starts at 0. A
+    keyframe is not chosen if a segment would be shorter than `min_length`
+    seconds (e.g., the keyframes are far apart).
+    """
+    points = [0.0]
+    for i in range(1, n):
+        target = duration * i / n
+        j = bisect.bisect_left(keys, target)
+        candidates = keys[max(0, j - 1):j + 1]
+        if not candidates:
+            continue
+        nearest = min(candidates, key=lambda t: abs(t - target))
+        if nearest > points[-1] and min(nearest - points[-1], duration - nearest) >= min_length:
+            points.append(nearest)
+    return points
+
+
+class SegmentedEncode:
+
+    def __init__(self, plan: Plan, outfile: str, segments: int) -> None:
+        """Transcode the video of a movie to H.264 in segments that are encoded in parallel.
+
+        The video is split at keyframes, each segment is encoded by a separate
+        ffmpeg process and then the segments are joined (without re-encoding)
+        with the concat demuxer and the audio of the original file is re-muxed
+        according to the `plan`.
+
+        The segments that are complete are kept if the encode is stopped (or
+        the computer crashes), so the next run of the same encode resumes from
+        them. They are removed once the segments are joined or if a segment
+        fails.
+        """
+        super(SegmentedEncode, self).__init__()
+        self.plan = plan
+        self.movie = plan.movie
+        self.outfile = outfile
+        self.segments = segments
+        self.directory = outfile + '.segments'
+        self.lock = threading.Lock()
+        self.processes: list[FFmpeg] = []
+        self.stopping = threading.Event()
+        self.stop_timeout = 5
+
+    @property
+    def cpu_time(self):
+        """The CPU time of all ffmpeg processes [seconds], :data:`None` if not available."""
+        with self.lock:
+            times = [p.cpu_time for p in self.processes]
+        if not times or None in times:
+            return None
+        return sum(times)
+
+    def segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f'{index:04d}.mp4')
+
+    def split(self) -> list[float]:
+        """Returns the start time of each segment.
+
+        The split points are relative to the start time of the video and are
+        saved so that a resumed encode uses the same segments, unless the movie
+        (or the number of segments) changed.
+        """
+        stat = os.stat(self.movie.path)
+        start_time = self.start_time()
+        source = [self.movie.path, stat.st_size, stat.st_mtime_ns, self.segments, start_time]
+        path = os.path.join(self.directory, 'points.json')
+        try:
+            with open(path) as fp:
+                saved = json.load(fp)
+            if saved['source'] == source:
+                return saved['points']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.cleanup()
+        keys = [t - start_time for t in keyframes(self.movie.path)]
+        points = split_points(keys, self.movie.duration, self.segments)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump({'source': source, 'points': points}, fp)
+        return points
+
+    def start_time(self) -> float:
+        """Returns the start time of the video [seconds], ``-ss`` is relative to it."""
+        try:
+            return float(self.movie.metadata['format'].get('start_time', 0))
+        except (TypeError, ValueError):
+            return 0.
+
+    def encode_command(self, index: int, points: list[float]) -> list[str]:
+        cmd = ['ffmpeg', '-y']
+        if index > 0:
+            cmd.extend(['-ss', f'{points[index]:.6f}'])
+        if index + 1 < len(points):
+            cmd.extend(['-t', f'{points[index + 1] - points[index]:.6f}'])
+        cmd.extend(['-i', self.movie.path, '-map', f'0:v:{self.plan.video.index}', '-an', '-sn', '-dn'])
+        cmd.extend(self.plan.video_codec_options())
+        video_filters = self.plan.video_filters()
+        if video_filters:
+            cmd.extend(['-vf', ', '.join(video_filters)])
+        cmd.extend(['-f', 'mp4', self.segment_path(index) + '.part'])
+        return cmd
+
+    def concat_command(self, listing: str) -> list[str]:
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', listing,
+               '-i', self.movie.path, '-map', '0:v', '-c:v', 'copy']
+        cmd.extend(self.plan.audio_options(input_index=1))
+        cmd.extend(['-f', 'mp4', self.outfile])
+        return cmd
+
+    def run(self, callback: Callable[[Progress], None]) -> tuple:
+        """Encode the segments and join them.
+
+        The `callback` receives the progress summed over all segments.
+
+        Returns (returncode, error message), like :meth:`~convert_mp4.conversion.FFmpeg.run`.
+        """
+        try:
+            points = self.split()
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            return 1, f'cannot split the video into segments, {e}'
+
+        latest = [Progress(duration=0)] * len(points)
+
+        def update(index: int, info: Progress) -> None:
+            with self.lock:
+                latest[index] = info
+                callback(Progress(
+                    duration=self.movie.duration,
+                    out_time=sum(p.out_time for p in latest),
+                    fps=sum(p.fps for p in latest if not p.done),
+                    speed=sum(p.speed for p in latest if not p.done),
+                    total_size=sum(p.total_size for p in latest),
+                ))
+
+        def encode(index: int) -> tuple:
+            duration = (points[index + 1] if index + 1 < len(points) else self.movie.duration) - points[index]
+            path = self.segment_path(index)
+            if os.path.isfile(path):  # from a previous run
+                update(index, Progress(duration=duration, out_time=duration, done=True))
+                return 0, ''
+            try:
+                code, message = self.start(self.encode_command(index, points), duration).run(
+                    lambda info: update(index, info))
+                if code == 0:
+                    os.replace(path + '.part', path)
+            except OSError as e:
+                return 1, str(e)
+            return code, message
+
+        with ThreadPoolExecutor(max_workers=len(points)) as executor:
+            results = list(executor.map(encode, range(len(points))))
+
+        if self.stopping.is_set():  # keep the segments that are complete
+            return None, 'aborted'
+
+        for index, (code, message) in enumerate(results):
+            if code != 0:
+                self.cleanup()
+                return code, f'encoding segment {index} failed, {message}'
+
+        listing = os.path.join(self.directory, 'concat.txt')
+        try:
+            with open(listing, 'w') as fp:
+                for index in range(len(points)):
+                    path = self.segment_path(index).replace("'", r"'\''")
+                    fp.write(f"file '{path}'\n")
+        except OSError as e:
+            self.cleanup()
+            return 1, f'cannot write {listing}, {e.strerror or e}'
+
+        try:
+            result = self.start(self.concat_command(listing), self.movie.duration).run(lambda info: None)
+        except OSError as e:
+            result = 1, f'joining the segments failed, {e}'
+        self.cleanup()
+        return result
+
+    def start(self, cmd: list[str], duration: float) -> FFmpeg:
+        ffmpeg = FFmpeg(cmd, duration)
+        with self.lock:
+            self.processes.append(ffmpeg)
+            if self.stopping.is_set():
+                ffmpeg.stop(self.stop_timeout)
+        return ffmpeg
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop all ffmpeg processes without blocking."""
+        with self.lock:
+            self.stopping.set()
+            self.stop_timeout = timeout
+            processes = list(self.processes)
+        for ffmpeg in processes:
+            ffmpeg.stop(timeout)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
@@ -0,0 +1,200 @@
+import os
+import re
+import threading
+from typing import Callable
+
+sidecar_regex = re.compile(r'\.(srt|idx|ass)$', flags=re.IGNORECASE)
+separator_regex = re.compile(r'[._\- ]')
+
+
+def normalize(name: str) -> str:
+    """Normalize a file or folder name so that it can be used as a key."""
+    return name.strip().casefold()
+
+
+def keys(name: str) -> set[str]:
+    """Returns the keys that a file or folder name is indexed by.
+
+    The name and every prefix of the name that is followed by a ``.``, ``_``,
+    ``-`` or a space is a key, so that, for example, ``Movie (2010).en``,
+    ``Movie (2010)_eng`` and ``Movie (2010) English`` can be found from a
+    video called ``Movie (2010).mkv``.
+    """
+    name = normalize(name)
+    return {name} | {name[:m.start()] for m in separator_regex.finditer(name) if m.start()}
+
+
+def sidecar_keys(path: str) -> set[str]:
+    """Returns the keys that a sidecar file is indexed by, its stem and the names of its folders."""
+    root, filename = os.path.split(path)
+    k = keys(os.path.splitext(filename)[0])
+    for folder in root.split(os.sep):
+        if folder:
+            k |= keys(folder)
+    return k
+
+
+def is_under(path: str, directory: str) -> bool:
+    """Whether `path` is equal to or is located within `directory`."""
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+class SidecarIndex:
+
+    def __init__(self) -> None:
+        """An index of the .srt, .idx and .ass files below some root folders.
+
+        Each root folder is walked only once, and a sidecar file is indexed by
+        its stem and by the names of the folders that it is located in (see
+        :func:`keys`).
+        """
+        super(SidecarIndex, self).__init__()
+        self.lock = threading.Lock()
+        self.roots: set[str] = set()
+        self.scanning: set[str] = set()  # the root folders that a Scanner is indexing
+        self.waiting: dict[str, list[Callable[[], None]]] = {}  # folder -> callbacks, see when_indexed
+        self.files: dict[str, set[str]] = {}  # path -> keys
+        self.index: dict[str, set[str]] = {}  # key -> paths
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def add_root(self, directory: str) -> None:
+        """Walk a folder (and sub-folders) and index all sidecar files.
+
+        If the folder was already indexed then it is walked again, which
+        picks up sidecar files that were added or removed since.
+        """
+        directory = os.path.abspath(directory)
+        found = []
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if sidecar_regex.search(filename):
+                    found.append(os.path.join(root, filename))
+        with self.lock:
+            self._forget(directory)
+            self._add(directory, found)
+
+    def add(self, directory: str, paths: list[str]) -> None:
+        """Index the sidecar `paths` that are located in a folder.
+
+        The sub-folders must have been added (or forgotten) already, e.g., by
+        a :class:`~convert_mp4.scanner.Scanner`, then the folder is indexed.
+        """
+        directory = os.path.abspath(directory)
+        with self.lock:
+            self._add(directory, paths)
+            callbacks = self._pop_waiting(directory)
+        for callback in callbacks:
+            callback()
+
+    def begin(self, directory: str) -> None:
+        """A :class:`~convert_mp4.scanner.Scanner` starts indexing a folder (and sub-folders).
+
+        The callbacks of :meth:`when_indexed` for a folder that is being
+        indexed are called once the folder has been added, or when
+        :meth:`end` is called.
+        """
+        directory = os.path.abspath(directory)
+        with self.lock:
+            self._forget(directory)
+            self.scanning.add(directory)
+
+    def end(self, directory: str) -> None:
+        """A :class:`~convert_mp4.scanner.Scanner` finished (or stopped) indexing a folder."""
+        directory = os.path.abspath(directory)
+        with self.lock:
+            self.scanning.discard(directory)
+            callbacks = self._pop_waiting(directory)
+        for callback in callbacks:
+            callback()
+
+    def when_indexed(self, directory: str, callback: Callable[[], None]) -> None:
+        """Call `callback` once the sidecar files below `directory` have been indexed.
+
+        If a :class:`~convert_mp4.scanner.Scanner` is indexing the folder, this
+        returns immediately and `callback` is called by the thread of the
+        Scanner (once the folder and its sub-folders have been indexed, or
+        the scan stopped). Otherwise, the folder is indexed first if it has
+        not been indexed yet and `callback` is called by the calling thread.
+        """
+        directory = os.path.abspath(directory)
+        with self.lock:
+            if self._is_scanning(directory):
+                self.waiting.setdefault(directory, []).append(callback)
+                return
+        if not self.is_indexed(directory):
+            self.add_root(directory)
+        callback()
+
+    def add_file(self, path: str) -> None:
+        """Index a sidecar file that was created in a folder that has been indexed."""
+        with self.lock:
+            if path not in self.files:
+                self._index(path)
+
+    def forget(self, directory: str) -> None:
+        """Remove a folder (and sub-folders) from the index."""
+        with self.lock:
+            self._forget(os.path.abspath(directory))
+
+    def is_indexed(self, directory: str) -> bool:
+        """Whether `directory` is within a folder that has been indexed."""
+        directory = os.path.abspath(directory)
+        with self.lock:
+            while directory not in self.roots:
+                parent = os.path.dirname(directory)
+                if parent == directory:
+                    return False
+                directory = parent
+            return True
+
+    def find(self, directory: str, name: str) -> list[str]:
+        """Find the sidecar files below `directory` that are indexed by `name`.
+
+        Only the files that have been indexed are found, see :meth:`when_indexed`.
+        """
+        directory = os.path.abspath(directory)
+        with self.lock:
+            paths = self.index.get(normalize(name), ())
+            return sorted(p for p in paths if is_under(p, directory))
+
+    def _add(self, directory: str, paths: list[str]) -> None:
+        for path in paths:
+            self._index(path)
+        self.roots.add(directory)
+
+    def _index(self, path: str) -> None:
+        k = self.files[path] = sidecar_keys(path)
+        for key in k:
+            self.index.setdefault(key, set()).add(path)
+
+    def _is_scanning(self, directory: str) -> bool:
+        # whether a Scanner is indexing the folder and has not added it (or a parent folder) yet
+        for root in self.scanning:
+            if not is_under(directory, root):
+                continue
+            folder = directory
+            while folder not in self.roots:
+                if folder == root:
+                    return True
+                folder = os.path.dirname(folder)
+        return False
+
+    def _pop_waiting(self, directory: str) -> list[Callable[[], None]]:
+        callbacks = []
+        for folder in [f for f in self.waiting if is_under(f, directory)]:
+            callbacks.extend(self.waiting.pop(folder))
+        return callbacks
+
+    def _forget(self, directory: str) -> None:
+        for path in [p for p in self.files if is_under(p, directory)]:
+            self._remove(path)
+        self.roots = {r for r in self.roots if not is_under(r, directory)}
+
+    def _remove(self, path: str) -> None:
+        for key in self.files.pop(path):
+            paths = self.index[key]
+            paths.discard(path)
+            if not paths:
+                del self.index[key]
@@ -0,0 +1,157 @@
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+TEXT_CODECS = ('subrip', 'ass', 'ssa', 'mov_text', 'webvtt', 'text')
+
+PREVIEW_CUES = 8
+
+ass_tags_regex = re.compile(r'\{[^}]*\}')
+
+
+class LRUCache:
+
+    def __init__(self, maxsize: int = 64) -> None:
+        """A thread-safe, least-recently-used cache."""
+        super(LRUCache, self).__init__()
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                return
+            return self.items[key]
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+cache = LRUCache()
+
+
+def is_text(info: dict) -> bool:
+    """Whether a subtitle is text based (i.e., whether it can be muxed into an MP4 as mov_text).
+
+    The `info` is an item of :attr:`Movie.subtitles <convert_mp4.movie.Movie.subtitles>`.
+    """
+    if info['path']:
+        return os.path.splitext(info['path'])[1].lower() in ('.srt', '.ass')
+    return info['codec'] in TEXT_CODECS
+
+
+def srt_cues(lines: Iterable[str], limit: int) -> list[str]:
+    """Returns the first `limit` cues (index, timing and text) from the lines of an SRT file."""
+    cues, block = [], []
+    for line in lines:
+        line = line.lstrip('\ufeff').rstrip('\r\n')
+        if line.strip():
+            block.append(line + '\n')
+            continue
+        if block:
+            cues.append(''.join(block) + '\n')
+            block = []
+            if len(cues) >= limit:
+                return cues
+    if block:
+        cues.append(''.join(block))
+    return cues
+
+
+def ass_time(timestamp: str) -> str:
+    """Convert an ASS timestamp (H:MM:SS.cc) to an SRT timestamp (HH:MM:SS,mmm)."""
+    h, m, s = timestamp.strip().split(':')
+    seconds, _, centi = s.partition('.')
+    return f'{int(h):02d}:{int(m):02d}:{int(seconds):02d},{int(centi or 0) * 10:03d}'
+
+
+def ass_cues(lines: Iterable[str], limit: int) -> list[str]:
+    """Returns the first `limit` Dialogue events from the lines of an ASS/SSA file, as SRT cues."""
+    cues = []
+    fields = None
+    events = False
+    for line in lines:
+        line = line.lstrip('\ufeff').strip()
+        if line.startswith('['):
+            events = line.lower() == '[events]'
+            continue
+        if not events:
+            continue
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key == 'format':
+            fields = [f.strip().lower() for f in value.split(',')]
+        elif key == 'dialogue' and fields:
+            event = dict(zip(fields, value.split(',', len(fields) - 1)))
+            text = ass_tags_regex.sub('', event.get('text', '')).strip()
+            text = text.replace('\\N', '\n').replace('\\n', '\n')
+            try:
+                timing = f'{ass_time(event["start"])} --> {ass_time(event["end"])}'
+            except (KeyError, ValueError):
+                continue
+            cues.append(f'{len(cues) + 1}\n{timing}\n{text}\n\n')
+            if len(cues) >= limit:
+                break
+    return cues
+
+
+def stream_cues(path: str, index: int, limit: int) -> list[str]:
+    """Returns the first `limit` cues of an internal subtitle stream.
+
+    ffmpeg converts the stream to SRT and writes it to a pipe. Once enough
+    cues have been read, ffmpeg is killed, so only the beginning of the
+    file is read regardless of its size.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-i', path,
+           '-map', f'0:s:{index}', '-c:s', 'srt', '-f', 'srt', 'pipe:1']
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         text=True, encoding='utf-8', errors='replace')
+    try:
+        return srt_cues(p.stdout, limit)
+    finally:
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        p.stdout.close()
+
+
+def preview(path: str, info: dict, limit: int = PREVIEW_CUES) -> list[str]:
+    """Returns the first `limit` cues of a subtitle.
+
+    The `info` is an item of :attr:`Movie.subtitles <convert_mp4.movie.Movie.subtitles>`
+    and `path` is the path to the movie. The results are cached.
+    """
+    source = info['path'] or path
+    key = (source, os.stat(source).st_mtime_ns, info['index'], limit)
+    cues = cache.get(key)
+    if cues is not None:
+        return cues
+
+    if info['path']:  # external file
+        ext = os.path.splitext(info['path'])[1].lower()
+        if ext == '.idx':
+            return ['Picture-based IDX/SUB']
+        if ext not in ('.srt', '.ass'):
+            raise ValueError(f'Unhandled subtitle extension {ext}')
+        with open(info['path'], encoding='utf-8', errors='replace') as f:
+            cues = srt_cues(f, limit) if ext == '.srt' else ass_cues(f, limit)
+    elif info['codec'] in TEXT_CODECS:  # internal stream
+        cues = stream_cues(path, info['index'], limit)
+    else:  # e.g., hdmv_pgs_subtitle or dvd_subtitle
+        return [f'Picture-based {info["codec"]}']
+
+    cache.put(key, cues)
+    return cues
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from .progress import format_bytes
+from .progress import format_duration
+
+PREFIX = 'convert_mp4'
+
+# the fields of a conversion record that are exported as counters
+COUNTERS = {
+    'queue_wait': 'queue_wait_seconds_total',
+    'cpu_time': 'cpu_seconds_total',
+    'input_bytes': 'input_bytes_total',
+    'output_bytes': 'output_bytes_total',
+    'media_seconds': 'media_seconds_total',
+}
+
+
+class Telemetry:
+
+    def __init__(self, log: str = None, textfile: str = None) -> None:
+        """Collect timing records of probes, subtitle loads and conversions (thread safe).
+
+        Each record is appended to `log` as a JSON line. If `textfile` is
+        specified, the totals are written to it in the Prometheus text format
+        (e.g., for the textfile collector of the node exporter) after each
+        conversion.
+        """
+        super(Telemetry, self).__init__()
+        self.log = log
+        self.textfile = textfile
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(float)  # the totals since the start
+        self.batch = defaultdict(float)  # the sums since start_batch, see summary
+        self.statuses: dict[str, int] = {}  # the number of conversions since start_batch
+        self._fp = None
+        if log:
+            os.makedirs(os.path.dirname(os.path.abspath(log)), exist_ok=True)
+            self._fp = open(log, mode='a', encoding='utf-8')
+
+    def start_batch(self) -> None:
+        """Only include the records from now on in the :meth:`summary`."""
+        with self.lock:
+            self.started = time.time()
+            self.batch.clear()
+            self.statuses.clear()
+
+    def record(self, event: str, **fields) -> dict:
+        """Add a record, the `event` is ``'probe'``, ``'subtitle'`` or ``'conversion'``."""
+        record = {'event': event, 'timestamp': time.time(), **fields}
+        with self.lock:
+            self._count(record)
+            if self._fp is not None:
+                self._fp.write(json.dumps(record) + '\n')
+                self._fp.flush()
+        if event == 'conversion':
+            self.write_textfile()
+        return record
+
+    def _count(self, record: dict) -> None:
+        event = record['event']
+        status = record.get('status', 'done')
+        self.counters[('jobs_total', event, status)] += 1
+        self.counters[('wall_seconds_total', event, status)] += record.get('wall', 0)
+        if event == 'probe':
+            self.batch['probes'] += 1
+            self.batch['probe_cached'] += 1 if record.get('cached') else 0
+            self.batch['probe_wall'] += record.get('wall', 0)
+        if event != 'conversion':
+            return
+        for field, name in COUNTERS.items():
+            self.counters[(name, event, status)] += record.get(field) or 0
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.batch['conversions'] += 1
+        self.batch['queue_wait'] += record.get('queue_wait') or 0
+        self.batch['cpu_time'] += record.get('cpu_time') or 0
+        if status == 'done':
+            for field in ('input_bytes', 'output_bytes', 'media_seconds'):
+                self.batch[field] += record.get(field) or 0
+
+    def summary(self) -> dict:
+        """Returns the aggregate statistics of the records since :meth:`start_batch`."""
+        with self.lock:
+            started = self.started
+            batch = dict(self.batch)
+            statuses = dict(self.statuses)
+        elapsed = max(time.time() - started, 1e-9)
+        probes = batch.get('probes', 0)
+        conversions = batch.get('conversions', 0)
+        input_bytes = batch.get('input_bytes', 0)
+        media_seconds = batch.get('media_seconds', 0)
+        return {
+            'elapsed': elapsed,
+            'conversions': statuses,
+            'probes': int(probes),
+            'probe_cached': int(batch.get('probe_cached', 0)),
+            'probe_wall_mean': batch['probe_wall'] / probes if probes else 0.,
+            'queue_wait_mean': batch['queue_wait'] / conversions if conversions else 0.,
+            'cpu_time': batch.get('cpu_time', 0),
+            'input_bytes': input_bytes,
+            'output_bytes': batch.get('output_bytes', 0),
+            'media_seconds': media_seconds,
+            'gb_per_hour': input_bytes / 1e9 / (elapsed / 3600.),
+            'media_hours_per_hour': media_seconds / elapsed,
+        }
+
+    def prometheus(self) -> str:
+        """Returns the totals in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+        lines = []
+        names = sorted(set(key[0] for key in counters))
+        for name in names:
+            lines.append(f'# TYPE {PREFIX}_{name} counter')
+            for (key, event, status), value in sorted(counters.items()):
+                if key == name:
+                    lines.append(f'{PREFIX}_{name}{{event="{event}",status="{status}"}} {value:g}')
+        summary = self.summary()
+        for name in ('gb_per_hour', 'media_hours_per_hour'):
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            lines.append(f'{PREFIX}_{name} {summary[name]:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self) -> None:
+        """Atomically replace the Prometheus text file (if one was specified)."""
+        if not self.textfile:
+            return
+        tmp = f'{self.textfile}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, mode='w', encoding='utf-8') as fp:
+            fp.write(self.prometheus())
+        os.replace(tmp, self.textfile)
+
+    def close(self) -> None:
+        self.write_textfile()
+        with self.lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+def report(summary: dict) -> str:
+    """Returns a human-readable report of a :meth:`Telemetry.summary`."""
+    statuses = ', '.join(f'{n} {s}' for s, n in summary['conversions'].items()) or 'no conversions'
+    return (
+        f'{statuses} in {format_duration(summary["elapsed"])} | '
+        f'{format_bytes(summary["input_bytes"])} read, {format_bytes(summary["output_bytes"])} written | '
+        f'{summary["gb_per_hour"]:.2f} GB/h, {summary["media_hours_per_hour"]:.2f} media-h/h | '
+        f'ffmpeg CPU {format_duration(summary["cpu_time"])} | '
+        f'mean queue wait {summary["queue_wait_mean"]:.1f} s | '
+        f'{summary["probes"]} probes ({summary["probe_cached"]} cached, '
+        f'mean {1e3 * summary["probe_wall_mean"]:.0f} ms)'
+    )
@@ -0,0 +1,331 @@
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Callable
+from typing import Iterable
+
+from .scanner import Scanner
+from .sidecars import SidecarIndex
+from .sidecars import sidecar_regex
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def is_output(path: str, extensions: Iterable[str], suffixes: Iterable[str] = ()) -> bool:
+    """Whether an MP4 file looks like it was converted from a video in the same folder.
+
+    The `suffixes` are of the :class:`~convert_mp4.planner.Output` renditions.
+    """
+    root, ext = os.path.splitext(path)
+    if ext.lower() != '.mp4':
+        return False
+    for suffix in {'', *suffixes}:
+        if not root.endswith(suffix):
+            continue
+        base = root[:len(root) - len(suffix)]
+        if base.endswith('_(copy)') or \
+                any(os.path.isfile(f'{base}.{e}') for e in extensions if e.lower() != 'mp4'):
+            return True
+    return False
+
+
+class Inotify:
+
+    def __init__(self, exclude: Callable[[str, str], bool] = None) -> None:
+        """Watch folders (and sub-folders) for files that are created, written or moved in (Linux only).
+
+        A folder is not watched if ``exclude(name, path)`` is true.
+        """
+        super(Inotify, self).__init__()
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify requires Linux')
+        self.exclude = exclude or (lambda name, path: False)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: dict[int, str] = {}  # watch descriptor -> folder
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f'cannot watch {directory}, {os.strerror(code)}')
+        self.watches[wd] = directory
+
+    def add_tree(self, directory: str) -> list[str]:
+        """Watch a folder and its sub-folders, returns the files that are in them.
+
+        Raises :exc:`OSError` if the limit of the number of watches is reached
+        (see /proc/sys/fs/inotify/max_user_watches).
+        """
+        files = []
+        for root, folders, filenames in os.walk(directory):
+            folders[:] = [f for f in folders if not self.exclude(f, os.path.join(root, f))]
+            try:
+                self.add_watch(root)
+            except OSError as e:
+                if e.errno in (errno.ENOSPC, errno.ENOMEM):
+                    raise
+                continue  # the folder was removed
+            files.extend(os.path.join(root, f) for f in filenames)
+        return files
+
+    def read(self):
+        """Returns the paths of the files that changed, or :data:`None` if events were lost."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:  # the folder was removed
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if not mask & IN_ISDIR:
+                paths.append(path)
+            elif not self.exclude(name, path):  # a new folder, its files may exist before it is watched
+                paths.extend(self.add_tree(path))
+        return None if overflow else paths
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Watcher:
+
+    def __init__(self,
+                 root: str,
+                 extensions_regex: re.Pattern,
+                 exclude: Iterable[str] = (),
+                 settle: float = 10,
+                 interval: float = 30,
+                 polling: bool = False,
+                 sidecars: SidecarIndex = None) -> None:
+        """Watch a folder for videos and report each video once it is no longer being written to.
+
+        A video is ready when its size and modification time have not changed
+        for `settle` seconds. inotify is used on Linux (the process sleeps
+        until a file changes) unless `polling` is true or the folder cannot
+        be watched with inotify. The folder is also searched every `interval`
+        seconds, since inotify does not report the files that other computers
+        write to a network share (e.g., CIFS or NFS). The subtitle files that
+        are found are added to the `sidecars` index, so a movie does not walk
+        its folder again.
+        """
+        super(Watcher, self).__init__()
+        self.root = os.path.abspath(root)
+        self.extensions_regex = extensions_regex
+        self.sidecars = sidecars
+        self.scanner = Scanner(extensions_regex, sidecars=sidecars, exclude=exclude)
+        self.settle = settle
+        self.interval = interval
+        self.pending: dict[str, tuple] = {}  # path -> ((size, mtime), when it last changed)
+        self.known: dict[str, tuple] = {}  # path -> (size, mtime) when it was reported
+        self.stopping = threading.Event()
+        self.inotify = None
+        self._wake = None
+        if not polling:
+            try:
+                self.inotify = Inotify(self.scanner.is_excluded)
+                self.inotify.add_tree(self.root)
+            except OSError:
+                self.close_inotify()
+            else:
+                self._wake = os.pipe()
+
+    @property
+    def mode(self) -> str:
+        return 'polling' if self.inotify is None else 'inotify'
+
+    def stop(self) -> None:
+        """Stop watching (may be called from any thread or a signal handler)."""
+        self.stopping.set()
+        if self._wake is not None:
+            os.write(self._wake[1], b'\0')
+
+    def close_inotify(self) -> None:
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def run(self, callback: Callable[[str], None]) -> None:
+        """Call `callback` with the path of each video that is ready, until :meth:`stop` is called.
+
+        The videos that are in the folder when watching starts are also reported.
+        """
+        self.rescan()
+        next_scan = time.monotonic() + self.interval
+        while not self.stopping.is_set():
+            wait = next_scan - time.monotonic()
+            timeout = self.timeout()
+            if timeout is not None:
+                wait = min(wait, timeout)
+            wait = max(0., wait)
+            if self.inotify is None:
+                self.stopping.wait(wait)
+            else:
+                readable, _, _ = select.select([self.inotify, self._wake[0]], [], [], wait)
+                if self.inotify in readable:
+                    try:
+                        paths = self.inotify.read()
+                    except OSError:  # too many folders to watch
+                        self.close_inotify()
+                        paths = None
+                    if paths is None:
+                        self.rescan()
+                        next_scan = time.monotonic() + self.interval
+                    else:
+                        for path in paths:
+                            if self.scanner.is_excluded(os.path.basename(path), path):
+                                continue
+                            if self.extensions_regex.search(path):
+                                self.touch(path)
+                            elif self.sidecars is not None and sidecar_regex.search(path):
+                                self.sidecars.add_file(path)
+            if self.stopping.is_set():
+                break
+            if time.monotonic() >= next_scan:
+                self.rescan()
+                next_scan = time.monotonic() + self.interval
+            for path in self.ready():
+                callback(path)
+        self.close_inotify()
+        if self._wake is not None:
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+
+    def rescan(self) -> None:
+        """Search the folder for videos that are new or have changed."""
+        for path in self.scanner.scan([self.root]):
+            self.touch(path)
+
+    def touch(self, path: str) -> None:
+        """A video was created or written to, wait for it to settle."""
+        signature = self.stat(path)
+        if signature is None or signature == self.known.get(path):
+            return
+        pending = self.pending.get(path)
+        if pending is None or pending[0] != signature:
+            self.pending[path] = (signature, time.monotonic())
+
+    def ready(self) -> list[str]:
+        """Returns the pending videos that have not changed for the settle time."""
+        now = time.monotonic()
+        paths = []
+        for path, (signature, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            current = self.stat(path)
+            if current is None:  # removed
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now)
+            else:
+                del self.pending[path]
+                self.known[path] = signature
+                paths.append(path)
+        return sorted(paths)
+
+    def timeout(self):
+        """Returns the number of seconds until a pending video should be checked, :data:`None` if none are pending."""
+        if not self.pending:
+            return None
+        since = min(since for _, since in self.pending.values())
+        return max(0., since + self.settle - time.monotonic())
+
+    @staticmethod
+    def stat(path: str):
+        try:
+            s = os.stat(path)
+        except OSError:
+            return None
+        return s.st_size, s.st_mtime_ns
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/status'):
+            body = json.dumps(self.server.status(), indent=2).encode()
+            content_type = 'application/json'
+        elif path == '/metrics':
+            body = self.server.metrics().encode()
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StatusServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int,
+                 status: Callable[[], dict],
+                 metrics: Callable[[], str],
+                 host: str = '127.0.0.1') -> None:
+        """Serve the `status` as JSON at /status and the `metrics` at /metrics in a background thread."""
+        super(StatusServer, self).__init__((host, port), StatusHandler)
+        self.status = status
+        self.metrics = metrics
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 1}, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -1,15 +1,16 @@
-import os
-import re
-import subprocess
+import time
+from typing import Callable
 
 from msl.qt import QtCore
 from msl.qt import Signal
 
+from .conversion import Conversion
 from .movie import Movie
+from .scanner import Scanner
 
 
 class LoadSubtitleSignaler(QtCore.QObject):
-    finished = Signal(str, list)  # movie title, subtitles
+    finished = Signal(str, list)  # movie path, subtitles
 
 
 class LoadSubtitleWorker(QtCore.QRunnable):
@@ -17,132 +18,113 @@ class LoadSubtitleWorker(QtCore.QRunnable):
     def __init__(self, movie: Movie, info: dict) -> None:
         super(LoadSubtitleWorker, self).__init__()
         self.movie = movie
-        self.title = movie.title
         self.info = info
+        self.wall = 0.
         self.signaler = LoadSubtitleSignaler()
 
     def run(self) -> None:
         """Load the subtitles and emit."""
+        t0 = time.perf_counter()
         subtitles = self.movie.load_subtitle(self.info)
-        self.signaler.finished.emit(self.title, subtitles)
+        self.wall = time.perf_counter() - t0
+        self.signaler.finished.emit(self.movie.path, subtitles)
 
 
 class ConvertMovieSignaler(QtCore.QObject):
     percentage = Signal(int)
+    stats = Signal(object)  # Progress
     error = Signal(str)
+    finished = Signal(str, str)  # movie path, status
 
 
 class ConvertMovieWorker(QtCore.QRunnable):
 
-    def __init__(self, movie, event_stop):
+    def __init__(self, movie, event_stop, config, journal=None, devices=None, index=None):
         super(ConvertMovieWorker, self).__init__()
         self.movie = movie
         self.signaler = ConvertMovieSignaler()
-        self.regex_timestamp = re.compile(r'time=(?P<timestamp>\S+)')
         self.event_stop = event_stop
-
-        output_extension = '.mp4'
-        root, ext = os.path.splitext(movie.path)
-        if ext == output_extension:
-            self.outfile = root + '_(copy)' + output_extension
-        else:
-            self.outfile = root + output_extension
-        self.movie.convert_path = self.outfile
-
-    @staticmethod
-    def to_seconds(timestamp: str) -> float:
-        if timestamp == 'N/A':
-            return 0.0
-        h, m, s = timestamp.split(':')
-        seconds = float(h) * 60 * 60
-        seconds += float(m) * 60
-        seconds += float(s)
-        return seconds
+        self.conversion = Conversion(movie, event_stop, config, journal=journal, devices=devices, index=index)
+        self.outfile = self.conversion.outfile
+        self.kind = self.conversion.kind()
+        self.key = 0.  # the sort key in the queue, see costs.priority
 
     def run(self):
-        if os.path.isfile(self.outfile):
-            print(f'{self.outfile} -- already exists')
-            self.signaler.percentage.emit(0)
-            self.signaler.error.emit('already exists')
-            return
+        status = self.conversion.run(progress=self.signaler.percentage.emit,
+                                     error=self.signaler.error.emit,
+                                     stats=self.signaler.stats.emit)
+        self.signaler.finished.emit(self.movie.path, status)
 
-        basename = os.path.basename(self.movie.path)
-        cmd = ['ffmpeg', '-i', basename]
-
-        video_filters = []
-        if self.movie.codec['video'] == 'hevc':
-            cmd.extend(['-vcodec', 'libx264'])
-            video_filters.append('format=yuv420p')
-
-        if self.movie.subtitle:
-            index = self.movie.subtitle['index']
-            if index is not None:
-                subs = f'{basename!r}:stream_index={index}'
-                video_filters.append(f'subtitles={subs}')
-            else:
-                dirname = os.path.dirname(self.movie.path)
-                subs = self.movie.subtitle['path'][len(dirname)+1:]
-                if subs.endswith('.srt') or subs.endswith('.ass'):
-                    subs = subs.replace('[', '\\[').replace(']', '\\]')
-                    video_filters.append(f'subtitles={subs}')
-                else:  # .idx
-                    cmd.extend([
-                        '-canvas_size', f'{self.movie.width}x{self.movie.height}',
-                        '-i', subs,
-                        '-filter_complex', f'[1:s]crop={self.movie.width}:{self.movie.height}[s1];[0:v][s1]overlay[v]',
-                        '-map', '[v]', '-map', '0:a',
-                        '-vcodec', 'libx264'
-                    ])
-
-        if video_filters:
-            cmd.extend(['-vf', ', '.join(video_filters)])
-        elif '-vcodec' not in cmd:
-            cmd.extend(['-vcodec', 'copy'])
-
-        if self.movie.codec['audio'] == 'mp3':
-            cmd.extend(['-acodec', 'aac'])
-        else:
-            cmd.extend(['-acodec', 'copy'])
-
-        cmd.append(os.path.basename(self.outfile))
-
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            text=True, cwd=os.path.dirname(self.movie.path))
-
-        for line in p.stdout:
-            if self.event_stop.is_set():
-                p.terminate()
-                return
 
-            if line.startswith('Conversion failed!') or \
-                    line.endswith('cannot be used together.\n'):
-                print(f'{self.outfile} -- ERROR: {line}')
-                self.signaler.percentage.emit(0)
-                self.signaler.error.emit(f'ERROR: {line}')
-                os.remove(self.outfile)
-                return
+class CalibrateSignaler(QtCore.QObject):
+    finished = Signal()
 
-            match = self.regex_timestamp.search(line)
-            if match:
-                seconds = self.to_seconds(match['timestamp'])
-                percentage = 100. * seconds / self.movie.duration
-                self.signaler.percentage.emit(int(percentage))
 
-        self.signaler.percentage.emit(100)
+class CalibrateWorker(QtCore.QRunnable):
 
+    def __init__(self, costs, plans, seconds):
+        """Encode a sample of the video of each plan, see :meth:`CostModel.calibrate_once <convert_mp4.costs.CostModel.calibrate_once>`."""
+        super(CalibrateWorker, self).__init__()
+        self.costs = costs
+        self.plans = plans
+        self.seconds = seconds
+        self.signaler = CalibrateSignaler()
 
-class LoadMovieSignaler(QtCore.QObject):
-    finished = Signal(object)
+    def run(self):
+        for plan in self.plans:
+            self.costs.calibrate_once(plan, seconds=self.seconds)
+        self.signaler.finished.emit()
 
 
-class LoadMovieWorker(QtCore.QRunnable):
+class ProbeSignaler(QtCore.QObject):
+    finished = Signal(str, object, str)  # path, Movie (or None), error message
+    attached = Signal(object)  # Movie, its subtitle files have been attached
 
-    def __init__(self, path):
-        super(LoadMovieWorker, self).__init__()
-        self.path = path
-        self.signaler = LoadMovieSignaler()
-        self.finished = self.signaler.finished
 
-    def run(self):
-        self.finished.emit(Movie(self.path))
+class ScanSignaler(QtCore.QObject):
+    found = Signal(list)  # paths
+    finished = Signal(int)  # the number of videos that were found
+
+
+class ScanWorker(QtCore.QRunnable):
+
+    def __init__(self,
+                 scanner: Scanner,
+                 paths: list[str],
+                 submit: Callable[[str], bool],
+                 interval: float = 0.1) -> None:
+        """Search folders for videos and emit the paths in batches, at most every `interval` seconds.
+
+        After a batch is emitted, each path is passed to `submit` (which may
+        block, e.g., :meth:`ProbePool.submit <convert_mp4.probe.ProbePool.submit>`,
+        and that slows down the search) and the search stops if it returns false.
+        """
+        super(ScanWorker, self).__init__()
+        self.scanner = scanner
+        self.paths = paths
+        self.submit = submit
+        self.interval = interval
+        self.count = 0
+        self.signaler = ScanSignaler()
+
+    def run(self) -> None:
+        batch = []
+        t0 = time.monotonic()
+        for path in self.scanner.scan(self.paths):
+            batch.append(path)
+            if time.monotonic() - t0 > self.interval:
+                self.flush(batch)
+                batch = []
+                t0 = time.monotonic()
+        self.flush(batch)
+        self.signaler.finished.emit(self.count)
+
+    def flush(self, batch: list[str]) -> None:
+        if not batch:
+            return
+        self.signaler.found.emit(batch)
+        for path in batch:
+            if not self.submit(path):
+                self.scanner.cancel()
+                return
+            self.count += 1
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """The databases are written to a temporary folder, not to the cache folder of the user."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('CONVERT_MP4_CACHE_DIR', str(path))
+    return path
@@ -0,0 +1,29 @@
+from convert_mp4.costs import finish_times
+
+LIMITS = {'copy': 2, 'audio': 1, 'video': 1}
+
+
+def test_finish_times_empty():
+    assert finish_times([], LIMITS) == {}
+
+
+def test_finish_times_queued():
+    jobs = [('a', 'video', 10., False), ('b', 'video', 5., False), ('c', 'video', 1., False)]
+    assert finish_times(jobs, LIMITS) == {'a': 10., 'b': 15., 'c': 16.}
+
+
+def test_finish_times_parallel_slots():
+    jobs = [('a', 'copy', 10., False), ('b', 'copy', 4., False), ('c', 'copy', 3., False), ('d', 'copy', 1., False)]
+    # c starts when b finishes, d starts when c finishes
+    assert finish_times(jobs, LIMITS) == {'a': 10., 'b': 4., 'c': 7., 'd': 8.}
+
+
+def test_finish_times_running_first():
+    # a running job occupies a slot, even if it is after a queued job
+    jobs = [('a', 'video', 10., False), ('b', 'video', 3., True)]
+    assert finish_times(jobs, LIMITS) == {'a': 13., 'b': 3.}
+
+
+def test_finish_times_kinds_are_independent():
+    jobs = [('a', 'video', 10., False), ('b', 'audio', 2., False), ('c', 'copy', 1., False)]
+    assert finish_times(jobs, LIMITS) == {'a': 10., 'b': 2., 'c': 1.}
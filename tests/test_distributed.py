@@ -0,0 +1,103 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from convert_mp4.distributed import JobClient
+from convert_mp4.distributed import JobServer
+from convert_mp4.distributed import is_loopback
+
+
+class FakeConversion:
+
+    def __init__(self, path: str, kind: str = 'video') -> None:
+        self.movie = SimpleNamespace(path=path, subtitle={})
+        self.outfile = path + '.mp4'
+        self.predicted = 1.
+        self.metrics = {}
+        self.message = ''
+        self._kind = kind
+
+    def kind(self) -> str:
+        return self._kind
+
+
+@pytest.fixture
+def server():
+    events = []
+    server = JobServer(0, on_event=lambda event, job, **kwargs: events.append((event, job.worker, kwargs)),
+                       lease_ttl=0.5, max_attempts=2, token='secret')
+    server.events = events
+    yield server
+    server.close()
+
+
+def clients(server, n=2):
+    return [JobClient(f'http://127.0.0.1:{server.port}', token='secret') for _ in range(n)]
+
+
+def test_expired_lease_is_completed_by_another_worker(server):
+    future = server.submit(FakeConversion('/videos/a.mkv'))
+    server.seal()
+    a, b = clients(server)
+
+    job = a.lease('a', ['video'])
+    assert job['path'] == '/videos/a.mkv'
+    assert b.lease('b', ['video']) is None  # leased by a
+    assert not b.finished
+
+    time.sleep(0.6)  # worker a does not send a heartbeat
+    server.expire()
+    assert not a.heartbeat(job)  # the lease was lost
+
+    requeued = b.lease('b', ['video'])
+    assert requeued['id'] == job['id']
+    assert requeued['lease'] != job['lease']
+    assert b.heartbeat(requeued, {'percentage': 50})
+    assert b.complete(requeued, 'done', {'wall': 1.}, 'ok')
+    assert not a.complete(job, 'done', {'wall': 2.})  # too late
+
+    assert future.result(5) == 'done'
+    assert server.counts == {'done': 1}
+    assert [e for e, _, _ in server.events] == ['lease', 'requeue', 'lease', 'progress', 'finish']
+    assert server.events[-1] == ('finish', 'b', {'status': 'done'})
+    assert b.lease('b', ['video']) is None
+    assert b.finished
+
+
+def test_aborted_job_is_queued_again(server):
+    future = server.submit(FakeConversion('/videos/a.mkv', kind='copy'))
+    a, b = clients(server)
+    job = a.lease('a', ['copy'])
+    assert a.complete(job, 'aborted', {})
+    job = b.lease('b', ['copy'])
+    assert job is not None
+    assert b.complete(job, 'aborted', {})  # the second attempt
+    assert future.result(5) == 'failed'
+    assert server.counts == {'failed': 1}
+
+
+def test_lease_by_kind_and_priority(server):
+    server.submit(FakeConversion('/videos/slow.mkv'), priority=2.)
+    server.submit(FakeConversion('/videos/fast.mkv'), priority=1.)
+    server.submit(FakeConversion('/videos/copy.mkv', kind='copy'), priority=3.)
+    a, = clients(server, 1)
+    assert a.lease('a', ['audio']) is None
+    assert a.lease('a', ['copy', 'video'])['path'] == '/videos/fast.mkv'
+    assert a.lease('a', ['copy', 'video'])['path'] == '/videos/slow.mkv'
+    assert a.lease('a', ['copy', 'video'])['path'] == '/videos/copy.mkv'
+
+
+def test_token_required(server):
+    client = JobClient(f'http://127.0.0.1:{server.port}', token='wrong')
+    with pytest.raises(PermissionError):
+        client.lease('a', ['video'])
+
+
+def test_host_requires_token():
+    assert is_loopback('localhost')
+    assert is_loopback('127.0.0.1')
+    assert is_loopback('::1')
+    assert not is_loopback('0.0.0.0')
+    with pytest.raises(ValueError, match='server_token'):
+        JobServer(0, host='0.0.0.0')
@@ -0,0 +1,91 @@
+import os
+import threading
+
+from convert_mp4 import fingerprint as module
+from convert_mp4.fingerprint import FingerprintIndex
+from convert_mp4.fingerprint import fingerprint
+
+INFO = {'duration': 5.0, 'streams': [['video', 'h264'], ['audio', 'aac']]}
+
+
+def write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_fingerprint(tmp_path):
+    small = write(tmp_path / 'small.mkv', b'a' * 1000)
+    copy = write(tmp_path / 'copy.mkv', b'a' * 1000)
+    other = write(tmp_path / 'other.mkv', b'b' * 1000)
+    assert fingerprint(small) == fingerprint(copy)
+    assert fingerprint(small) != fingerprint(other)
+    assert fingerprint(small).startswith(f'{1000:x}-')
+
+
+def test_fingerprint_samples(tmp_path):
+    data = bytearray(64 * 1024 * 16)
+    a = write(tmp_path / 'a.mkv', bytes(data))
+    data[64 * 1024 * 8 + 100] = 1  # between the chunks that are read
+    b = write(tmp_path / 'b.mkv', bytes(data))
+    data[-1] = 1  # the last chunk is read
+    c = write(tmp_path / 'c.mkv', bytes(data))
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(a) != fingerprint(c)
+
+
+def test_index_fingerprint_cached(tmp_path, monkeypatch):
+    path = write(tmp_path / 'movie.mkv', b'a' * 1000)
+    index = FingerprintIndex()
+    value = index.fingerprint(path)
+    index.close()
+
+    calls = []
+    monkeypatch.setattr(module, 'fingerprint', lambda p: calls.append(p) or 'changed')
+    index = FingerprintIndex()
+    assert index.fingerprint(path) == value
+    assert calls == []
+    write(tmp_path / 'movie.mkv', b'a' * 1001)
+    assert index.fingerprint(path) == 'changed'
+    assert calls == [path]
+    index.close()
+
+
+def test_index_outputs(tmp_path):
+    output = write(tmp_path / 'movie.mp4', b'output')
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.sqlite3'))
+    assert index.get(output) is None
+    index.record(output, INFO, '/videos/movie.mkv', fingerprint='f', recipe='r', rendition=1)
+    index.record(str(tmp_path / 'missing.mp4'), INFO, '/videos/missing.mkv')  # ignored
+    index.close()
+
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.sqlite3'))
+    expected = {'output': output, 'source': '/videos/movie.mkv', 'fingerprint': 'f', 'recipe': 'r',
+                'rendition': 1, **INFO}
+    assert index.get(output) == expected
+    assert index.find('f', 'r', 1) == expected
+    assert index.find('f', 'r', 0) is None
+    assert index.find('f', 'other recipe', 1) is None
+
+    # an output that changed since it was recorded is not valid
+    write(tmp_path / 'movie.mp4', b'changed output')
+    assert index.get(output) is None
+    assert index.find('f', 'r', 1) is None
+    os.remove(output)
+    assert index.get(output) is None
+    index.close()
+
+
+def test_index_claim(tmp_path):
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.sqlite3'))
+    key = ('f', 'r')
+    assert index.claim(key, 0)
+    assert not index.claim(key, 0.01)
+    assert index.claim(('f', 'other recipe'), 0)
+
+    claimed = []
+    thread = threading.Thread(target=lambda: claimed.append(index.claim(key, 5)))
+    thread.start()
+    index.release(key)
+    thread.join()
+    assert claimed == [True]
+    index.close()
@@ -0,0 +1,59 @@
+import os
+import time
+
+from convert_mp4.journal import Journal
+
+
+def test_journal_round_trip(cache_dir):
+    journal = Journal()
+    assert os.path.dirname(journal.path) == str(cache_dir)
+    subtitle = {'index': None, 'codec': None, 'path': '/videos/a.srt', 'burn': True}
+    journal.queue('/videos/a.mkv', '/videos/a.mp4', subtitle)
+    journal.queue('/videos/b.mkv', '/videos/b.mp4', {})
+    journal.update('/videos/b.mkv', 'running')
+    journal.close()
+
+    journal = Journal()
+    job = journal.get('/videos/a.mkv')
+    assert job['output'] == '/videos/a.mp4'
+    assert job['state'] == 'queued'
+    assert job['subtitle'] == subtitle
+    assert job['message'] == ''
+    assert [job['path'] for job in journal.unfinished()] == ['/videos/a.mkv', '/videos/b.mkv']
+    assert journal.is_output('/videos/a.mp4')
+    assert not journal.is_output('/videos/a.mkv')
+    assert journal.get('/videos/c.mkv') is None
+
+    journal.update('/videos/a.mkv', 'failed', 'cannot probe')
+    assert journal.get('/videos/a.mkv')['message'] == 'cannot probe'
+    assert [job['path'] for job in journal.unfinished()] == ['/videos/b.mkv']
+    journal.close()
+
+
+def test_journal_requeue(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.sqlite3'))
+    journal.queue('/videos/a.mkv', '/videos/a.mp4', None)
+    journal.update('/videos/a.mkv', 'done')
+    journal.queue('/videos/a.mkv', '/videos/a_720p.mp4', {})
+    job = journal.get('/videos/a.mkv')
+    assert job['state'] == 'queued'
+    assert job['output'] == '/videos/a_720p.mp4'
+    assert job['subtitle'] == {}
+    journal.close()
+
+
+def test_journal_keep_days(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = Journal(path)
+    for name in ('done', 'aborted', 'queued', 'running'):
+        journal.queue(f'/videos/{name}.mkv', f'/videos/{name}.mp4', {})
+        journal.update(f'/videos/{name}.mkv', name)
+    with journal.connection:
+        journal.connection.execute('UPDATE jobs SET updated=?', (time.time() - 2 * 86400,))
+    journal.close()
+
+    journal = Journal(path, keep_days=1)  # the finished jobs are removed, the unfinished jobs are kept
+    assert journal.get('/videos/done.mkv') is None
+    assert journal.get('/videos/aborted.mkv') is None
+    assert sorted(job['state'] for job in journal.unfinished()) == ['queued', 'running']
+    journal.close()
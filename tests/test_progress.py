@@ -0,0 +1,79 @@
+from convert_mp4 import progress
+from convert_mp4.progress import Progress
+from convert_mp4.progress import ProgressParser
+from convert_mp4.progress import Throttle
+
+BLOCK = """frame=250
+fps=49.8
+stream_0_0_q=28.0
+bitrate=1024.5kbits/s
+total_size=1280000
+out_time_us=10000000
+out_time_ms=10000000
+out_time=00:00:10.000000
+dup_frames=0
+drop_frames=0
+speed=1.99x
+progress=continue
+"""
+
+
+def feed(parser: ProgressParser, text: str) -> list:
+    return [p for p in map(parser.feed, text.splitlines(keepends=True)) if p is not None]
+
+
+def test_parser_block():
+    parser = ProgressParser(duration=40)
+    snapshots = feed(parser, BLOCK)
+    assert snapshots == [Progress(duration=40, out_time=10., fps=49.8, speed=1.99, total_size=1280000)]
+    info = snapshots[0]
+    assert info.percentage == 25
+    assert info.eta == 30. / 1.99
+
+
+def test_parser_end():
+    parser = ProgressParser(duration=40)
+    first, last = feed(parser, BLOCK + BLOCK.replace('progress=continue', 'progress=end'))
+    assert not first.done
+    assert last.done
+    assert last.percentage == 100
+    assert last.eta == 0.
+    assert first is not last  # a snapshot is not changed by the next block
+
+
+def test_parser_not_available():
+    parser = ProgressParser(duration=40)
+    info, = feed(parser, 'out_time_us=N/A\nfps=N/A\nspeed=N/A\ntotal_size=N/A\nprogress=continue\n')
+    assert info == Progress(duration=40)
+    assert info.percentage == 0
+    assert info.eta == -1.
+
+
+def test_parser_negative_out_time():
+    parser = ProgressParser(duration=40)
+    info, = feed(parser, 'out_time_us=-1500\nprogress=continue\n')
+    assert info.out_time == 0.
+
+
+def test_parser_ignores_other_lines():
+    parser = ProgressParser(duration=40)
+    assert feed(parser, 'not a key value pair\n\nbitrate=N/A\n') == []
+
+
+def test_percentage_is_below_100_until_done():
+    assert Progress(duration=10, out_time=12).percentage == 99
+    assert Progress(duration=0, out_time=12).percentage == 0
+
+
+def test_throttle(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(progress.time, 'monotonic', lambda: now[0])
+    throttle = Throttle(interval=0.25)
+    assert throttle.ready(1)
+    assert not throttle.ready(1)  # unchanged
+    now[0] += 0.1
+    assert not throttle.ready(2)  # too soon
+    assert throttle.ready(2, force=True)
+    assert not throttle.ready(2, force=True)  # unchanged, even if forced
+    now[0] += 0.25
+    assert throttle.ready(3)
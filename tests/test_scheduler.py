@@ -0,0 +1,24 @@
+import pytest
+
+from convert_mp4.scheduler import AUDIO
+from convert_mp4.scheduler import COPY
+from convert_mp4.scheduler import VIDEO
+from convert_mp4.scheduler import classify
+
+
+@pytest.mark.parametrize('options, kind', [
+    (['-c', 'copy'], COPY),
+    (['-c:v', 'copy', '-c:a', 'copy'], COPY),
+    (['-vcodec', 'copy', '-acodec', 'copy'], COPY),
+    (['-c:v', 'copy', '-c:a', 'aac'], AUDIO),
+    (['-c:v', 'copy', '-c:a:0', 'copy', '-c:a:1', 'aac'], AUDIO),
+    (['-acodec', 'aac'], AUDIO),
+    (['-c:v', 'libx264', '-c:a', 'copy'], VIDEO),
+    (['-c:v:0', 'libx264', '-c:a', 'aac'], VIDEO),
+    (['-vcodec', 'libx264'], VIDEO),
+    (['-c:v', 'copy', '-vf', 'subtitles=movie.srt'], VIDEO),
+    (['-filter_complex', '[0:v]scale=1280:-2[v]', '-c:v', 'copy'], VIDEO),
+])
+def test_classify(options, kind):
+    assert classify(['ffmpeg', '-i', 'movie.mkv', *options, 'movie.mp4']) == kind
+
@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from convert_mp4 import segments
+from convert_mp4.conversion import Conversion
+from convert_mp4.movie import Movie
+from convert_mp4.probe import ffprobe
+from convert_mp4.segments import SegmentedEncode
+from convert_mp4.segments import split_points
+
+
+def encoders() -> str:
+    if shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None:
+        return ''
+    return subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+
+
+requires_ffmpeg = pytest.mark.skipif(
+    not all(e in encoders() for e in ('libx264', 'libx265')),
+    reason='requires ffmpeg with libx264 and libx265'
+)
+
+
+def test_split_points_nearest_keyframe():
+    keys = [float(t) for t in range(0, 60, 2)]
+    assert split_points(keys, 60, 4) == [0., 14., 30., 44.]
+    assert split_points(keys, 60, 1) == [0.]
+
+
+def test_split_points_no_keyframes():
+    assert split_points([], 60, 4) == [0.]
+
+
+def test_split_points_not_repeated():
+    # the nearest keyframe to several targets only starts one segment
+    assert split_points([0., 50.], 60, 4) == [0., 50.]
+
+
+def test_split_points_min_length():
+    keys = [0., 1., 29., 59.5]
+    assert split_points(keys, 60, 4, min_length=0) == [0., 1., 29., 59.5]
+    assert split_points(keys, 60, 4, min_length=1) == [0., 1., 29.]
+    assert split_points(keys, 60, 4, min_length=5) == [0., 29.]
+    assert split_points(keys, 60, 4, min_length=60) == [0.]
+
+
+def test_split_relative_to_start_time(tmp_path, monkeypatch):
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(b'\0' * 100)
+    movie = SimpleNamespace(path=str(path), duration=40., metadata={'format': {'start_time': '10.5'}})
+    encode = SegmentedEncode(SimpleNamespace(movie=movie), str(tmp_path / 'movie.mp4'), 4)
+
+    calls = []
+
+    def keyframes(p):
+        calls.append(p)
+        return [10.5 + t for t in range(0, 40, 5)]
+
+    monkeypatch.setattr(segments, 'keyframes', keyframes)
+    assert encode.start_time() == 10.5
+    assert encode.split() == [0., 10., 20., 30.]
+
+    # the saved points are used again, unless the start time changed
+    assert encode.split() == [0., 10., 20., 30.]
+    assert len(calls) == 1
+    movie.metadata['format']['start_time'] = '0'
+    assert encode.split() == [0., 10.5, 20.5, 30.5]
+    assert len(calls) == 2
+
+
+def make_hevc(path: str, duration: int) -> None:
+    subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size=320x240:rate=25',
+                    '-f', 'lavfi', '-i', f'sine=duration={duration}',
+                    '-c:v', 'libx265', '-preset', 'ultrafast', '-g', '25', '-x265-params', 'log-level=error',
+                    '-c:a', 'aac', path], check=True)
+
+
+def layout(path: str) -> tuple:
+    metadata = ffprobe(path)
+    streams = tuple((s['codec_type'], s['codec_name']) for s in metadata['streams'])
+    return float(metadata['format']['duration']), streams
+
+
+@requires_ffmpeg
+def test_segmented_matches_single_pass(tmp_path):
+    single = str(tmp_path / 'single.mkv')
+    make_hevc(single, 12)
+    segmented = str(tmp_path / 'segmented.mkv')
+    shutil.copyfile(single, segmented)
+
+    assert Conversion(Movie(single), config={}).run() == 'done'
+    conversion = Conversion(Movie(segmented), config={'segments': 3, 'segment_min_duration': 0})
+    assert conversion.is_segmented()
+    assert conversion.run() == 'done'
+    assert conversion.segmented
+    assert not os.path.isdir(str(tmp_path / 'segmented.mp4.segments'))
+
+    d_single, s_single = layout(str(tmp_path / 'single.mp4'))
+    d_segmented, s_segmented = layout(str(tmp_path / 'segmented.mp4'))
+    assert s_segmented == s_single == (('video', 'h264'), ('audio', 'aac'))
+    assert d_segmented == pytest.approx(d_single, abs=0.1)
+
+
+def test_cover_art_is_not_the_video(tmp_path):
+    # the mjpeg cover art is the last video stream
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(b'\0' * 100)
+    metadata = {
+        'format': {'duration': '600'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'hevc', 'width': 1920, 'height': 1080},
+            {'codec_type': 'audio', 'codec_name': 'aac'},
+            {'codec_type': 'video', 'codec_name': 'mjpeg', 'disposition': {'attached_pic': 1}},
+        ],
+    }
+    cache = SimpleNamespace(get=lambda p, stat: (metadata, []))
+    conversion = Conversion(Movie(str(path), cache=cache), config={'segments': 4})
+    assert conversion.required() == ('video',)
+    assert conversion.is_segmented()
+
+    metadata['streams'][0]['disposition'] = {'attached_pic': 1}  # an audio file with cover art
+    assert conversion.required() == ()
+    assert not conversion.is_segmented()
@@ -0,0 +1,110 @@
+import os
+
+from convert_mp4.sidecars import SidecarIndex
+from convert_mp4.sidecars import is_under
+from convert_mp4.sidecars import keys
+from convert_mp4.sidecars import sidecar_keys
+
+
+def test_keys():
+    assert keys('Movie (2010)') == {'movie (2010)', 'movie'}
+    assert keys('Movie (2010).en') == {'movie (2010).en', 'movie (2010)', 'movie'}
+    assert keys('Movie (2010)_eng') == {'movie (2010)_eng', 'movie (2010)', 'movie'}
+    assert keys('Movie (2010)-English') == {'movie (2010)-english', 'movie (2010)', 'movie'}
+    assert keys('Movie (2010) English') == {'movie (2010) english', 'movie (2010)', 'movie'}
+
+
+def test_keys_normalized():
+    assert keys('  The.Movie ') == {'the.movie', 'the'}
+    assert keys('ÉCOLE') == {'école'}
+
+
+def test_keys_leading_separator():
+    # a name that starts with a separator does not have an empty key
+    assert keys('.hidden') == {'.hidden'}
+    assert keys('_a_b') == {'_a_b', '_a'}
+
+
+def test_sidecar_keys():
+    path = os.path.join(os.sep, 'videos', 'Show.S01', 'Subs', 'English.srt')
+    assert sidecar_keys(path) == {'english', 'subs', 'show.s01', 'show', 'videos'}
+
+
+def test_is_under():
+    root = os.path.join(os.sep, 'videos', 'a')
+    assert is_under(root, root)
+    assert is_under(os.path.join(root, 'b'), root)
+    assert not is_under(root + 'b', root)
+    assert not is_under(os.path.dirname(root), root)
+
+
+def touch(*parts) -> str:
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    return path
+
+
+def test_index_find(tmp_path):
+    root = str(tmp_path)
+    same = touch(root, 'Movie.srt')
+    english = touch(root, 'Movie.en.srt')
+    folder = touch(root, 'Movie', 'English.srt')
+    touch(root, 'Other.srt')
+    touch(root, 'Movie.txt')
+
+    index = SidecarIndex()
+    index.add_root(root)
+    assert len(index) == 4
+    assert index.is_indexed(os.path.join(root, 'Movie'))
+    assert index.find(root, 'Movie') == sorted([same, english, folder])
+    assert index.find(os.path.join(root, 'Movie'), 'Movie') == [folder]
+    assert index.find(root, 'Unknown') == []
+
+
+def test_index_add_file_and_forget(tmp_path):
+    root = str(tmp_path)
+    index = SidecarIndex()
+    index.add_root(root)
+    assert index.find(root, 'Movie') == []
+    path = touch(root, 'Movie.srt')
+    index.add_file(path)
+    assert index.find(root, 'Movie') == [path]
+    index.forget(root)
+    assert len(index) == 0
+    assert not index.is_indexed(root)
+
+
+def test_when_indexed_not_scanning(tmp_path):
+    # the folder is walked by the calling thread
+    path = touch(str(tmp_path), 'Movie.srt')
+    index = SidecarIndex()
+    found = []
+    index.when_indexed(str(tmp_path), lambda: found.append(index.find(str(tmp_path), 'Movie')))
+    assert found == [[path]]
+
+
+def test_when_indexed_scanning(tmp_path):
+    root = str(tmp_path)
+    folder = os.path.join(root, 'a')
+    index = SidecarIndex()
+    index.begin(root)
+    found = []
+    index.when_indexed(folder, lambda: found.append(index.find(folder, 'Movie')))
+    assert found == []  # the folder has not been indexed
+    index.add(os.path.join(folder, 'b'), [os.path.join(folder, 'b', 'Movie.srt')])
+    assert found == []  # only a sub-folder has been indexed
+    index.add(folder, [os.path.join(folder, 'Movie.srt')])
+    assert found == [[os.path.join(folder, 'Movie.srt'), os.path.join(folder, 'b', 'Movie.srt')]]
+    index.end(root)
+
+
+def test_when_indexed_scan_stopped(tmp_path):
+    root = str(tmp_path)
+    index = SidecarIndex()
+    index.begin(root)
+    called = []
+    index.when_indexed(root, lambda: called.append(True))
+    index.end(root)  # e.g., the scan was cancelled
+    assert called == [True]
+    assert index.waiting == {}
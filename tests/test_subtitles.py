@@ -0,0 +1,89 @@
+from convert_mp4 import subtitles
+from convert_mp4.subtitles import ass_cues
+from convert_mp4.subtitles import ass_time
+from convert_mp4.subtitles import preview
+from convert_mp4.subtitles import srt_cues
+
+SRT = """﻿1\r
+00:00:01,000 --> 00:00:02,000\r
+Hello\r
+\r
+2\r
+00:00:03,000 --> 00:00:04,000\r
+Two\r
+lines\r
+\r
+\r
+3\r
+00:00:05,000 --> 00:00:06,000\r
+Last"""
+
+ASS = """[Script Info]
+Title: Example
+Format: not an event
+
+[V4+ Styles]
+Format: Name, Fontname
+Style: Default,Arial
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Comment: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,not shown
+Dialogue: 0,0:00:01.50,0:00:02.00,Default,,0,0,0,,{\\i1}Hello{\\i0}, world
+Dialogue: 0,1:02:03.04,1:02:05.00,Default,,0,0,0,,Two\\Nlines
+Dialogue: 0,bad,0:00:06.00,Default,,0,0,0,,Skipped
+Dialogue: 0,0:00:07.00,0:00:08.00,Default,,0,0,0,,Last
+"""
+
+
+def test_srt_cues():
+    lines = SRT.splitlines(keepends=True)
+    assert srt_cues(lines, 10) == [
+        '1\n00:00:01,000 --> 00:00:02,000\nHello\n\n',
+        '2\n00:00:03,000 --> 00:00:04,000\nTwo\nlines\n\n',
+        '3\n00:00:05,000 --> 00:00:06,000\nLast\n',
+    ]
+
+
+def test_srt_cues_limit():
+    def lines():
+        yield from SRT.splitlines(keepends=True)
+        raise AssertionError('read beyond the limit')
+
+    assert len(srt_cues(lines(), 2)) == 2
+
+
+def test_ass_time():
+    assert ass_time('0:00:01.50') == '00:00:01,500'
+    assert ass_time('1:02:03.04') == '01:02:03,040'
+    assert ass_time('0:00:07') == '00:00:07,000'
+
+
+def test_ass_cues():
+    assert ass_cues(ASS.splitlines(), 10) == [
+        '1\n00:00:01,500 --> 00:00:02,000\nHello, world\n\n',
+        '2\n01:02:03,040 --> 01:02:05,000\nTwo\nlines\n\n',
+        '3\n00:00:07,000 --> 00:00:08,000\nLast\n\n',
+    ]
+    assert len(ass_cues(ASS.splitlines(), 1)) == 1
+
+
+def test_ass_cues_without_format():
+    assert ass_cues(['[Events]', 'Dialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,Hello'], 10) == []
+
+
+def test_preview_sidecar_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(subtitles, 'cache', subtitles.LRUCache())
+    path = tmp_path / 'movie.srt'
+    path.write_text(SRT, encoding='utf-8')
+    info = {'index': None, 'codec': None, 'path': str(path)}
+    cues = preview(str(tmp_path / 'movie.mkv'), info, limit=1)
+    assert cues == ['1\n00:00:01,000 --> 00:00:02,000\nHello\n\n']
+    assert preview(str(tmp_path / 'movie.mkv'), info, limit=1) is cues
+
+
+def test_preview_picture_based_stream(tmp_path):
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(b'\0')
+    info = {'index': 0, 'codec': 'hdmv_pgs_subtitle', 'path': None}
+    assert preview(str(path), info) == ['Picture-based hdmv_pgs_subtitle']
@@ -0,0 +1,44 @@
+from convert_mp4.telemetry import Telemetry
+
+
+def conversion(telemetry: Telemetry, status: str, **fields) -> dict:
+    record = {
+        'status': status, 'wall': 2., 'queue_wait': 1., 'cpu_time': 3.,
+        'input_bytes': 1000, 'output_bytes': 500, 'media_seconds': 60.,
+    }
+    record.update(fields)
+    return telemetry.record('conversion', **record)
+
+
+def test_summary():
+    telemetry = Telemetry()
+    telemetry.record('probe', wall=1., cached=False)
+    telemetry.record('probe', wall=0., cached=True)
+    conversion(telemetry, 'done')
+    conversion(telemetry, 'failed', queue_wait=3., cpu_time=None)
+    summary = telemetry.summary()
+    assert summary['conversions'] == {'done': 1, 'failed': 1}
+    assert summary['probes'] == 2
+    assert summary['probe_cached'] == 1
+    assert summary['probe_wall_mean'] == 0.5
+    assert summary['queue_wait_mean'] == 2.
+    assert summary['cpu_time'] == 3.
+    assert summary['input_bytes'] == 1000  # only the conversions that are done
+    assert summary['output_bytes'] == 500
+    assert summary['media_seconds'] == 60.
+
+
+def test_start_batch():
+    telemetry = Telemetry()
+    telemetry.record('probe', wall=1., cached=False)
+    conversion(telemetry, 'done')
+    telemetry.start_batch()
+    summary = telemetry.summary()
+    assert summary['conversions'] == {}
+    assert summary['probes'] == 0
+    assert summary['probe_wall_mean'] == 0.
+    assert summary['input_bytes'] == 0
+    conversion(telemetry, 'skipped')
+    assert telemetry.summary()['conversions'] == {'skipped': 1}
+    # the Prometheus counters are totals since the start
+    assert 'convert_mp4_jobs_total{event="conversion",status="done"} 1' in telemetry.prometheus()
@@ -0,0 +1,76 @@
+import re
+import sys
+import threading
+
+import pytest
+
+from convert_mp4.watch import Inotify
+from convert_mp4.watch import Watcher
+from convert_mp4.watch import is_output
+
+EXTENSIONS = ['avi', 'mkv', 'mp4']
+
+
+def touch(path) -> str:
+    open(path, 'w').close()
+    return str(path)
+
+
+def test_is_output_of_a_video(tmp_path):
+    touch(tmp_path / 'Movie.mkv')
+    assert is_output(touch(tmp_path / 'Movie.mp4'), EXTENSIONS)
+    assert is_output(str(tmp_path / 'Movie.MP4'), EXTENSIONS)
+
+
+def test_is_not_output(tmp_path):
+    assert not is_output(touch(tmp_path / 'Movie.mp4'), EXTENSIONS)  # no video with the same name
+    touch(tmp_path / 'Movie.mkv')
+    assert not is_output(str(tmp_path / 'Movie.mkv'), EXTENSIONS)  # not an MP4
+    assert not is_output(str(tmp_path / 'Movie.mp4'), ['mp4'])  # only the extensions of the videos
+
+
+def test_is_output_of_an_mp4(tmp_path):
+    # an MP4 is converted to "<name>_(copy).mp4"
+    assert is_output(str(tmp_path / 'Movie_(copy).mp4'), EXTENSIONS)
+
+
+def test_is_output_rendition(tmp_path):
+    touch(tmp_path / 'Movie.avi')
+    assert is_output(str(tmp_path / 'Movie_720p.mp4'), EXTENSIONS, ['_720p'])
+    assert not is_output(str(tmp_path / 'Movie_720p.mp4'), EXTENSIONS, ['_480p'])
+    assert is_output(str(tmp_path / 'Movie_(copy)_720p.mp4'), EXTENSIONS, ['_720p'])
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify requires Linux')
+def test_watcher_rescans_in_inotify_mode(tmp_path, monkeypatch):
+    # like a network share, the folder is watched but the writes of other computers are not reported
+    monkeypatch.setattr(Inotify, 'add_watch', lambda self, directory: None)
+    watcher = Watcher(str(tmp_path), re.compile(r'\.mkv$'), settle=0, interval=0.1)
+    assert watcher.mode == 'inotify'
+
+    scanned = threading.Event()
+    rescan = watcher.rescan
+
+    def searched():
+        rescan()
+        scanned.set()
+
+    monkeypatch.setattr(watcher, 'rescan', searched)
+
+    found = threading.Event()
+    paths = []
+
+    def callback(path):
+        paths.append(path)
+        found.set()
+
+    thread = threading.Thread(target=watcher.run, args=(callback,))
+    thread.start()
+    try:
+        assert scanned.wait(5)  # the file is written after the folder was searched when watching started
+        touch(tmp_path / 'Movie.mkv')
+        assert found.wait(5)
+    finally:
+        watcher.stop()
+        thread.join(5)
+    assert paths == [str(tmp_path / 'Movie.mkv')]